@@ -0,0 +1,2 @@
+###############################################################
+# Benchmarks of shlerp, run with: python -m benchmarks.run
@@ -0,0 +1,159 @@
+###############################################################
+# This file features the synthetic project generator used by
+# the benchmarks. Each shape mimics a kind of project described
+# in rules.json, the content only depends on the shape, the size
+# and the seed, so the same tree is generated on every run.
+
+import random
+import shutil
+import os
+
+# Multiplier applied to the number of files of each shape
+SIZES = {'small': 1, 'medium': 5, 'large': 25}
+
+# Tokens the text files are made of, so that they compress like source code
+WORDS = [
+    'def', 'class', 'return', 'import', 'from', 'const', 'let', 'function', 'public', 'private',
+    'static', 'void', 'self', 'this', 'if', 'else', 'for', 'while', 'in', 'new', 'null', 'None',
+    'true', 'false', 'value', 'index', 'item', 'result', 'data', 'config', 'name', 'path', '=',
+    '(', ')', '{', '}', '[', ']', ';', ':', ',', '.', '+', '-', '*', '0', '1', '42', "'text'"
+]
+
+
+def text(rng, lines):
+    """
+    :param rng: random.Random of the shape being generated
+    :param lines: number of lines
+    :return: text looking like source code
+    """
+    return '\n'.join(
+        ' ' * (4 * rng.randint(0, 3)) + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        for _ in range(lines)
+    ) + '\n'
+
+
+def write(root, rel_path, content):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb' if isinstance(content, bytes) else 'w') as write_file:
+        write_file.write(content)
+
+
+def sources(rng, root, rel_fld, count, ext, lines=(20, 200)):
+    """Writes text files spread over a few sub-folders
+    :param count: number of files
+    :param ext: text, the extension of the files
+    :param lines: tuple (min, max) number of lines per file
+    """
+    for index in range(count):
+        sub_fld = f'mod{index // 50}' if count > 50 else ''
+        write(root, os.path.join(rel_fld, sub_fld, f'file{index}{ext}'), text(rng, rng.randint(*lines)))
+
+
+def blobs(rng, root, rel_fld, count, size, ext):
+    """Writes binary files that don't compress, like images or build outputs
+    :param size: tuple (min, max) size of the files in bytes
+    """
+    for index in range(count):
+        blob_size = rng.randint(*size)
+        write(root, os.path.join(rel_fld, f'blob{index}{ext}'), rng.getrandbits(blob_size * 8).to_bytes(blob_size, 'little'))
+
+
+def node_modules(rng, root, packages, files):
+    """Writes a node_modules folder, with nested dependencies like npm does"""
+    for index in range(packages):
+        pkg = f'node_modules/pkg{index}'
+        write(root, f'{pkg}/package.json', f'{{"name": "pkg{index}", "version": "1.0.{index}"}}\n')
+        sources(rng, root, f'{pkg}/lib', files, '.js', (5, 60))
+        if index % 5 == 0:
+            sources(rng, root, f'{pkg}/node_modules/dep{index}/lib', files // 2 or 1, '.js', (5, 60))
+
+
+#####################
+# Shapes
+
+def ionic(rng, root, scale):
+    write(root, 'ionic.config.json', '{"name": "app", "integrations": {"cordova": {}}, "type": "angular"}\n')
+    write(root, 'package.json', '{"name": "app", "dependencies": {"@ionic/angular": "^7.0.0"}}\n')
+    sources(rng, root, 'src/app', 40 * scale, '.ts')
+    sources(rng, root, 'platforms/android', 20 * scale, '.java')
+    node_modules(rng, root, 60 * scale, 20)
+
+
+def react_native(rng, root, scale):
+    write(root, 'package.json', '{"name": "app", "dependencies": {"react-native": "0.73.0"}}\n')
+    write(root, '.expo-shared/assets.json', '{}\n')
+    sources(rng, root, 'src', 50 * scale, '.jsx')
+    blobs(rng, root, 'assets', 10 * scale, (10000, 200000), '.png')
+    node_modules(rng, root, 80 * scale, 20)
+
+
+def laravel(rng, root, scale):
+    write(root, 'artisan', '#!/usr/bin/env php\n<?php\n')
+    write(root, 'composer.json', '{"require": {"laravel/framework": "^10.0"}}\n')
+    write(root, '.env', 'APP_KEY=secret\n')
+    sources(rng, root, 'app', 60 * scale, '.php')
+    sources(rng, root, 'resources/views', 30 * scale, '.php')
+    sources(rng, root, 'storage/logs', 5 * scale, '.log', (200, 2000))
+    for index in range(40 * scale):
+        sources(rng, root, f'vendor/vendor{index}/src', 15, '.php', (10, 100))
+
+
+def rust(rng, root, scale):
+    write(root, 'Cargo.toml', '[package]\nname = "app"\nversion = "0.1.0"\n')
+    write(root, 'Cargo.lock', text(rng, 200))
+    sources(rng, root, 'src', 60 * scale, '.rs')
+    blobs(rng, root, 'target/debug/deps', 40 * scale, (50000, 500000), '.rlib')
+    sources(rng, root, 'target/debug/build', 100 * scale, '.d', (2, 10))
+
+
+def java_deep(rng, root, scale):
+    write(root, 'pom.xml', '<project><parent><artifactId>spring-boot-starter-parent</artifactId></parent></project>\n')
+    write(root, 'src/Application.java', text(rng, 30))
+    package = 'src/main/java/com/example/company/product/module/feature/core/internal/impl'
+    for depth in range(1, package.count('/') + 1):
+        fld = '/'.join(package.split('/')[:depth + 1])
+        sources(rng, root, fld, 8 * scale, '.java')
+    blobs(rng, root, 'target/classes', 30 * scale, (1000, 20000), '.class')
+
+
+def assets(rng, root, scale):
+    write(root, 'app.py', 'from flask import Flask\n')
+    write(root, 'requirements.txt', 'flask\n')
+    sources(rng, root, 'templates', 20 * scale, '.html')
+    blobs(rng, root, 'static/img', 30 * scale, (200000, 2000000), '.jpg')
+    blobs(rng, root, 'static/video', 2 * scale, (2000000, 8000000), '.mp4')
+
+
+def tiny_files(rng, root, scale):
+    write(root, 'main.py', 'print(1)\n')
+    sources(rng, root, 'src', 2000 * scale, '.py', (1, 3))
+
+
+SHAPES = {
+    'ionic': ionic,
+    'react_native': react_native,
+    'laravel': laravel,
+    'rust': rust,
+    'java_deep': java_deep,
+    'assets': assets,
+    'tiny_files': tiny_files
+}
+
+
+def generate(shape, size, dst_fld, seed=0):
+    """Generates a synthetic project, unless it has already been generated
+    :param shape: text, one of the SHAPES keys
+    :param size: text, one of the SIZES keys
+    :param dst_fld: text, the folder the project is generated into
+    :param seed: number, changes the content of the files
+    :return: the path of the project
+    """
+    root = os.path.join(dst_fld, f'{shape}_{size}_{seed}')
+    if not os.path.isdir(root):
+        # Generated aside then renamed, so that an interrupted generation is never reused
+        tmp_root = f'{root}.tmp'
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        SHAPES[shape](random.Random(f'{shape}-{size}-{seed}'), tmp_root, SIZES[size])
+        os.replace(tmp_root, root)
+    return root
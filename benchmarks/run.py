@@ -0,0 +1,261 @@
+###############################################################
+# This file features the benchmark runner. The synthetic
+# projects are generated once, then auto_detect, make_archive
+# and duplicate are timed on each of them. The results can be
+# saved as a baseline, the next runs are compared with it.
+# The startup of shlerp is also timed, against a fixed budget.
+#
+# python -m benchmarks.run --size small --baseline benchmarks/baseline.json
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.generate import SHAPES, SIZES, generate
+from shlerp.tools.state import set_state, activate_headless
+from shlerp.tools.exclusions import compile_exclusions
+from shlerp.tools.archive import default_jobs
+from shlerp.tools import copy as copier
+from shlerp.tools import utils
+from shlerp.tools import stats
+from shlerp.main import auto_detect, make_archive, duplicate
+import subprocess
+import platform
+import tempfile
+import shutil
+import click
+import time
+import json
+
+RESULTS_VERSION = 1
+# Relative slowdown reported as a regression when comparing with the baseline
+REGRESSION_THRESHOLD = 0.10
+# Slowdowns under this number of seconds are noise, whatever their relative value
+REGRESSION_MIN_SECONDS = 0.01
+# Seconds shlerp may take, from the start of the interpreter to its exit, to show its help and to copy a one-file project.
+# cron runs shlerp once per project, the startup is paid every time.
+STARTUP_BUDGET = {'help': 0.25, 'copy': 0.5}
+
+
+def backup_options(archive_format):
+    """
+    :param archive_format: text, the format of the archives
+    :return: the options shlerp uses when none is given on the command line
+    """
+    return {
+        'noexcl': False,
+        'nogit': False,
+        'keephidden': False,
+        'gitignore': False,
+        'jobs': default_jobs(),
+        'copy_jobs': copier.default_jobs(),
+        'format': archive_format,
+        'level': None,
+        'incremental': False,
+        'link_dest': False,
+        'mirror': False
+    }
+
+
+def best_time(func, repeat, cleanup=None):
+    """
+    :param func: function to time, called without arguments
+    :param repeat: number of runs, the fastest one is kept to leave out the noise
+    :param cleanup: function called after each run, outside of the timing
+    :return: a tuple (fastest time in seconds, value returned by the last run)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        if cleanup:
+            cleanup()
+    return best, result
+
+
+def detect(proj_fld):
+    """Runs the detection on a project, counting what it goes through
+    :param proj_fld: text, the project folder
+    :return: a tuple (matched rules, dictionary/object with the number of "files" the detection went through)
+    """
+    project = stats.project_report(proj_fld)
+    project['counters'].clear()
+    with stats.for_project(proj_fld):
+        rules = auto_detect(proj_fld)
+    # The detection doesn't read the files, only their names, there are no bytes to measure
+    return rules, {'files': project['counters'].get('detection_files', 0), 'bytes': None}
+
+
+def bench_project(proj_fld, out_fld, options, repeat):
+    """Times the operations on a project
+    :param proj_fld: text, the project folder
+    :param out_fld: text, a folder the backups are written into, emptied after each run
+    :param options: dictionary/object containing exclusion and archive options
+    :param repeat: number of runs of each operation
+    :return: dictionary/object of {operation: measures}
+    """
+    def empty_output():
+        for name in os.listdir(out_fld):
+            copier.remove_path(os.path.join(out_fld, name))
+
+    uid = utils.suid()
+    detect_time, (rules, scanned) = best_time(lambda: detect(proj_fld), repeat)
+    # The measures are expressed over what the backups keep, not over the whole tree
+    kept = utils.count_entries(utils.walk_kept(proj_fld, compile_exclusions(rules, options, root=proj_fld)))
+    archive_time, _ = best_time(
+        lambda: make_archive(proj_fld, f'{out_fld}/archive', rules, options, uid, time.time(), ''), repeat, empty_output
+    )
+    copy_time, _ = best_time(
+        lambda: duplicate(proj_fld, f'{out_fld}/copy', rules, options, uid, time.time(), ''), repeat, empty_output
+    )
+    results = {}
+    for operation, seconds, measured in (
+        ('auto_detect', detect_time, scanned),
+        ('make_archive', archive_time, kept),
+        ('duplicate', copy_time, kept)
+    ):
+        results[operation] = {
+            'seconds': round(seconds, 4),
+            'files': measured['files'],
+            'bytes': measured['bytes'],
+            'files_per_s': round(measured['files'] / seconds, 1),
+            'mb_per_s': round(measured['bytes'] / (1024 * 1024) / seconds, 2) if measured['bytes'] is not None else None
+        }
+    results['auto_detect']['rules'] = [rule['name'] for rule in rules]
+    return results
+
+
+def bench_startup(work_fld, repeat):
+    """Times shlerp as cron runs it, in a new interpreter, through its entry point
+    :param work_fld: text, the folder the trivial project and its copies are written into
+    :param repeat: number of runs of each command
+    :return: dictionary/object of {command: measures}
+    """
+    shutil.rmtree(os.path.join(work_fld, 'startup'), ignore_errors=True)
+    proj_fld = os.path.join(work_fld, 'startup', 'project')
+    os.makedirs(proj_fld, exist_ok=True)
+    with open(os.path.join(proj_fld, 'main.py'), 'w') as write_file:
+        write_file.write('print(1)\n')
+    copies = []
+
+    def run_shlerp(command, *args):
+        completed = subprocess.run(
+            [sys.executable, '-c', 'from shlerp.bin.shlerp import main; main()', *args],
+            cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise click.ClickException(f'shlerp failed to {command}:\n{completed.stderr or completed.stdout}')
+
+    def copy_project():
+        # The copies are named after the current second, each run gets its own output folder
+        out_fld = os.path.join(work_fld, 'startup', f'out{len(copies)}')
+        os.makedirs(out_fld, exist_ok=True)
+        copies.append(out_fld)
+        run_shlerp('copy', '-t', proj_fld, '-o', out_fld, '-hl')
+
+    results = {}
+    for command, func in (('help', lambda: run_shlerp('help', '--help')), ('copy', copy_project)):
+        seconds, _ = best_time(func, repeat)
+        results[command] = {'seconds': round(seconds, 4), 'budget': STARTUP_BUDGET[command]}
+    return results
+
+
+def compare(results, baseline):
+    """Prints how the results changed since the baseline
+    :return: the number of regressions
+    """
+    regressions = 0
+    for key, operations in results['results'].items():
+        for operation, measures in operations.items():
+            previous = baseline['results'].get(key, {}).get(operation)
+            if not previous:
+                continue
+            change = measures['seconds'] / previous['seconds'] - 1
+            regressed = change > REGRESSION_THRESHOLD \
+                and measures['seconds'] - previous['seconds'] > REGRESSION_MIN_SECONDS
+            regressions += regressed
+            click.echo(click.style(
+                f'{key:<22} {operation:<13} {previous["seconds"]:>9.3f}s -> {measures["seconds"]:>9.3f}s ({change:+.1%})',
+                fg='red' if regressed else 'green' if change < -REGRESSION_THRESHOLD else None
+            ))
+    return regressions
+
+
+@click.command()
+@click.option('-s', '--size', 'sizes', type=click.Choice(list(SIZES)), multiple=True, default=['small'], help='Sizes of the generated projects, can be repeated')
+@click.option('--shape', 'shapes', type=click.Choice(list(SHAPES)), multiple=True, help='Shapes of the generated projects, all of them by default')
+@click.option('--seed', type=int, default=0, help='Changes the content of the generated projects')
+@click.option('-r', '--repeat', type=click.IntRange(min=1), default=3, help='Runs of each operation, the fastest one is kept')
+@click.option('-f', '--format', 'archive_format', default='zip', help='Format of the archives')
+@click.option('-w', '--workdir', type=click.Path(file_okay=False), help='Folder the projects are generated into, they are reused by the next runs')
+@click.option('-b', '--baseline', type=click.Path(dir_okay=False), help='Results of a previous run to compare with')
+@click.option('--save', type=click.Path(dir_okay=False), help='Write the results to this file, to use them as the next baseline')
+@click.option('--startup/--no-startup', default=True, help='Time the startup of shlerp against its budget')
+def main(sizes, shapes, seed, repeat, archive_format, workdir, baseline, save, startup):
+    """Benchmarks the scan, the archives and the copies of shlerp on synthetic projects"""
+    activate_headless()
+    set_state('total', 1)
+    # Only the detection is measured within a project report, the counters tell what it went through
+    stats.enable(utils.suid())
+    options = backup_options(archive_format)
+    work_fld = workdir or tempfile.mkdtemp(prefix='shlerp_bench_')
+    projects_fld = os.path.join(work_fld, 'projects')
+    out_fld = os.path.join(work_fld, 'out')
+    os.makedirs(projects_fld, exist_ok=True)
+    os.makedirs(out_fld, exist_ok=True)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': utils.get_dt(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'format': archive_format,
+        'results': {}
+    }
+    regressions = 0
+    try:
+        if startup:
+            results['results']['startup'] = bench_startup(work_fld, repeat)
+            for command, measures in results['results']['startup'].items():
+                over_budget = measures['seconds'] > measures['budget']
+                regressions += over_budget
+                click.echo(click.style(
+                    f'{"startup":<22} {command:<13} {measures["seconds"]:>9.3f}s (budget {measures["budget"]}s)',
+                    fg='red' if over_budget else None
+                ))
+        for size in sizes:
+            for shape in shapes or SHAPES:
+                proj_fld = generate(shape, size, projects_fld, seed)
+                key = f'{shape}/{size}'
+                results['results'][key] = bench_project(proj_fld, out_fld, options, repeat)
+                for operation, measures in results['results'][key].items():
+                    mb_per_s = f' {measures["mb_per_s"]:>9.2f} MB/s' if measures['mb_per_s'] is not None else ''
+                    click.echo(
+                        f'{key:<22} {operation:<13} {measures["seconds"]:>9.3f}s '
+                        f'{measures["files"]:>8} files {measures["files_per_s"]:>10.1f} files/s{mb_per_s}'
+                    )
+    finally:
+        if not workdir:
+            shutil.rmtree(work_fld, ignore_errors=True)
+
+    if baseline and os.path.exists(baseline):
+        with open(baseline, 'r') as read_baseline:
+            previous = json.load(read_baseline)
+        if previous.get('version') == RESULTS_VERSION:
+            click.echo(f'\nCompared with {baseline} ({previous["created"]}):')
+            regressions += compare(results, previous)
+    if save:
+        with open(save, 'w') as write_results:
+            json.dump(results, write_results, indent=4)
+        click.echo(f'Results written to {save}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
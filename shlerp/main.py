@@ -21,7 +21,9 @@ if __name__ == "__main__":
         incr_state,
         get_printed,
         force_verbose,
-        activate_headless
+        activate_headless,
+        activate_stderr,
+        activate_gitignore
     )
 else:
     from .tools.state import (
@@ -31,12 +33,15 @@ else:
         incr_state,
         get_printed,
         force_verbose,
-        activate_headless
+        activate_headless,
+        activate_stderr,
+        activate_gitignore
     )
 if __name__ == "__main__":
     from shlerp.tools.utils import (
         get_app_details,
         get_setup_fld,
+        get_tmp_fld,
         is_archive,
         get_settings
     )
@@ -44,6 +49,7 @@ else:
     from .tools.utils import (
         get_app_details,
         get_setup_fld,
+        get_tmp_fld,
         is_archive,
         get_settings
     )
@@ -61,32 +67,83 @@ else:
     )
 if __name__ == "__main__":
     from shlerp.tools.scan import (
+        walk_project,
         frameworks_processing,
         vanilla_processing
     )
 else:
     from .tools.scan import (
+        walk_project,
         frameworks_processing,
         vanilla_processing
     )
+if __name__ == "__main__":
+    from shlerp.tools.exclusions import compile_exclusions
+else:
+    from .tools.exclusions import compile_exclusions
+if __name__ == "__main__":
+    from shlerp.tools.archive import ARCHIVE_FORMATS, default_jobs, check_format, open_archive
+else:
+    from .tools.archive import ARCHIVE_FORMATS, default_jobs, check_format, open_archive
+if __name__ == "__main__":
+    from shlerp.tools import manifest
+else:
+    from .tools import manifest
+if __name__ == "__main__":
+    from shlerp.tools import copy as copier
+else:
+    from .tools import copy as copier
+if __name__ == "__main__":
+    from shlerp.tools import store
+else:
+    from .tools import store
+if __name__ == "__main__":
+    from shlerp.tools import journal
+else:
+    from .tools import journal
+if __name__ == "__main__":
+    from shlerp.tools.progress import Progress
+else:
+    from .tools.progress import Progress
+if __name__ == "__main__":
+    from shlerp.tools import stats
+else:
+    from .tools import stats
+if __name__ == "__main__":
+    from shlerp.tools import profiler
+    from shlerp.tools.profiler import traced
+else:
+    from .tools import profiler
+    from .tools.profiler import traced
 if __name__ == "__main__":
     from shlerp.tools import utils
 else:
     from .tools import utils
 from os.path import exists
-from signal import signal, SIGINT
-from zipfile import ZipFile, ZIP_DEFLATED
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
+from contextlib import nullcontext
+from concurrent.futures import wait, FIRST_COMPLETED
+from collections import deque
+import atexit
+import queue
 import threading
 import re
 import os
 import sys
-import shutil
 import time
 import json
 
 
+# Appended to the project folder name when a mirror is made next to the project
+MIRROR_SUFFIX = '_mirror'
+# Projects waiting between two stages of a batch pipeline
+PIPELINE_DEPTH = 2
+# Seconds a stage of the pipeline waits on a queue before checking if the batch has been interrupted
+PIPELINE_POLL = 0.1
+
 # Main logic & functions
 
+@traced
 def auto_detect(proj_fld):
     """Auto-detects the project language/framework
     to then back it up while applying the exclusions defined in the rule that
@@ -100,6 +157,7 @@ def auto_detect(proj_fld):
     started = time.time()
 
     # Step 1: Get the rules from the config & temporary file
+    rules_started = time.perf_counter()
     try:
         with open(f'{get_setup_fld()}/config/rules.json', 'r') as read_file:
             rules = json.load(read_file)
@@ -108,7 +166,7 @@ def auto_detect(proj_fld):
         exit(1)
 
     try:
-        with open(f'{get_setup_fld()}/tmp/rules_history.json', 'r') as read_tmp:
+        with open(f'{get_tmp_fld()}/rules_history.json', 'r') as read_tmp:
             tmp_file = json.load(read_tmp)
         # If the rules history hasn't been checked yet, only keep the rules that are mentioned in the tmp file
         # The history file only contains the name of the rules that have been recently used by shlerp.
@@ -123,157 +181,915 @@ def auto_detect(proj_fld):
     except FileNotFoundError:
         print_term('scan', 'I', 'Temp file not found, will use the whole ruleset instead', )
         tmp_file = {'frameworks': [], 'vanilla': []}
-        tmp_fld = f'{get_setup_fld()}/tmp'
-        if not exists(tmp_fld):
-            os.mkdir(tmp_fld)
-        with open(f'{tmp_fld}/rules_history.json', 'w') as write_tmp:
+        tmp_fld = get_tmp_fld()
+        os.makedirs(tmp_fld, exist_ok=True)
+        # Written aside then renamed, the projects of a parallel batch can get there at the same time
+        tmp_path = f'{tmp_fld}/rules_history.json.{os.getpid()}'
+        with open(tmp_path, 'w') as write_tmp:
             write_tmp.write(json.dumps(tmp_file, indent=4))
+        os.replace(tmp_path, f'{tmp_fld}/rules_history.json')
+    stats.add_time('rules_loading', time.perf_counter() - rules_started)
+
+    # Step 2: Walk the project once, the framework and vanilla rules are all scored from this traversal
+    with stats.span('scan'):
+        walk_project(rules, proj_fld)
 
-    # Step 2: Evaluate rules from the frameworks section
+    # Step 3: Evaluate rules from the frameworks section
     print_term('scan', 'I', 'Evaluating framework rules...', )
-    fw_leads = frameworks_processing(rules, proj_fld)
+    with stats.span('detect_frameworks'):
+        fw_leads = frameworks_processing(rules, proj_fld)
 
-    # Step 3: Evaluate vanilla rules if the frameworks didn't match anything
+    # Step 4: Evaluate vanilla rules if the frameworks didn't match anything
     print_term('scan', 'I', 'Evaluating vanilla rules...', )
-    v_leads = vanilla_processing(rules, proj_fld, )
+    with stats.span('detect_vanilla'):
+        v_leads = vanilla_processing(rules, proj_fld, )
 
-    # Step 4: Exit the function
+    # Step 5: Exit the function
     elapsed_time = time.time() - started  # Calculate elapsed time
     if state('debug'): print_term('scan:stat', 'D', f'Auto-detection completed in {elapsed_time:.2f} seconds')
     return fw_leads + v_leads
 
 
+@traced
 def make_archive(proj_fld, dst_path, rules, options, uid, started, count):
     """
-    Creates a zip archive of the project folder.
+    Creates an archive of the project folder, in the format selected with --format.
     :param proj_fld: text, the folder we want to archive
-    :param dst_path: text, the location where we want to store the archive
+    :param dst_path: text, the location where we want to store the archive, without its extension
     :param rules: list of dictionaries/objects representing the rules/languages corresponding to the project
-    :param options: dictionary/object containing exclusion options
+    :param options: dictionary/object containing exclusion and archive options
     :param uid: text representing a short uid
     :param started: number representing the time when the script has been executed
     :param count: string that represents nothing or the current count out of a total of backups to process
     """
-    with ZipFile(f'{dst_path}.zip', 'w', ZIP_DEFLATED, compresslevel=9) as zip_archive:
-        fld_count = file_count = 0
-        success = True
-        if state('total') == 1:
-            count = ''
-
-        #####################
-        # Exclusion zone
-
-        # Collect exclusions from all rules
-        exclusions = {
-            'files': set(),
-            'folders': set(),
-            'dep_folders': set()
-        }
-        exclusions['files'].add('.DS_Store')
-        for rule in rules:
-            if 'actions' in rule and 'exclude' in rule['actions']:
-                exclude = rule['actions']['exclude']
-                if 'files' in exclude:
-                    exclusions['files'].update(exclude['files'])
-                if 'folders' in exclude:
-                    exclusions['folders'].update(exclude['folders'])
-                if 'dep_folders' in exclude:
-                    exclusions['dep_folders'].update(exclude['dep_folders'])
-
-        for elem_path in utils.iglob_hidden(proj_fld + '/**', recursive=True):
-            rel_name = elem_path.split(f'{proj_fld}/')[1]
-            proceed = True
-            output = True
-
-            if options['nogit']:
-                exclusions['folders'].add('.git')
-                exclusions['files'].add('.gitignore')
-
-            # Reject the current relative path if one of these conditions are matched
-            if not options['noexcl']:
-                if any(dep_folder in elem_path for dep_folder in exclusions['dep_folders']):
-                    proceed = False
-                if any(excl in rel_name for excl in exclusions['folders']):
-                    proceed = False
-                if any(excl in rel_name for excl in exclusions['files']):
-                    proceed = False
-
-            if '.git' in elem_path:
-                output = False
+    if dst_path == '-':
+        # The archive is streamed, nothing is ever written on the disk
+        archive_path = 'stdout'
+        archive_stream = nullcontext(sys.stdout.buffer)
+    else:
+        archive_path = f'{dst_path}.{options["format"]}'
+        archive_stream = open(archive_path, 'wb')
+    try:
+        with archive_stream as archive_file:
+            if stats.current():
+                # With --stats-json, the time spent writing the archive is measured
+                archive_file = stats.TimedFile(archive_file)
+            archive_writer = open_archive(archive_file, options['format'], options['level'], options['jobs'])
+            fld_count = file_count = 0
+            success = True
+            if state('total') == 1:
+                count = ''
 
             #####################
-            # Archive making
+            # Exclusion zone
 
-            if proceed:
-                if rel_name == '':
-                    output = False
-                try:
-                    zip_archive.write(elem_path, rel_name)
-                    if os.path.isdir(elem_path):
-                        rel_name = rel_name + '/'
-                        fld_count += 1
+            # Merge the exclusions from all rules, once for the whole project
+            matcher = compile_exclusions(rules, options, root=proj_fld)
+
+            # With --incremental, only the files that changed since the latest manifest are archived
+            previous = None
+            if options['incremental'] and dst_path != '-':
+                previous = manifest.load_latest_manifest(dst_path)
+                if previous:
+                    print_term('arch', 'I', f'Incremental archive based on {previous["name"]}',   cnt=count)
+                else:
+                    print_term('arch', 'W', 'No previous manifest found, making a full archive',   cnt=count)
+            prev_folders = set(previous['folders']) if previous else set()
+            files = {}
+            folders = []
+            records = {}
+            # Files of the project that couldn't be archived, they mustn't be listed as deleted
+            failed = []
+            unchanged_count = 0
+
+            # Without --verbose, a single line shows how far the archive is on a terminal, only the summary is printed elsewhere
+            out_size = (lambda: os.path.getsize(archive_path)) if dst_path != '-' else None
+            progress = Progress('arch', count, out_size)
+            if progress.enabled and dst_path != '-':
+                progress.expect(previous or manifest.load_latest_manifest(dst_path))
+
+            def changed_entries():
+                """Walks the project and only yields the entries that need to be archived"""
+                nonlocal unchanged_count
+                # Excluded folders are pruned by the walk itself, they are never entered
+                for elem_path, elem_rel, elem_is_dir in stats.measured(utils.interruptible(utils.walk_kept(proj_fld, matcher))):
+                    if elem_is_dir:
+                        folders.append(elem_rel)
+                        if elem_rel in prev_folders:
+                            continue
                     else:
-                        file_count += 1
-                    if output:
-                        print_term('arch', 'I', f'Added: {rel_name}',   cnt=count)
-                except Exception as e:
-                    success = False
-                    print_term('arch', 'E', f'Error adding {rel_name}: {e}',   cnt=count)
-
-        if success:
-            append_state('backed_up', proj_fld)
-            print_term('stat', 'I', f'Folders: {fld_count} - Files: {file_count}',   cnt=count)
-            print_term('stat', 'I', f'✅ Project archived ({"%.2f" % (time.time() - started)}s): {dst_path}.zip',   cnt=count)
+                        try:
+                            record = manifest.file_record(elem_path)
+                        except OSError:
+                            record = None
+                        prev_record = manifest.unchanged(previous, elem_rel, record)
+                        if prev_record:
+                            files[elem_rel] = prev_record
+                            unchanged_count += 1
+                            progress.add(bytes_in=prev_record[0], skipped=True)
+                            continue
+                        records[elem_rel] = record
+                    yield elem_path, elem_rel, elem_is_dir
+
+            # Zip members are compressed by several threads and written back in the walk order
+            archiving_started = time.perf_counter()
+            try:
+                with progress:
+                    for rel_name, is_dir, error, digest in archive_writer.write(changed_entries()):
+
+                        #####################
+                        # Archive making
+
+                        if error:
+                            success = False
+                            failed.append(rel_name)
+                            print_term('arch', 'E', f'Error adding {rel_name}: {error}',   cnt=count)
+                            continue
+                        if is_dir:
+                            rel_name = rel_name + '/'
+                            fld_count += 1
+                        else:
+                            file_count += 1
+                            record = records.get(rel_name)
+                            if record:
+                                files[rel_name] = record + [digest]
+                            progress.add(bytes_in=record[0] if record else 0)
+                        if state('verbose') and not rel_name.startswith('.git/') and rel_name != '.gitignore':
+                            print_term('arch', 'I', f'Added: {rel_name}',   cnt=count)
+            except BaseException:
+                # The writer is closed before the file, it would try to finish the archive into a closed file otherwise.
+                # Interrupted or failed, the archive stays incomplete, the journal of the batch removes it on resume.
+                try:
+                    archive_writer.close()
+                except Exception:
+                    pass
+                raise
+
+            if options['format'] != 'zip':
+                # Tar streams are compressed by this thread, between walking the project and writing the archive
+                stats.add_time('compression', max(0, time.perf_counter() - archiving_started
+                                                  - stats.phase_time('traversal') - stats.phase_time('writing')))
+            deleted = manifest.deleted_paths(previous, files, folders, failed)
+            deleted_name = None
+            if deleted:
+                deleted_name = manifest.deleted_member(files, folders)
+                archive_writer.add_bytes(deleted_name, '\n'.join(deleted).encode())
+            archive_writer.close()
+            archive_file.flush()
+            if dst_path != '-':
+                stats.set_value('output', archive_path)
+                stats.set_value('output_bytes', os.path.getsize(archive_path))
+                manifest.write_manifest(
+                    dst_path, proj_fld, os.path.basename(archive_path), options['format'],
+                    files, folders, deleted, previous, deleted_name
+                )
+
+            if success:
+                append_state('backed_up', proj_fld)
+                print_term('stat', 'I', f'Folders: {fld_count} - Files: {file_count}',   cnt=count)
+                if previous:
+                    print_term('stat', 'I', f'Unchanged: {unchanged_count} - Deleted: {len(deleted)}',   cnt=count)
+                print_term('stat', 'I', f'✅ Project archived ({"%.2f" % (time.time() - started)}s): {archive_path}',   cnt=count)
+            else:
+                append_state('failures', proj_fld)
+                print_term('stat', 'W', f'Incomplete archive: {archive_path}',   cnt=count)
+    except BrokenPipeError:
+        # The command reading the stream exited before the end of the archive
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        append_state('failures', proj_fld)
+        print_term('stat', 'E', 'The output pipe has been closed before the end of the archive',   cnt=count)
+
+
+@traced
+def store_backup(proj_fld, store_fld, rules, options, uid, started, count):
+    """Backs up the project folder into the deduplicating store, as a new snapshot.
+    Only the chunks that aren't already in the store are written.
+    :param proj_fld: text, the folder we want to back up
+    :param store_fld: text, the folder of the store
+    :param rules: list of dictionaries/objects representing the rules/languages corresponding to the project
+    :param options: dictionary/object containing exclusion options
+    :param uid: text representing a short uid
+    :param started: number representing the time when the script has been executed
+    :param count: string that represents nothing or the current count out of a total of backups to process
+    """
+    fld_count = file_count = unchanged_count = written = 0
+    success = True
+    if state('total') == 1:
+        count = ''
+    matcher = compile_exclusions(rules, options, root=proj_fld)
+    previous = store.latest_snapshot(store_fld, proj_fld)
+    if previous:
+        print_term('stor', 'I', f'Previous snapshot: {previous["name"]}',   cnt=count)
+    files = {}
+    folders = []
+
+    # Without --verbose, a single line shows how far the snapshot is on a terminal, only the summary is printed elsewhere
+    progress = Progress('stor', count, lambda: written)
+    progress.expect(previous)
+    entries = stats.measured(utils.interruptible(utils.walk_kept(proj_fld, matcher)))
+    with progress:
+        for rel_name, is_dir, error, chunk_written in store.store_entries(store_fld, entries, previous, files, folders, options['jobs']):
+            if error:
+                success = False
+                print_term('stor', 'E', f'Error storing {rel_name}: {error}',   cnt=count)
+                continue
+            if is_dir:
+                fld_count += 1
+                continue
+            file_count += 1
+            if previous and files[rel_name] is previous['files'].get(rel_name):
+                unchanged_count += 1
+                progress.add(bytes_in=files[rel_name][0], skipped=True)
+                continue
+            written += chunk_written
+            progress.add(bytes_in=files[rel_name][0])
+            if state('verbose') and not rel_name.startswith('.git/') and rel_name != '.gitignore':
+                print_term('stor', 'I', f'Added: {rel_name}',   cnt=count)
+
+    snapshot_path = store.write_snapshot(store_fld, proj_fld, files, folders, previous)
+    stats.set_value('output', snapshot_path)
+    stats.set_value('output_bytes', written)
+    print_term('stat', 'I', f'Folders: {fld_count} - Files: {file_count} - Unchanged: {unchanged_count}',   cnt=count)
+    print_term('stat', 'I', f'Written to the store: {written / (1024 * 1024):.2f} MB',   cnt=count)
+    if success:
+        append_state('backed_up', proj_fld)
+        print_term('stat', 'I', f'✅ Project stored ({"%.2f" % (time.time() - started)}s): {snapshot_path}',   cnt=count)
+    else:
+        append_state('failures', proj_fld)
+        print_term('stat', 'W', f'Incomplete snapshot: {snapshot_path}',   cnt=count)
+
+
+def restore(snapshot_path, dst, options):
+    """Rebuilds a project folder from a snapshot of the store
+    :param snapshot_path: text, the path of the snapshot index
+    :param dst: text, the folder to create
+    :param options: dictionary/object containing the number of jobs
+    """
+    started = time.time()
+    file_count = 0
+    for rel_name, error in store.restore_snapshot(snapshot_path, dst, options['jobs']):
+        if error:
+            append_state('failures', rel_name)
+            print_term('rest', 'E', f'Error restoring {rel_name}: {error}', )
         else:
-            append_state('failures', proj_fld)
-            print_term('stat', 'W', f'Incomplete archive: {dst_path}.zip',   cnt=count)
+            file_count += 1
+            if state('verbose'):
+                print_term('rest', 'I', f'Restored: {rel_name}', )
+    print_term('stat', 'I', f'Files: {file_count}', )
+    print_term('stat', 'I', f'✅ Snapshot restored ({"%.2f" % (time.time() - started)}s): {dst}/', )
 
 
+@traced
 def duplicate(proj_fld, dst, rules, options, uid, started, count):
-    """Duplicates a project folder, processes all files and folders. node_modules will be processed last if cache = True
+    """Duplicates a project folder, processes all files and folders.
+    The tree is listed once, skipping the excluded folders at every level, then the files are copied by a pool of threads.
     :param proj_fld: string that represents the project folder we want to duplicate
     :param dst: string that represents the destination folder where we will copy the project files
     :param rules: list of dictionaries/object representing the technologies used by the project
-    :param options: dictionary/object containing exclusion options
+    :param options: dictionary/object containing exclusion and copy options
     :param uid: text representing a short uid,
     :param started: number representing the time when the script has been executed
     :param count: string that represents nothing or the current count out of a total of backups to process
     """
 
     fld_count = file_count = 0
-    elem_list = utils.get_files(proj_fld, rules, options)
+    success = True
+    # Number of files copied by each strategy of the copy engine
+    strategies = {}
     if state('total') == 1:
         count = ''
-    os.mkdir(dst)
-    for elem in elem_list:
-        orig = f'{proj_fld}/{elem}'
-        full_dst = f'{dst}/{elem}'
-        try:
-            if os.path.isdir(orig):
-                shutil.copytree(orig, full_dst)
-                if exists(full_dst):
-                    print_term('copy', 'I', f'Done: {proj_fld}/{elem}/',   cnt=count)
-                    fld_count += 1
+
+    unchanged_count = deleted_count = 0
+    # With --link-dest, the files that didn't change since the previous copy are hard linked to it
+    link_dest = None
+    if options['link_dest']:
+        link_dest = copier.find_previous_copy(dst)
+        if link_dest:
+            print_term('copy', 'I', f'Unchanged files are linked to {link_dest}',   cnt=count)
+        else:
+            print_term('copy', 'W', 'No previous copy found, making a full copy',   cnt=count)
+
+    if options['mirror']:
+        # The mirror is synced in place, only what differs from the project is written or deleted
+        os.makedirs(dst, exist_ok=True)
+    else:
+        os.mkdir(dst)
+    # The results come back in the walk order, a top level entry is done when the next one shows up
+    current_top = None
+    entries = copier.copy_tree(
+        stats.measured(utils.interruptible(utils.get_files(proj_fld, rules, options))),
+        dst, options['copy_jobs'], link_dest, options['mirror']
+    )
+    for rel_name, is_dir, error, strategy in entries:
+        if strategy == 'deleted':
+            if error:
+                success = False
+                print_term('copy', 'E', f'Error deleting {rel_name}: {error}',   cnt=count)
             else:
-                shutil.copy(orig, full_dst)
-                file_count += 1
-                if exists(full_dst):
-                    print_term('copy', 'I', f'Done: {proj_fld}/{elem}',   cnt=count)
-        except FileNotFoundError as fnf_error:
-            print_term('copy', 'E', f'File not found: {fnf_error}',   cnt=count)
-            append_state('failures', proj_fld)
-        except PermissionError as perm_error:
-            print_term('copy', 'E', f'Permission error: {perm_error}',   cnt=count)
-            append_state('failures', proj_fld)
-        except shutil.Error as shutil_error:
-            print_term('copy', 'E', f'Shutil error: {shutil_error}',   cnt=count)
-            append_state('failures', proj_fld)
-        except Exception as exc:
-            print_term('copy', 'E', f'Unexpected error: {exc}',   cnt=count)
+                deleted_count += 1
+            continue
+        if '/' not in rel_name:
+            if current_top:
+                print_term('copy', 'I', f'Done: {proj_fld}/{current_top}',   cnt=count)
+            current_top = rel_name + '/' if is_dir else rel_name
+        if error:
+            success = False
+            if isinstance(error, FileNotFoundError):
+                print_term('copy', 'E', f'File not found: {error}',   cnt=count)
+            elif isinstance(error, PermissionError):
+                print_term('copy', 'E', f'Permission error: {error}',   cnt=count)
+            else:
+                print_term('copy', 'E', f'Unexpected error: {error}',   cnt=count)
+            continue
+        if is_dir:
+            fld_count += 1
+        elif strategy == 'unchanged':
+            file_count += 1
+            unchanged_count += 1
+        else:
+            file_count += 1
+            strategies[strategy] = strategies.get(strategy, 0) + 1
+    if current_top:
+        print_term('copy', 'I', f'Done: {proj_fld}/{current_top}',   cnt=count)
+    stats.set_value('output', dst)
+
+    print_term('stat', 'I', f'Folders: {fld_count} - Files: {file_count}',   cnt=count)
+    if options['mirror']:
+        print_term('stat', 'I', f'Unchanged: {unchanged_count} - Deleted: {deleted_count}',   cnt=count)
+    if strategies:
+        used = ', '.join(f'{strategy} ({number})' for strategy, number in strategies.items())
+        print_term('stat', 'I', f'Copy strategy: {used}',   cnt=count)
+    if success:
+        append_state('backed_up', proj_fld)
+        operation = 'mirrored' if options['mirror'] else 'duplicated'
+        print_term('stat', 'I', f'✅ Project {operation} ({"%.2f" % (time.time() - started)}s): {dst}/',   cnt=count)
+    else:
+        # The project is only counted once, whatever the number of files that failed
+        append_state('failures', proj_fld)
+        print_term('stat', 'W', f'Incomplete copy: {dst}/',   cnt=count)
+
+
+def detect_project(batch_elem, settings):
+    """Scans a folder of the target to find out how it should be backed up
+    :param batch_elem: text, the path of the folder, or of an archive to upload
+    :param settings: dictionary/object containing the options of the current execution
+    :return: dictionary/object describing the backup to make, or None if there is nothing to back up
+    """
+    with stats.for_project(batch_elem):
+        elem_rules = None
+        if os.path.basename(batch_elem) == store.STORE_NAME:
+            # The store shared by the projects of the batch is not a project
+            return None
+        if settings['mirror'] and batch_elem.endswith(MIRROR_SUFFIX):
+            # Neither are the mirrors made next to the projects
+            return None
+        if os.path.isdir(batch_elem):
+            if settings['rules']:
+                # Rules from the --rule option
+                elem_rules = settings['rules']
+            else:
+                if not batch_elem.startswith('.'):
+                    print_term('scan', 'I', f'Scanning {batch_elem}', )
+                    elem_rules = auto_detect(batch_elem, )
+            if elem_rules:
+                print_term('scan', 'I', f'Detected: {[rule["name"] for rule in elem_rules]}', )
+                stats.set_value('rules', [{'name': rule['name'], 'score': rule.get('total')} for rule in elem_rules])
+                return {
+                    'proj_fld': batch_elem,
+                    'rules': elem_rules
+                }
+            else:
+                print_term('scan', 'W', f'The folder {batch_elem} won\'t be processed as automatic rule detection failed')
+                append_state('ad_failures', batch_elem)
+        if is_archive(batch_elem):
+            if settings['upload']:
+                return {
+                    'proj_fld': batch_elem,
+                    'already_archived': True # already_archived will either be True, or non-existent at all
+                }
+        return None
+
+
+def set_destination(backup, settings):
+    """Sets where a backup has to be written, as backup['dst']
+    :param backup: dictionary/object describing the backup to make
+    :param settings: dictionary/object containing the options of the current execution
+    """
+    output = settings['output']
+    project_name = backup['proj_fld'].split('/')[-1]
+    if settings['stdout']:
+        backup['dst'] = '-'
+    elif settings['mirror']:
+        # A mirror always goes to the same place, so that each run updates it
+        backup['dst'] = f'{output}/{project_name}' if output else f'{backup["proj_fld"]}{MIRROR_SUFFIX}'
+        if backup['dst'] == backup['proj_fld']:
+            backup['dst'] += MIRROR_SUFFIX
+    elif output:
+        backup['dst'] = f'{output}/{project_name}_{utils.get_dt()}'
+    else:
+        # If the current path to backup is already an archive, just set the  project folder as the backup dest.
+        # The goal is for the rest of the code to just use backup['dst'] instead of using a condition
+        backup['dst'] = f'{backup["proj_fld"]}_{utils.get_dt()}' \
+        if not backup.get('already_archived') \
+        else backup['proj_fld']
+
+
+@traced
+def process_backup(backup, settings, count):
+    """Backs up a project the way the options ask for
+    :param backup: dictionary/object describing the backup to make, with its dst
+    :param settings: dictionary/object containing the options of the current execution
+    :param count: string that represents nothing or the current count out of a total of backups to process
+    """
+    with stats.for_project(backup['proj_fld']), stats.span('backup'):
+        start_time = time.time()
+        options = settings['options']
+        uid = settings['uid']
+        archive = settings['archive']
+
+        if settings['batch']: # Used to display information
+            print_term('stor' if settings['use_store'] else 'arch' if archive else 'copy', 'I', f'Processing: {backup["proj_fld"]}',   cnt=count)
+
+        if settings['use_store']:
+            # With --store, the projects share a deduplicating store next to them or in the --output folder
+            store_fld = f'{settings["output"] or os.path.dirname(backup["proj_fld"])}/{store.STORE_NAME}'
+            store_backup(
+                backup['proj_fld'], store_fld,
+                backup['rules'], options,
+                uid, start_time, count
+            )
+        elif archive and not backup.get('already_archived'):
+            # If --archive is provided to the script, we use make_archive()
+            make_archive(
+                backup['proj_fld'], backup['dst'],
+                backup['rules'], options,
+                uid, start_time, count
+            )
+        elif not archive:
+            # Else if we don't want an archive we will do a copy of the project instead
+            duplicate(
+                backup['proj_fld'], backup['dst'],
+                backup['rules'], options,
+                uid, start_time, count
+            )
+
+
+@traced
+def upload_backup(backup, settings, count, spinner=True):
+    """Uploads the archive of a project, once process_backup() made it
+    :param backup: dictionary/object describing the backup, with its dst
+    :param settings: dictionary/object containing the options of the current execution
+    :param count: string that represents nothing or the current count out of a total of backups to process
+    :param spinner: boolean, False to upload without the spinner animation
+    :return: True if the archive has been uploaded
+    """
+    with stats.for_project(backup['proj_fld']):
+        options = settings['options']
+        if settings['is_upload']:
+            step = 'uplo'
+            zip_path = ''
+
+            # The zip file name has to be defined differently depending if the --target was already an archive or not
+            if backup.get('already_archived'):
+                zip_path = backup['dst']
+            elif backup['proj_fld'] in state('backed_up'):
+                zip_path = f'{backup["dst"]}.{options["format"]}'
+            else:
+                print_term(step, 'E', 'Archiving process failed - skipping upload', )
+                return
+
+            archive_size_mb = utils.get_file_size(zip_path)
+            archive_size_gb = archive_size_mb / 1024  # Convert MB to GB
+            if archive_size_gb > 2:  # 2 GB limit
+                print_term(step, 'E', f'File size is too big: {archive_size_gb:.2f} GB', )
+            else:
+                with stats.span('upload'):
+                    response = upload_archive(zip_path, settings['expiration'], spinner)
+                json_resp = response.json()
+                if json_resp['success']:
+                    expiry_message = time_until_expiry(json_resp['expires'])
+                    print_term(step, 'I', f'🔗 Single use: {json_resp["link"]} - {expiry_message}',   cnt=count)
+                    return True
+                else:
+                    append_state('upload_failures', backup['proj_fld'])
+                    print_term(step, 'E', f'Upload failed: {json_resp["error"]}',   cnt=count)
+
+
+# State keys that the batch workers inherit from the main process, and the ones they report back
+INHERITED_STATE = ('uid', 'headless', 'stderr', 'verbose', 'gitignore', 'debug', 'total')
+REPORTED_STATE = ('backed_up', 'failures', 'ad_failures', 'upload_failures')
+
+
+def init_batch_worker():
+    # Ctrl-C reaches every process of the terminal, the main process decides what stops and terminates the workers
+    signal(SIGINT, SIG_IGN)
+    signal(SIGTERM, stop_batch_worker)
+
+
+def stop_batch_worker(signalnum, frame):
+    # The backup in progress stops at its next entry and cleans up like on Ctrl-C, an idle worker waits to be shut down
+    utils.interrupted.set()
+
+
+def batch_worker(task, item, settings, inherited):
+    """Runs a step of a batch for one project, in a worker process.
+    The messages are captured instead of printed, so that the main process prints them grouped by project.
+    :param task: text, "scan" to detect the project and estimate its size, "backup" to back it up and upload it
+    :param item: text, the path to scan, or dictionary/object describing the backup to make
+    :param settings: dictionary/object containing the options of the current execution
+    :param inherited: dictionary/object of the state values of the main process
+    :return: dictionary/object with the captured messages, the state lists filled by this project,
+    the backup to make for a scan, whether it has been uploaded and the measures made for --stats-json and --profile
+    """
+    for key, value in inherited.items():
+        set_state(key, value)
+    for key in REPORTED_STATE:
+        set_state(key, [])
+    if settings['stats_json']:
+        # Only what this worker measures is sent back
+        stats.enable(inherited['uid'])
+    if settings['profile']:
+        profiler.stop_worker_profiling()
+        profiler.start_tracing()
+    captured = []
+    set_state('captured', captured)
+    result = {'backup': None, 'uploaded': False}
+    try:
+        if task == 'scan':
+            backup = detect_project(item, settings)
+            if backup:
+                set_destination(backup, settings)
+                backup['estimate'] = estimate_backup(backup, settings)
+            result['backup'] = backup
+        else:
+            process_backup(item, settings, 'x')
+            result['uploaded'] = upload_backup(item, settings, 'x')
+    except Exception as exc:
+        proj_fld = item if task == 'scan' else item['proj_fld']
+        print_term('arch' if settings['archive'] else 'copy', 'E', f'Unexpected error: {exc}',   cnt='x')
+        if proj_fld not in state('failures') + state('backed_up'):
             append_state('failures', proj_fld)
+    finally:
+        set_state('captured', None)
+    result.update({key: state(key) for key in REPORTED_STATE})
+    result['messages'] = captured
+    result['stats'] = stats.report['projects'] if stats.report is not None else {}
+    result['trace'] = profiler.collect()
+    return result
+
 
-    print_term('stat', 'I', f'✅ Project duplicated ({"%.2f" % (time.time() - started)}s): {dst}/',   cnt=count)
-    append_state('backed_up', proj_fld)
+def estimate_backup(backup, settings):
+    """Measures what a backup will have to read, once the exclusions are applied.
+    Only the metadata is read, the excluded folders are never entered.
+    :param backup: dictionary/object describing the backup to make
+    :param settings: dictionary/object containing the options of the current execution
+    :return: dictionary/object with the number of "files" and of "bytes"
+    """
+    proj_fld = backup['proj_fld']
+    options = settings['options']
+    if backup.get('already_archived'):
+        return {'files': 1, 'bytes': os.path.getsize(proj_fld)}
+    if settings['archive'] or settings['use_store']:
+        entries = utils.walk_kept(proj_fld, compile_exclusions(backup['rules'], options, root=proj_fld))
+    else:
+        entries = utils.get_files(proj_fld, backup['rules'], options)
+    return utils.count_entries(entries)
+
+
+def batch_operation(settings):
+    """
+    :param settings: dictionary/object containing the options of the current execution
+    :return: text describing what the batch makes, a journal is only resumed by a batch making the same thing
+    """
+    if settings['upload']:
+        return f'upload:{settings["options"]["format"]}'
+    if settings['use_store']:
+        return 'store'
+    if settings['archive']:
+        return f'archive:{settings["options"]["format"]}'
+    return 'mirror' if settings['mirror'] else 'copy'
+
+
+def open_journal(target_fld, settings, resume):
+    """Starts the journal of a batch, next to its backups.
+    When resuming, the outputs left half written by the interrupted run are removed first.
+    :param target_fld: text, the folder containing the projects of the batch
+    :param settings: dictionary/object containing the options of the current execution
+    :param resume: boolean, True to carry on with the journal of the previous run instead of starting over
+    :return: dictionary/object with the "path" of the journal and the "journal" itself
+    """
+    journal_file = journal.journal_path(settings['output'] or target_fld)
+    operation = batch_operation(settings)
+    previous = journal.load_journal(journal_file, target_fld, operation)
+    if resume and previous:
+        print_term('prep', 'I', f'Resuming the batch started on {previous["started"]}', )
+        for output_path in journal.remove_partial_outputs(previous):
+            print_term('prep', 'W', f'Removed the partial output of an interrupted run: {output_path}', )
+        jrnl = previous
+    else:
+        if resume:
+            print_term('prep', 'W', 'No interrupted batch to resume, all the projects will be processed', )
+        jrnl = journal.new_journal(target_fld, operation)
+    journal.write_journal(journal_file, jrnl)
+    set_state('journal', journal_file)
+    return {'path': journal_file, 'journal': jrnl}
+
+
+def record_project(jrnl, backup, project_state, **fields):
+    """Records the new state of a project in the journal of the batch, if there is one
+    :param jrnl: dictionary/object returned by open_journal(), or None
+    :param backup: dictionary/object describing the backup
+    :param project_state: text, one of the project states of the journal
+    """
+    if jrnl:
+        journal.record(jrnl['path'], jrnl['journal'], backup['proj_fld'], project_state, **fields)
+
+
+def partial_outputs(backup, settings):
+    """
+    :param backup: dictionary/object describing the backup to make, with its dst
+    :param settings: dictionary/object containing the options of the current execution
+    :return: the list of the paths to remove if the backup is interrupted
+    """
+    if settings['use_store'] or settings['mirror'] or backup.get('already_archived'):
+        # Chunks and snapshots are written atomically, and a mirror is synced again by the next run
+        return []
+    if settings['archive']:
+        # The manifest of an incomplete archive mustn't be used as the base of the next incremental archive
+        manifest_file = manifest.manifest_path(backup['dst'])
+        return [f'{backup["dst"]}.{settings["options"]["format"]}', manifest_file, f'{manifest_file}.tmp']
+    return [backup['dst']]
+
+
+def backup_result(backup):
+    """
+    :param backup: dictionary/object describing the backup, once process_backup() went through it
+    :return: the state of the project to record in the journal
+    """
+    if backup.get('already_archived') or backup['proj_fld'] in state('backed_up'):
+        return journal.DONE
+    if utils.interrupted.is_set():
+        # Cut short by the interruption of the batch, it stays in progress until its output is removed
+        return journal.BACKING_UP
+    return journal.FAILED
+
+
+def batch_candidates(batch_list, settings):
+    """
+    :param batch_list: list of the paths found in the target folder
+    :param settings: dictionary/object containing the options of the current execution
+    :return: the list of the paths that detect_project() will look at, each one ends up backed up or failed
+    """
+    return [
+        batch_elem for batch_elem in batch_list
+        if os.path.isdir(batch_elem) or (settings['upload'] and is_archive(batch_elem))
+    ]
+
+
+def run_pipelined_batch(batch_list, settings, jrnl=None):
+    """Scans, backs up and uploads the projects of a batch in three stages running at the same time,
+    so that a project is being compressed while the previous one uploads and the next one is scanned.
+    The stages are connected by bounded queues, only a few projects are in flight at any time.
+    If the batch is interrupted, the stages stop, the backup being made included, before the interruption is raised.
+    :param batch_list: list of the paths found in the target folder
+    :param settings: dictionary/object containing the options of the current execution
+    :param jrnl: dictionary/object returned by open_journal(), or None
+    """
+    incr_state('total', len(batch_candidates(batch_list, settings)))
+    scanned = queue.Queue(maxsize=PIPELINE_DEPTH)
+    backed_up = queue.Queue(maxsize=PIPELINE_DEPTH)
+    # Shared by the stages, none of them waits on a queue once it is set
+    stop = utils.interrupted
+    stop.clear()
+
+    def put(pipe, item):
+        while not stop.is_set():
+            try:
+                pipe.put(item, timeout=PIPELINE_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def get(pipe):
+        while not stop.is_set():
+            try:
+                return pipe.get(timeout=PIPELINE_POLL)
+            except queue.Empty:
+                pass
+        return None
+
+    def scan_stage():
+        try:
+            for batch_elem in batch_list:
+                if stop.is_set():
+                    break
+                backup = detect_project(batch_elem, settings)
+                if backup:
+                    set_destination(backup, settings)
+                    record_project(jrnl, backup, journal.SCANNED, dst=backup['dst'])
+                    put(scanned, backup)
+        except KeyboardInterrupt:
+            # The scan has been cut short by the interruption of the batch
+            pass
+        finally:
+            # Tells the next stage that there is nothing left
+            put(scanned, None)
+
+    def backup_stage():
+        backup = True
+        try:
+            while True:
+                backup = get(scanned)
+                if backup is None:
+                    break
+                count = f'{(len(state("backed_up")) + len(state("failures"))) + 1}/{state("total")}'
+                record_project(jrnl, backup, journal.BACKING_UP, outputs=partial_outputs(backup, settings))
+                try:
+                    process_backup(backup, settings, count)
+                except Exception as exc:
+                    print_term('arch' if settings['archive'] else 'copy', 'E', f'Unexpected error: {exc}',   cnt=count)
+                    append_state('failures', backup['proj_fld'])
+                record_project(jrnl, backup, backup_result(backup))
+                put(backed_up, (backup, count))
+        except KeyboardInterrupt:
+            # The backup has been cut short, the journal keeps it as being backed up so that its output is removed
+            pass
+        finally:
+            put(backed_up, None)
+            # Unblocks the scan stage if this stage stopped early
+            while backup is not None:
+                backup = get(scanned)
+
+    def upload_stage():
+        while True:
+            item = get(backed_up)
+            if item is None:
+                break
+            backup, count = item
+            try:
+                if upload_backup(backup, settings, count, spinner=False):
+                    record_project(jrnl, backup, journal.UPLOADED)
+            except Exception as exc:
+                print_term('uplo', 'E', f'Upload failed: {exc}',   cnt=count)
+                append_state('upload_failures', backup['proj_fld'])
+
+    stages = [threading.Thread(target=stage) for stage in (scan_stage, backup_stage)]
+    for stage in stages:
+        stage.start()
+    try:
+        # The uploads run on the current thread, the one that gets the KeyboardInterrupt
+        upload_stage()
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        # Once stopped, the stages leave at their next entry or queue operation
+        for stage in stages:
+            stage.join()
+    if stop.is_set():
+        # Interrupted from another thread, by the SIGINT handler
+        raise KeyboardInterrupt
+
+
+def run_parallel_batch(batch_list, settings, jobs, jrnl=None):
+    """Scans and backs up the projects of a batch in a pool of processes.
+    All the projects are scanned first, then the biggest ones are backed up first,
+    so that a big project doesn't start last and keep the batch running alone.
+    :param batch_list: list of the paths found in the target folder
+    :param settings: dictionary/object containing the options of the current execution
+    :param jobs: number of projects processed at the same time
+    :param jrnl: dictionary/object returned by open_journal(), or None
+    """
+    candidates = batch_candidates(batch_list, settings)
+    incr_state('total', len(candidates))
+    inherited = {key: state(key) for key in INHERITED_STATE}
+
+    def collect(result, count=''):
+        # The messages of a project are printed together, numbered in the order the projects complete
+        for step, lvl, message, counted in result['messages']:
+            print_term(step, lvl, message, cnt=count if counted else '')
+        for key in REPORTED_STATE:
+            for value in result[key]:
+                append_state(key, value)
+        stats.merge(result['stats'])
+        profiler.merge(result['trace'])
+
+    def completed(running):
+        # Yields the futures as they complete, until the batch is interrupted from this thread or from another one
+        while running:
+            done, _ = wait(running, timeout=PIPELINE_POLL, return_when=FIRST_COMPLETED)
+            if utils.interrupted.is_set():
+                raise KeyboardInterrupt
+            for future in done:
+                yield future, running.pop(future)
+
+    # Imported here, multiprocessing is only needed by the parallel batches
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_batch_worker) as pool:
+        # Futures of the running tasks, with the backup they make, None for the scans
+        running = {}
+        try:
+            backups = []
+            for batch_elem in candidates:
+                running[pool.submit(batch_worker, 'scan', batch_elem, settings, inherited)] = None
+            for future, _ in completed(running):
+                result = future.result()
+                collect(result)
+                if result['backup']:
+                    backups.append(result['backup'])
+                    record_project(jrnl, result['backup'], journal.SCANNED, dst=result['backup']['dst'])
+
+            # Longest first: the size read is what the duration of a backup depends on the most
+            backups.sort(key=lambda backup: (backup['estimate']['bytes'], backup['estimate']['files']), reverse=True)
+            total_bytes = sum(backup['estimate']['bytes'] for backup in backups)
+            print_term('plan', 'I', f'{len(backups)} projects to back up, {total_bytes / (1024 * 1024):.1f} MB, biggest first:', )
+            for backup in backups:
+                estimate = backup['estimate']
+                print_term('plan', 'I', f'{backup["proj_fld"]}: {estimate["bytes"] / (1024 * 1024):.1f} MB in {estimate["files"]} files', )
+
+            waiting = deque(backups)
+
+            def start_next():
+                # Only submitted once a worker is free, so that the journal only records the backups that started
+                backup = waiting.popleft()
+                record_project(jrnl, backup, journal.BACKING_UP, outputs=partial_outputs(backup, settings))
+                running[pool.submit(batch_worker, 'backup', backup, settings, inherited)] = backup
+
+            while waiting and len(running) < jobs:
+                start_next()
+            for future, backup in completed(running):
+                result = future.result()
+                collect(result, f'{len(state("backed_up")) + len(state("failures")) + 1}/{state("total")}')
+                record_project(jrnl, backup, journal.UPLOADED if result['uploaded'] else backup_result(backup))
+                if waiting:
+                    start_next()
+        except KeyboardInterrupt:
+            # Nothing else starts, and the workers stop the backups they are making
+            utils.interrupted.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            for process in multiprocessing.active_children():
+                process.terminate()
+            for future, backup in running.items():
+                try:
+                    result = future.result()
+                except BaseException:
+                    # Cut short by the interruption, the journal keeps it as being backed up
+                    result = None
+                if backup is None:
+                    continue
+                if result:
+                    # Completed before the workers stopped
+                    collect(result, f'{len(state("backed_up")) + len(state("failures")) + 1}/{state("total")}')
+                record_project(jrnl, backup, journal.UPLOADED if result and result['uploaded'] else backup_result(backup))
+            raise
+
+
+def print_summary(settings, exec_time):
+    """Prints the stats of a batch
+    :param settings: dictionary/object containing the options of the current execution
+    :param exec_time: number representing the time when the script has been executed
+    """
+    step = 'stat'
+    failed_cnt = len(state('failures')) + len(state('ad_failures'))
+    backed_up_cnt = len(state('backed_up'))
+    summary = f'Successful: {backed_up_cnt} - ' \
+            f'Failed: {failed_cnt} - ' \
+            f'Total runtime: {"%.2f" % (time.time() - exec_time)}s'
+    # Display which kind of operation has been done during current execution
+    operation = 'Upload' if settings['upload'] else 'Store' if settings['use_store'] else 'Archive' if settings['archive'] else 'Copy'
+    print_term(step, 'I', summary, )
+    if len(state('ad_failures')) > 0:
+        print_term(step, 'W', f'Detection failures: {state("ad_failures")}', )
+    if len(state('failures')) > 0:
+        print_term(step, 'W', f'{operation} failures: {state("failures")}', )
+    if len(state('upload_failures')) > 0:
+        print_term(step, 'W', f'Upload failures: {state("upload_failures")}', )
+
+
+def write_stats(settings):
+    """Writes the report asked with --stats-json
+    :param settings: dictionary/object containing the options of the current execution
+    """
+    stats.write_report(settings['stats_json'], {
+        'operation': batch_operation(settings),
+        'batch': settings['batch'],
+        'jobs': settings['options']['jobs'],
+        'copy_jobs': settings['options']['copy_jobs'],
+        **{key: state(key) for key in REPORTED_STATE}
+    })
+    print_term('stat', 'I', f'Run report written to {settings["stats_json"]}', )
+
+
+def export_profile(uid):
+    """Writes the profile asked with --profile into the logs folder, once the execution is over
+    :param uid: text representing the short uid of the execution
+    """
+    profile_fld = f'{os.path.expanduser("~")}/{get_settings()["rel_logs_path"]}/profiles'
+    os.makedirs(profile_fld, exist_ok=True)
+    for path in profiler.export(f'{profile_fld}/shlerp_{utils.get_dt()}_{uid}'):
+        print_term('stat', 'I', f'Profile written to {path}', )
 
 
 def set_upload_expiration(ctx, param, value):
@@ -293,6 +1109,11 @@ def set_upload_expiration(ctx, param, value):
 
 def validate_path(ctx, param, value):
     """Custom validator to ensure the target exists."""
+    if value == '-' and param.name == 'output':
+        return {
+            'value': True,
+            'stdout': True
+        }
     if value:
         path = os.path.abspath(value)
         if exists(path):
@@ -315,31 +1136,57 @@ def validate_path(ctx, param, value):
         return None
 
 
+# The help texts of the options, app_details.json is read once for all of them
+options_help = get_app_details()['options']
+
+
 @click.command(epilog=f'shlerp v{get_app_details()["proj_ver"]} - More details: https://github.com/synka777/shlerp-cmd')
-@click.option('-t', '--target', type=click.Path(), default=lambda: os.getcwd(), callback=validate_path, help=get_app_details()["options"]["target"])
-@click.option('-o', '--output', type=click.Path(), callback=validate_path, help=get_app_details()["options"]["output"])
-@click.option('-a', '--archive', default=False, is_flag=True, help=get_app_details()["options"]["archive"])
-@click.option('-u', '--upload', callback=set_upload_expiration, help=get_app_details()["options"]["upload"])
-@click.option('-r', '--rules', help=get_app_details()["options"]["rule"])
-@click.option('-b', '--batch', default=False, is_flag=True, help=get_app_details()["options"]["batch"])
-@click.option('-ne', '--noexcl', default=False, is_flag=True, help=get_app_details()["options"]["noexcl"])
-@click.option('-ng', '--nogit', default=False, is_flag=True, help=get_app_details()["options"]["nogit"])
-@click.option('-kh', '--keephidden', default=False, is_flag=True, help=get_app_details()["options"]["keephidden"])
-@click.option('-hl', '--headless', default=False, is_flag=True, help=get_app_details()["options"]["headless"])
-def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidden, headless):
+@click.option('-t', '--target', type=click.Path(), default=lambda: os.getcwd(), callback=validate_path, help=options_help["target"])
+@click.option('-o', '--output', type=click.Path(), callback=validate_path, help=options_help["output"])
+@click.option('-a', '--archive', default=False, is_flag=True, help=options_help["archive"])
+@click.option('-u', '--upload', callback=set_upload_expiration, help=options_help["upload"])
+@click.option('-r', '--rules', help=options_help["rule"])
+@click.option('-b', '--batch', default=False, is_flag=True, help=options_help["batch"])
+@click.option('-ne', '--noexcl', default=False, is_flag=True, help=options_help["noexcl"])
+@click.option('-ng', '--nogit', default=False, is_flag=True, help=options_help["nogit"])
+@click.option('-kh', '--keephidden', default=False, is_flag=True, help=options_help["keephidden"])
+@click.option('-gi', '--gitignore', default=False, is_flag=True, help=options_help["gitignore"])
+@click.option('-hl', '--headless', default=False, is_flag=True, help=options_help["headless"])
+@click.option('-j', '--jobs', type=click.IntRange(min=1), help=options_help["jobs"])
+@click.option('-bj', '--batch-jobs', 'batch_jobs', type=click.IntRange(min=1), default=1, help=options_help["batch_jobs"])
+@click.option('-f', '--format', 'archive_format', type=click.Choice(list(ARCHIVE_FORMATS)), default='zip', help=options_help["format"])
+@click.option('-l', '--level', type=int, help=options_help["level"])
+@click.option('--stdout', default=False, is_flag=True, help=options_help["stdout"])
+@click.option('-i', '--incremental', default=False, is_flag=True, help=options_help["incremental"])
+@click.option('--store', 'use_store', default=False, is_flag=True, help=options_help["store"])
+@click.option('--link-dest', 'link_dest', default=False, is_flag=True, help=options_help["link_dest"])
+@click.option('-m', '--mirror', default=False, is_flag=True, help=options_help["mirror"])
+@click.option('--restore', 'restore_path', type=click.Path(exists=True, dir_okay=False), help=options_help["restore"])
+@click.option('--resume', default=False, is_flag=True, help=options_help["resume"])
+@click.option('-v', '--verbose', default=False, is_flag=True, help=options_help["verbose"])
+@click.option('--stats-json', 'stats_json', type=click.Path(dir_okay=False), help=options_help["stats_json"])
+@click.option('--profile', default=False, is_flag=True, help=options_help["profile"])
+def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidden, gitignore, headless, jobs, batch_jobs, archive_format, level, stdout, incremental, use_store, link_dest, mirror, restore_path, resume, verbose, stats_json, profile):
     """Dev projects backups made easy"""
 
     #####################
     # Variables declaration
 
     exec_time = time.time()
-    backup_sources = []
-    archiving_failed = False
     bad_target = False
+    # With --batch-jobs, the threads of each project get a share of the CPUs unless --jobs is given
     options = {
         'noexcl': noexcl,
         'nogit': nogit,
         'keephidden': keephidden,
+        'gitignore': gitignore,
+        'jobs': jobs or max(1, default_jobs() // batch_jobs),
+        'copy_jobs': jobs or max(2, copier.default_jobs() // batch_jobs),
+        'format': archive_format,
+        'level': level,
+        'incremental': incremental,
+        'link_dest': link_dest,
+        'mirror': mirror,
     }
 
     #####################
@@ -347,10 +1194,31 @@ def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidde
 
     uid = utils.suid()
     set_state('uid', uid)
+    if threading.current_thread() is threading.main_thread():
+        # Run by the installed command, not by the __main__ block below, the interruption is caught in this thread
+        signal(SIGINT, handle_sigint)
 
     if headless:
         activate_headless()
 
+    if gitignore:
+        activate_gitignore()
+
+    # -o - is the same as --stdout
+    if output and output.get('stdout'):
+        output = None
+        stdout = True
+    if stdout:
+        if batch or upload or incremental:
+            print_term('prep', 'E', 'Streaming to stdout can\'t be used with --batch, --upload or --incremental', )
+            exit(0)
+        if sys.stdout.isatty():
+            print_term('prep', 'E', 'Refusing to write an archive to a terminal, redirect stdout to a file or a pipe', )
+            exit(0)
+        # Keep stdout clean for the archive
+        activate_stderr()
+        archive = True
+
     paths = []
     def if_exists_add_key(param_dict, param_name):
         if param_dict:
@@ -382,7 +1250,15 @@ def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidde
             print_term('prep', 'E', f'Missing value for --{path["opt"]}', )
             exit(0)
 
-    if batch:
+    if resume and not batch:
+        print_term('prep', 'E', '--resume only applies to --batch', )
+        exit(0)
+
+    if batch_jobs > 1 and not batch:
+        print_term('prep', 'E', '--batch-jobs only applies to --batch', )
+        exit(0)
+
+    if verbose:
         force_verbose()
     if batch and not output:
         u_input = print_term('prep', 'W', 'You are about to backup your projects in the same folder. Continue (Y/N)? ',
@@ -393,6 +1269,36 @@ def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidde
             print_term('prep', 'I', 'Exiting shlerp', )
             exit(0)
 
+    if restore_path:
+        # The restored folder is named after the snapshot, like a duplicate made at that time
+        restore_name = os.path.basename(restore_path)[:-len(store.SNAPSHOT_EXT)]
+        restore_dst = f'{output["path"] if output else os.getcwd()}/{restore_name}'
+        if exists(restore_dst):
+            print_term('prep', 'E', f'The restore destination already exists: {restore_dst}', )
+            exit(0)
+        restore(restore_path, restore_dst, options)
+        return
+
+    if use_store and (archive or upload or stdout or incremental):
+        print_term('prep', 'E', '--store can\'t be used with --archive, --upload, --stdout or --incremental', )
+        exit(0)
+
+    if link_dest and (archive or upload or stdout or incremental or use_store):
+        print_term('prep', 'E', '--link-dest only applies to copies, it can\'t be used with --archive, --upload, --stdout, --incremental or --store', )
+        exit(0)
+
+    if mirror and (archive or upload or stdout or incremental or use_store or link_dest):
+        print_term('prep', 'E', '--mirror only applies to copies, it can\'t be used with --archive, --upload, --stdout, --incremental, --store or --link-dest', )
+        exit(0)
+
+    if incremental:
+        archive = True
+
+    format_error = check_format(archive_format, level)
+    if format_error:
+        print_term('prep', 'E', format_error, )
+        exit(0)
+
     is_upload = False
     if upload:
         try:
@@ -409,50 +1315,34 @@ def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidde
     #####################
     # Main logic
 
-    def get_backup_sources(**kwargs):
-        """Get the folder list to backup and scan each folder
-        to determine the programming language/framework used
-        """
-        batch_list = []
-        if batch:
-            batch_list = [f'{target["path"]}/{f}' for f in os.listdir(target['path'])]
-        else:
-            batch_list.append(target['path'])
-
-        for batch_elem in batch_list:
-            elem_rules = None
-            if os.path.isdir(batch_elem):
-                if len(kwargs) > 0 and kwargs['rules']:
-                    # Get rules from the --rule option, separated by semi colons
-                    elem_rules = [rule for rule in kwargs['rule'].lower().split(';')]
-                else:
-                    if not batch_elem.startswith('.'):
-                        print_term('scan', 'I', f'Scanning {batch_elem}', )
-                        elem_rules = auto_detect(batch_elem, )
-                if elem_rules:
-                    print_term('scan', 'I', f'Detected: {[rule["name"] for rule in elem_rules]}', )
-                    backup_sources.append({
-                        'proj_fld': batch_elem,
-                        'rules': elem_rules
-                    })
-                else:
-                    print_term('scan', 'W', f'The folder {batch_elem} won\'t be processed as automatic rule detection failed')
-                    append_state('ad_failures', batch_elem)
-                    incr_state('total')
-            if is_archive(batch_elem):
-                if upload:
-                    backup_sources.append({
-                        'proj_fld': batch_elem,
-                        'already_archived': True # already_archived will either be True, or non-existent at all
-                    })
+    settings = {
+        'batch': batch,
+        'archive': archive,
+        'use_store': use_store,
+        'mirror': mirror,
+        'upload': upload,
+        'is_upload': is_upload,
+        'expiration': expiration if is_upload else None,
+        'stdout': stdout,
+        'output': os.path.abspath(output['path']) if output else None,
+        'rules': None,
+        'options': options,
+        'stats_json': os.path.abspath(stats_json) if stats_json else None,
+        'profile': profile,
+        'uid': uid
+    }
+    if stats_json:
+        stats.enable(uid)
+    if profile:
+        # Exported on exit, whichever way the execution ends
+        profiler.start()
+        atexit.register(export_profile, uid)
 
     ################################################
     # 1 - Check options validity & prepare mandatory
     #     variables for data processing
 
-    if not rules:
-        get_backup_sources()
-    else:
+    if rules:
         # If a --rule has been provided by the user, check if it is valid
         with open(f'{get_setup_fld()}/rules.json', 'r') as read_file:
             _rules = json.load(read_file)
@@ -462,121 +1352,85 @@ def main(target, output, archive, upload, rules, batch, noexcl, nogit, keephidde
                     if str(rule).lower() == stored_rule['name'].lower():
                         stored_rules.append(stored_rule)
             if stored_rules:
-                if batch:
-                    get_backup_sources(rules=stored_rules)
-                else:
-                    backup_sources.append({
-                        'proj_fld': target['path'],
-                        'rules': stored_rules
-                    })
+                settings['rules'] = stored_rules
                 matched = True
             if not matched:
                 print_term('scan', 'E', 'Rule name not found', )
                 exit(0)
 
+    batch_list = []
+    if batch:
+        batch_list = [f'{target["path"]}/{f}' for f in os.listdir(target['path'])]
+    else:
+        batch_list.append(target['path'])
+
+    if batch and not state('debug'):
+        jrnl = open_journal(target['path'], settings, resume)
+        if resume:
+            remaining = [
+                batch_elem for batch_elem in batch_list
+                if not journal.completed(jrnl['journal'], batch_elem, is_upload)
+            ]
+            print_term('prep', 'I', f'{len(batch_list) - len(remaining)} projects already backed up are skipped', )
+            batch_list = remaining
+        if batch_jobs > 1:
+            # Each project is scanned and backed up in its own process
+            run_parallel_batch(batch_list, settings, batch_jobs, jrnl)
+        else:
+            # Scanning, backing up and uploading overlap from one project to the next
+            run_pipelined_batch(batch_list, settings, jrnl)
+        if not (state('failures') or state('upload_failures')):
+            # Nothing left to resume, the folders that aren't projects would fail the same way again
+            os.remove(jrnl['path'])
+            set_state('journal', None)
+        print_summary(settings, exec_time)
+        if stats_json:
+            write_stats(settings)
+        return
+
+    backup_sources = []
+    for batch_elem in batch_list:
+        backup = detect_project(batch_elem, settings)
+        if backup:
+            backup_sources.append(backup)
+
     # At this point we should have a list containing at least one project to process
 
     # If we don't have a particular output folder, use the same as the project
-    if output:
-        output = os.path.abspath(output['path'])
-        for backup in backup_sources:
-            project_name = backup['proj_fld'].split('/')[-1]
-            backup['dst'] = f'{output}/{project_name}_{utils.get_dt()}'
-    else:
-        for backup in backup_sources:
-            # If the current path to backup is already an archive, just set the  project folder as the backup dest.
-            # The goal is for the rest of the code to just use backup['dst'] instead of using a condition
-            backup['dst'] = f'{backup["proj_fld"]}_{utils.get_dt()}' \
-            if not backup.get('already_archived') \
-            else backup['proj_fld']
+    for backup in backup_sources:
+        set_destination(backup, settings)
     # At this point we should have the dst incorporated into the backup_job list
 
     ###################################
     # 2 - Data processing, show progress
     if not state('debug'):
-        incr_state('total', len(backup_sources))
+        incr_state('total', len(backup_sources) + len(state('ad_failures')))
         for backup in backup_sources:
-            start_time = time.time()
-            show_state = True if batch else False
-            count = ''
-            if show_state: # Used to display information
-                count = f'{(len(state("backed_up")) + len(state("failures"))) + 1}/{state("total")}'
-
-            if batch: # Used to display information
-                print_term('arch' if archive else 'copy', 'I', f'Processing: {backup["proj_fld"]}',   cnt=count)
-
-            if archive and not backup.get('already_archived'):
-                # If --archive is provided to the script, we use make_archive()
-                make_archive(
-                    backup['proj_fld'], backup['dst'],
-                    backup['rules'], options,
-                    uid, start_time, count
-                )
-            if not archive:
-                # Else if we don't want an archive we will do a copy of the project instead
-                duplicate(
-                    backup['proj_fld'], backup['dst'],
-                    backup['rules'], options,
-                    uid, start_time, count
-                )
-
-            if is_upload:
-                step = 'uplo'
-                zip_path = ''
-
-                # The zip file name has to be defined differently depending if the --target was already an archive or not
-                if backup.get('already_archived'):
-                    zip_path = backup['dst']
-                elif backup['proj_fld'] in state('backed_up'):
-                    zip_path = f'{backup["dst"]}.zip'
-                else:
-                    print_term(step, 'E', 'Archiving process failed - skipping upload', )
-                    archiving_failed = True
-
-                if not archiving_failed:
-                    archive_size_mb = utils.get_file_size(zip_path)
-                    archive_size_gb = archive_size_mb / 1024  # Convert MB to GB
-                    if archive_size_gb > 2:  # 2 GB limit
-                        print_term(step, 'E', f'File size is too big: {archive_size_gb:.2f} GB', )
-                    else:
-                        response = upload_archive(zip_path, expiration)
-                        json_resp = response.json()
-                        if json_resp['success']:
-                            expiry_message = time_until_expiry(json_resp['expires'])
-                            print_term(step, 'I', f'🔗 Single use: {json_resp["link"]} - {expiry_message}',   cnt=count)
-                        else:
-                            append_state('upload_failures', backup['proj_fld'])
-                            print_term(step, 'E', f'Upload failed: {json_resp["error"]}',   cnt=count)
-
-            if batch:  # Used to display information
-                failed_cnt = len(state('failures')) + len(state('ad_failures'))
-                backed_up_cnt = len(state('backed_up'))
-
-                # This condition is there to make sure we got through the whole list of projects
-                # before displaying the stats
-                if backed_up_cnt + failed_cnt == state('total'):
-                    step = 'stat'
-                    summary = f'Successful: {backed_up_cnt} - ' \
-                            f'Failed: {failed_cnt} - ' \
-                            f'Total runtime: {"%.2f" % (time.time() - exec_time)}s'
-                    # Display which kind of operation has been done during current execution
-                    operation = 'Upload' if upload else 'Archive' if archive else 'Copy'
-                    print_term(step, 'I', summary, )
-                    if len(state('ad_failures')) > 0:
-                        print_term(step, 'W', f'Detection failures: {state("ad_failures")}', )
-                    if len(state('failures')) > 0:
-                        print_term(step, 'W', operation, f'Backup failures: {state("failures")}', )
-                    if len(state('upload_failures')) > 0:
-                        print_term(step, 'W', f'Upload failures: {state("upload_failures")}', )
+            process_backup(backup, settings, '')
+            upload_backup(backup, settings, '')
+        if stats_json:
+            write_stats(settings)
 
 
 def handle_sigint(signalnum, frame):
-    print_term(get_printed()['step'], 'E', f'SIGINT: Interrupted by user', state('uid'))
-    sys.exit()
+    # The batch running in the other threads stops as well
+    utils.interrupted.set()
+    # Nothing is recorded as printed in headless mode
+    step = get_printed()['step'] if state('printed') else 'prep'
+    print_term(step, 'E', 'SIGINT: Interrupted by user', )
+    if state('journal'):
+        print_term('prep', 'I', f'Run the same command with --resume to carry on with this batch ({state("journal")})', )
+    utils.flush_logs()
+    # What runs on the main thread stops and cleans up like on a plain Ctrl-C
+    raise KeyboardInterrupt
 
 
 if __name__ == '__main__':
     signal(SIGINT, handle_sigint)
     t = threading.Thread(target=main)
     t.start()
-    t.join()
\ No newline at end of file
+    try:
+        t.join()
+    except KeyboardInterrupt:
+        # main() stops at its next check of utils.interrupted, the exit waits for it
+        sys.exit()
\ No newline at end of file
@@ -0,0 +1,460 @@
+###############################################################
+# This file features the archive writers used by make_archive.
+# Zip members are compressed by a pool of threads (zlib releases
+# the GIL) while a single writer emits them in order into the
+# archive, tar streams are compressed as a whole.
+
+from . import stats
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT
+import mimetypes
+import hashlib
+import tarfile
+import struct
+import stat
+import time
+import io
+import gzip
+import lzma
+import zlib
+import os
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Supported archive formats, with their default and allowed compression levels
+ARCHIVE_FORMATS = {
+    'zip': {'level': 9, 'levels': (0, 9)},
+    'tar.gz': {'level': 9, 'levels': (0, 9)},
+    'tar.xz': {'level': 6, 'levels': (0, 9)},
+    'tar.zst': {'level': 3, 'levels': (1, 22)},
+}
+
+# Files bigger than this are compressed as several chunks, in parallel
+CHUNK_SIZE = 1 << 20
+# Size of the deflate window, each chunk is primed with the data that precedes it
+DICT_SIZE = 1 << 15
+# Zip flag and signature used when the sizes are written after the member data
+DATA_DESCRIPTOR_FLAG = 0x08
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
+# Formats that are already compressed, deflating them again only costs CPU
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.heic',
+    '.woff', '.woff2',
+    '.zip', '.jar', '.war', '.ear', '.aar', '.apk', '.ipa', '.whl', '.egg', '.nupkg', '.xpi', '.crx',
+    '.gz', '.tgz', '.bz2', '.tbz2', '.xz', '.txz', '.lz', '.lzma', '.zst', '.br', '.7z', '.rar', '.cab',
+    '.mp3', '.m4a', '.aac', '.ogg', '.oga', '.opus', '.flac',
+    '.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub',
+}
+# Types of the archives that are already compressed. A plain tar isn't, it deflates as well as its content
+COMPRESSED_TYPES = {
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+    'application/x-7z-compressed', 'application/x-rar-compressed', 'application/vnd.rar', 'application/zstd',
+    'application/java-archive', 'application/vnd.android.package-archive', 'application/epub+zip',
+}
+# Image types that are not compressed by their format
+COMPRESSIBLE_IMAGE_TYPES = {'image/svg+xml', 'image/bmp', 'image/x-ms-bmp', 'image/tiff', 'image/x-icon', 'image/vnd.microsoft.icon'}
+# Types that are known to deflate well, they skip the probe
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'application/x-sh', 'application/sql'}
+# Size of the sample used to probe the files we don't know anything about
+PROBE_SIZE = 1 << 16
+
+
+def default_jobs():
+    """
+    :return: the number of compression threads to use when --jobs isn't provided
+    """
+    return os.cpu_count() or 1
+
+
+def compression_policy(path, level):
+    """Picks how a member should be compressed from its extension or MIME type
+    :param path: text, the path of the file
+    :param level: number, the deflate compression level used for compressible files
+    :return: a tuple (compress type, level), or None if the content has to be probed
+    """
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return ZIP_STORED, None
+    mime_type, encoding = mimetypes.guess_type(path)
+    if encoding or mime_type in COMPRESSED_TYPES:
+        return ZIP_STORED, None
+    if mime_type:
+        if mime_type.startswith(('audio/', 'video/')):
+            return ZIP_STORED, None
+        if mime_type.startswith('image/') and mime_type not in COMPRESSIBLE_IMAGE_TYPES:
+            return ZIP_STORED, None
+        if (
+            mime_type.startswith('text/') or
+            mime_type in COMPRESSIBLE_TYPES or
+            mime_type.endswith(('+xml', '+json'))
+        ):
+            return ZIP_DEFLATED, level
+    return None
+
+
+def probe_policy(sample, level):
+    """Picks how a member should be compressed by trying to compress the beginning of its content
+    :param sample: bytes, the first block of the file
+    :param level: number, the deflate compression level used for compressible files
+    :return: a tuple (compress type, level)
+    """
+    if len(sample) < 512:
+        return ZIP_DEFLATED, level
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    if ratio > 0.95:
+        # Random looking data, compressing it would only make it bigger
+        return ZIP_STORED, None
+    if ratio > 0.8:
+        # Higher levels barely do better than level 1 on this kind of data, but cost way more CPU
+        return ZIP_DEFLATED, 1
+    return ZIP_DEFLATED, level
+
+
+def compress_file(path, policy, level):
+    """Compresses a whole file in a single raw deflate stream, or stores it as is
+    :param path: text, the path of the file to compress
+    :param policy: tuple (compress type, level) or None to probe the content first
+    :param level: number, the deflate compression level used for compressible files
+    :return: a tuple (crc, uncompressed size, payload, compress type, content digest)
+    """
+    with open(path, 'rb') as src:
+        data = src.read()
+    digest = hashlib.sha256(data).hexdigest()
+    compress_type, level = policy or probe_policy(data[:PROBE_SIZE], level)
+    if compress_type == ZIP_STORED:
+        return zlib.crc32(data), len(data), data, ZIP_STORED, digest
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush()
+    return zlib.crc32(data), len(data), payload, ZIP_DEFLATED, digest
+
+
+def compress_chunk(path, offset, policy, last):
+    """Compresses one chunk of a big file so that the chunks can be concatenated into a single deflate stream.
+    The compressor is primed with the 32KB that precede the chunk, so the ratio stays close to a sequential deflate.
+    :param path: text, the path of the file to compress
+    :param offset: number, where the chunk starts in the file
+    :param policy: tuple (compress type, level)
+    :param last: boolean, True if this is the last chunk of the file, which is then read until its end
+    :return: a tuple (uncompressed data, compressed payload)
+    """
+    compress_type, level = policy
+    if compress_type == ZIP_STORED:
+        with open(path, 'rb') as src:
+            src.seek(offset)
+            data = src.read() if last else src.read(CHUNK_SIZE)
+        return data, data
+    with open(path, 'rb') as src:
+        zdict = b''
+        if offset:
+            src.seek(offset - DICT_SIZE)
+            zdict = src.read(DICT_SIZE)
+        data = src.read() if last else src.read(CHUNK_SIZE)
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    payload = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return data, payload
+
+
+def plan_tasks(pool, entries, level):
+    """Turns the walked entries into compression tasks, submitted lazily to the pool
+    :param pool: ThreadPoolExecutor running the compression
+    :param entries: iterable of tuples (path, arcname, is_dir)
+    :param level: number, the deflate compression level
+    :return: a generator of task dictionaries, in the archive order
+    """
+    # The time the workers spend compressing is reported with --stats-json
+    compress_whole = stats.timed(compress_file, 'compression')
+    compress_part = stats.timed(compress_chunk, 'compression')
+    for path, arcname, is_dir in entries:
+        task = {'path': path, 'arcname': arcname, 'is_dir': is_dir, 'error': None}
+        if is_dir:
+            yield task
+            continue
+        try:
+            zinfo = ZipInfo.from_file(path, arcname)
+            if not stat.S_ISREG(zinfo.external_attr >> 16):
+                # Reading a named pipe or a device would block or never end
+                raise OSError(f'{path} is not a regular file')
+        except Exception as exc:
+            task['error'] = exc
+            yield task
+            continue
+        task['zinfo'] = zinfo
+        policy = compression_policy(path, level)
+        chunks = max(1, -(-zinfo.file_size // CHUNK_SIZE))
+        if chunks == 1:
+            # Small files are probed by the worker thread, while it reads them
+            task['future'] = pool.submit(compress_whole, path, policy, level)
+            yield task
+        else:
+            if not policy:
+                try:
+                    with open(path, 'rb') as src:
+                        policy = probe_policy(src.read(PROBE_SIZE), level)
+                except Exception as exc:
+                    task['error'] = exc
+                    yield task
+                    continue
+            zinfo.compress_type = policy[0]
+            for index in range(chunks):
+                last = index == chunks - 1
+                yield dict(
+                    task,
+                    future=pool.submit(compress_part, path, index * CHUNK_SIZE, policy, last),
+                    chunk=index,
+                    last=last
+                )
+
+
+def write_header(zip_archive, zinfo, zip64):
+    """Registers a new member and writes its local header at the end of the archive"""
+    zip_archive._writecheck(zinfo)
+    zip_archive._didModify = True
+    if zip_archive._seekable:
+        zip_archive.fp.seek(zip_archive.start_dir)
+    zinfo.header_offset = zip_archive.fp.tell()
+    zip_archive.fp.write(zinfo.FileHeader(zip64))
+
+
+def close_member(zip_archive, zinfo):
+    """Adds a fully written member to the central directory of the archive"""
+    zip_archive.start_dir = zip_archive.fp.tell()
+    zip_archive.filelist.append(zinfo)
+    zip_archive.NameToInfo[zinfo.filename] = zinfo
+
+
+def write_parallel(zip_archive, entries, jobs, level=9):
+    """Writes the given entries into a zip archive, compressing them with a pool of threads.
+    The compressed payloads are written in the same order as the entries, by this thread only,
+    and the central directory is still written by ZipFile.close() so the output is a standard zip.
+    :param zip_archive: ZipFile opened in write mode
+    :param entries: iterable of tuples (path, arcname, is_dir), as yielded by utils.walk_kept()
+    :param jobs: number of compression threads
+    :param level: number, the deflate compression level
+    :return: a generator of tuples (arcname, is_dir, error, digest) for each member, once written.
+    error is None when the member has been added to the archive, digest is the sha256 of the file content
+    """
+    window = jobs * 2 + 2
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        tasks = plan_tasks(pool, entries, level)
+        # Chunked member currently being written, with its running crc and sizes
+        current = None
+
+        def write_task(task):
+            nonlocal current
+            if task['error']:
+                return task['arcname'], task['is_dir'], task['error'], None
+            if task['is_dir']:
+                zip_archive.write(task['path'], task['arcname'])
+                return task['arcname'], True, None, None
+
+            zinfo = task['zinfo']
+            if 'chunk' not in task:
+                try:
+                    crc, size, payload, zinfo.compress_type, digest = task['future'].result()
+                except Exception as exc:
+                    return task['arcname'], False, exc, None
+                zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc, size, len(payload)
+                zip64 = size > ZIP64_LIMIT or len(payload) > ZIP64_LIMIT
+                write_header(zip_archive, zinfo, zip64)
+                zip_archive.fp.write(payload)
+                close_member(zip_archive, zinfo)
+                return task['arcname'], False, None, digest
+
+            # Chunked members are streamed, their crc and sizes are only known after the data has been written
+            if task['chunk'] == 0:
+                current = {'crc': 0, 'hash': hashlib.sha256(), 'size': 0, 'compress_size': 0, 'error': None, 'started': False}
+            if not current['error']:
+                try:
+                    data, payload = task['future'].result()
+                    if not current['started']:
+                        # Placeholders, like ZipFile does before the data is written
+                        zinfo.CRC = zinfo.compress_size = 0
+                        if not zip_archive._seekable:
+                            zinfo.flag_bits |= DATA_DESCRIPTOR_FLAG
+                        current['zip64'] = zinfo.file_size * 1.05 > ZIP64_LIMIT
+                        write_header(zip_archive, zinfo, current['zip64'])
+                        current['started'] = True
+                    zip_archive.fp.write(payload)
+                    current['crc'] = zlib.crc32(data, current['crc'])
+                    current['hash'].update(data)
+                    current['size'] += len(data)
+                    current['compress_size'] += len(payload)
+                except Exception as exc:
+                    current['error'] = exc
+            else:
+                task['future'].cancel()
+            if not task['last']:
+                return None
+
+            if current['error']:
+                # The partial data stays out of the central directory, so the rest of the archive remains valid
+                zip_archive.start_dir = zip_archive.fp.tell()
+                return task['arcname'], False, current['error'], None
+            zinfo.CRC, zinfo.file_size, zinfo.compress_size = current['crc'], current['size'], current['compress_size']
+            if not current['zip64'] and max(zinfo.file_size, zinfo.compress_size) > ZIP64_LIMIT:
+                zip_archive.start_dir = zip_archive.fp.tell()
+                return task['arcname'], False, RuntimeError('File size too large, it grew while being archived'), None
+            if zinfo.flag_bits & DATA_DESCRIPTOR_FLAG:
+                fmt = '<LLQQ' if current['zip64'] else '<LLLL'
+                zip_archive.fp.write(struct.pack(fmt, DATA_DESCRIPTOR_SIGNATURE, zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+            else:
+                # Same as ZipFile: go back to the local header to write the crc and sizes into it
+                end = zip_archive.fp.tell()
+                zip_archive.fp.seek(zinfo.header_offset)
+                zip_archive.fp.write(zinfo.FileHeader(current['zip64']))
+                zip_archive.fp.seek(end)
+            close_member(zip_archive, zinfo)
+            return task['arcname'], False, None, current['hash'].hexdigest()
+
+        for task in tasks:
+            pending.append(task)
+            while len(pending) >= window:
+                written = write_task(pending.popleft())
+                if written:
+                    yield written
+        while pending:
+            written = write_task(pending.popleft())
+            if written:
+                yield written
+
+
+#####################
+# Archive writers
+
+class ZipWriter:
+    """Writes a zip archive, members being compressed in parallel by write_parallel()"""
+
+    def __init__(self, fileobj, level, jobs):
+        self.jobs = jobs
+        self.level = level
+        self.zip_archive = ZipFile(fileobj, 'w', ZIP_DEFLATED, compresslevel=level)
+
+    def write(self, entries):
+        """
+        :param entries: iterable of tuples (path, arcname, is_dir), as yielded by utils.walk_kept()
+        :return: a generator of tuples (arcname, is_dir, error, digest) for each member, once written
+        """
+        yield from write_parallel(self.zip_archive, entries, self.jobs, self.level)
+
+    def add_bytes(self, arcname, data):
+        """Adds a member made of in-memory data"""
+        self.zip_archive.writestr(arcname, data)
+
+    def close(self):
+        self.zip_archive.close()
+
+
+class HashingReader:
+    """File wrapper computing the sha256 of the content while tarfile reads it.
+    The header of the member is already written when the file is read: if the file shrank in the meantime or
+    can't be read anymore, the member is padded with zeros up to the size of its header, and the error is kept.
+    A shorter member would corrupt the rest of the stream.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.error = None
+
+    def read(self, size=-1):
+        data = b''
+        if not self.error:
+            try:
+                data = self.fileobj.read(size)
+            except OSError as exc:
+                self.error = exc
+            self.hash.update(data)
+        if 0 <= len(data) < size:
+            if not self.error:
+                self.error = OSError(f'{self.fileobj.name} shrank while being archived, its member is padded with zeros')
+            data += bytes(size - len(data))
+        return data
+
+
+class TarWriter:
+    """Writes a tar stream, compressed as a whole (solid compression) by the given compressor"""
+
+    def __init__(self, fileobj, compression, level, jobs):
+        if compression == 'gz':
+            self.compressor = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level)
+        elif compression == 'xz':
+            self.compressor = lzma.LZMAFile(fileobj, 'wb', preset=level)
+        else:
+            # zstd compresses the stream with its own pool of threads
+            self.compressor = zstandard.ZstdCompressor(level=level, threads=jobs).stream_writer(fileobj, closefd=False)
+        self.tar_archive = tarfile.open(fileobj=self.compressor, mode='w|', format=tarfile.PAX_FORMAT)
+
+    def write(self, entries):
+        """
+        :param entries: iterable of tuples (path, arcname, is_dir), as yielded by utils.walk_kept()
+        :return: a generator of tuples (arcname, is_dir, error, digest) for each member, once written
+        """
+        for path, arcname, is_dir in entries:
+            try:
+                tarinfo = self.tar_archive.gettarinfo(path, arcname)
+                src = open(path, 'rb') if tarinfo.isreg() else None
+            except Exception as exc:
+                yield arcname, is_dir, exc, None
+                continue
+            # Once the header is written, the errors of the file are handled by the reader,
+            # the ones of the archive itself end it, the stream can't go on after a partial member
+            if src is None:
+                self.tar_archive.addfile(tarinfo)
+                yield arcname, is_dir, None, None
+                continue
+            with src:
+                reader = HashingReader(src)
+                self.tar_archive.addfile(tarinfo, reader)
+            if reader.error:
+                yield arcname, is_dir, reader.error, None
+            else:
+                yield arcname, is_dir, None, reader.hash.hexdigest()
+
+    def add_bytes(self, arcname, data):
+        """Adds a member made of in-memory data"""
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        tarinfo.mtime = int(time.time())
+        self.tar_archive.addfile(tarinfo, io.BytesIO(data))
+
+    def close(self):
+        self.tar_archive.close()
+        self.compressor.close()
+
+
+def check_format(fmt, level):
+    """Checks that an archive format can be used with the given compression level
+    :param fmt: text, one of the ARCHIVE_FORMATS keys
+    :param level: number or None to use the default level of the format
+    :return: an error message, or None if the format can be used
+    """
+    if fmt == 'tar.zst' and not zstandard:
+        return 'The tar.zst format requires the zstandard package: pip install zstandard'
+    if level is not None:
+        lowest, highest = ARCHIVE_FORMATS[fmt]['levels']
+        if not lowest <= level <= highest:
+            return f'The compression level for {fmt} must be between {lowest} and {highest}'
+    return None
+
+
+def open_archive(fileobj, fmt, level=None, jobs=1):
+    """Opens an archive writer for the given format
+    :param fileobj: binary file object the archive is written to
+    :param fmt: text, one of the ARCHIVE_FORMATS keys
+    :param level: number or None to use the default level of the format
+    :param jobs: number of threads the writer can use to compress
+    :return: a ZipWriter or a TarWriter
+    """
+    if level is None:
+        level = ARCHIVE_FORMATS[fmt]['level']
+    if fmt == 'zip':
+        return ZipWriter(fileobj, level, jobs)
+    return TarWriter(fileobj, fmt.split('.')[1], level, jobs)
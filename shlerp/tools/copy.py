@@ -0,0 +1,262 @@
+###############################################################
+# This file features the copy engine used by duplicate.
+# The content of the files is copied by the kernel whenever it
+# is possible: reflinks share the blocks on btrfs/XFS, then
+# copy_file_range and sendfile avoid the round trip through
+# user space. Buffered copying is only the last resort.
+# Trees are copied by a pool of threads, so that the latency of
+# the syscalls made for each small file overlaps.
+
+from .utils import walk_kept
+from . import stats
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import shutil
+import errno
+import stat
+import re
+import os
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request cloning a whole file, from linux/fs.h
+FICLONE = 0x40049409
+# Bytes requested to the kernel per call
+COPY_SIZE = 1 << 30
+BUFFER_SIZE = 1 << 20
+
+def default_jobs():
+    """
+    :return: the number of copy threads to use when --jobs isn't provided
+    """
+    # Copying is bound by the I/O latency rather than the CPU, so more threads than CPUs pay off
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+# Strategies that failed between two devices, they aren't tried again for the same pair
+unsupported = {}
+
+
+def reflink(fsrc, fdst):
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def range_copy(fsrc, fdst):
+    while os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_SIZE):
+        pass
+
+
+def send_copy(fsrc, fdst):
+    while os.sendfile(fdst.fileno(), fsrc.fileno(), None, COPY_SIZE):
+        pass
+
+
+def buffered_copy(fsrc, fdst):
+    shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+
+
+# Tried in this order, the unavailable ones are left out
+STRATEGIES = [
+    (name, func) for name, func, available in (
+        ('reflink', reflink, fcntl is not None and os.uname().sysname == 'Linux'),
+        ('copy_file_range', range_copy, hasattr(os, 'copy_file_range')),
+        ('sendfile', send_copy, hasattr(os, 'sendfile')),
+        ('buffered', buffered_copy, True)
+    ) if available
+]
+
+
+def copy_file(src, dst):
+    """Copies the content and the metadata of a file, like shutil.copy2() does,
+    with the fastest strategy supported between the two filesystems.
+    :param src: text, the path of the file to copy
+    :param dst: text, the path of the copy
+    :return: text, the name of the strategy that copied the content
+    """
+    if not stat.S_ISREG(os.stat(src).st_mode):
+        # Opening a named pipe or a device would block or never end, shutil.copyfile() refuses them as well
+        raise shutil.SpecialFileError(f'{src} is not a regular file')
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_dev = os.fstat(fsrc.fileno()).st_dev
+        dst_dev = os.fstat(fdst.fileno()).st_dev
+        failed = unsupported.setdefault((src_dev, dst_dev), set())
+        if src_dev != dst_dev:
+            # Blocks can't be shared between two filesystems
+            failed.add('reflink')
+        for name, func in STRATEGIES:
+            if name in failed and name != 'buffered':
+                continue
+            try:
+                func(fsrc, fdst)
+                break
+            except OSError as exc:
+                # Only fall back if nothing has been copied yet, a real I/O error is raised as is
+                if name == 'buffered' or exc.errno == errno.ENOSPC or fdst.tell() or os.fstat(fdst.fileno()).st_size:
+                    raise
+                failed.add(name)
+                fsrc.seek(0)
+    shutil.copystat(src, dst)
+    return name
+
+
+def find_previous_copy(dst):
+    """Finds the most recent copy of the same project, made next to the one we are about to make
+    :param dst: text, the path of the copy we are about to make, named like {project_name}_{get_dt()}
+    :return: the path of the previous copy, or None if there isn't any
+    """
+    dst_fld, dst_name = os.path.split(dst)
+    project_name = dst_name.rsplit('_', 1)[0]
+    pattern = re.compile(rf'^{re.escape(project_name)}_\d{{8}}#\d{{6}}$')
+    try:
+        candidates = sorted(
+            name for name in os.listdir(dst_fld or '.')
+            if pattern.match(name) and name != dst_name and os.path.isdir(os.path.join(dst_fld, name))
+        )
+    except OSError:
+        return None
+    # The datetime in the name sorts the same way as the time
+    return os.path.join(dst_fld, candidates[-1]) if candidates else None
+
+
+def link_or_copy(src, dst, prev):
+    """Hard links the file of the previous copy if the file didn't change since then, copies it otherwise
+    :param src: text, the path of the file to copy
+    :param dst: text, the path of the copy
+    :param prev: text, the path of the same file in the previous copy
+    :return: text, the name of the strategy used
+    """
+    try:
+        src_stat = os.stat(src)
+        prev_stat = os.lstat(prev)
+        if (src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_mode) == \
+                (prev_stat.st_size, prev_stat.st_mtime_ns, prev_stat.st_mode):
+            os.link(prev, dst)
+            return 'hardlink'
+    except OSError:
+        # Missing in the previous copy, on another filesystem or too many links: the file is copied
+        pass
+    return copy_file(src, dst)
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def sync_file(src, dst):
+    """Copies a file over its mirror, unless the mirror already has the same size, mtime and mode
+    :param src: text, the path of the file to copy
+    :param dst: text, the path of the mirrored file
+    :return: text, the name of the strategy used, "unchanged" if nothing had to be copied
+    """
+    src_stat = os.stat(src)
+    try:
+        dst_stat = os.lstat(dst)
+        if stat.S_ISREG(dst_stat.st_mode) and (src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_mode) == \
+                (dst_stat.st_size, dst_stat.st_mtime_ns, dst_stat.st_mode):
+            return 'unchanged'
+        if stat.S_ISDIR(dst_stat.st_mode):
+            shutil.rmtree(dst)
+    except FileNotFoundError:
+        pass
+    # Copied aside then renamed, so an interrupted sync never leaves a truncated file in the mirror
+    tmp_path = f'{dst}.shlerp.tmp'
+    strategy = copy_file(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return strategy
+
+
+def copy_tree(entries, dst, jobs, link_dest=None, mirror=False):
+    """Copies a list of entries into an existing folder.
+    Folders are created in the walk order, before their content, while the files are copied by a pool of threads.
+    The results are yielded in the walk order too: the result of a folder waits for the files listed before it.
+    The metadata of the folders is applied last, since adding files into a folder changes its mtime.
+    :param entries: iterable of tuples (path, relative path, is_dir), parents always coming before their content
+    :param dst: text, the destination folder
+    :param jobs: number of threads copying the files
+    :param link_dest: text, a previous copy whose unchanged files are hard linked instead of copied, or None
+    :param mirror: boolean, True to sync dst with the entries: only the files that differ are copied,
+    and what isn't part of the entries anymore is deleted from dst
+    :return: a generator of tuples (relative path, is_dir, error, strategy) for each entry,
+    followed in mirror mode by (relative path, is_dir, error, "deleted") for each deleted path
+    """
+    folders = []
+    kept = set()
+    # The time the workers spend copying is reported with --stats-json
+    sync_task = stats.timed(sync_file, 'copy')
+    link_task = stats.timed(link_or_copy, 'copy')
+    copy_task = stats.timed(copy_file, 'copy')
+
+    def drain(pending, limit):
+        while len(pending) > limit:
+            rel_name, future, error = pending.popleft()
+            if future is None:
+                # A folder, created when it was listed
+                yield rel_name, True, error, None
+                continue
+            try:
+                yield rel_name, False, None, future.result()
+            except Exception as exc:
+                yield rel_name, False, exc, None
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for src, rel_name, is_dir in entries:
+            full_dst = f'{dst}/{rel_name}'
+            if mirror:
+                kept.add(rel_name)
+            if is_dir:
+                try:
+                    if os.path.islink(src):
+                        # Linked folders are kept as links, following them could loop
+                        target = os.readlink(src)
+                        if mirror and os.path.lexists(full_dst):
+                            if not (os.path.islink(full_dst) and os.readlink(full_dst) == target):
+                                # Whatever is in the way of the link in the mirror is replaced, even a real folder
+                                remove_path(full_dst)
+                        if not os.path.lexists(full_dst):
+                            os.symlink(target, full_dst)
+                    else:
+                        if mirror and os.path.lexists(full_dst) and (os.path.islink(full_dst) or not os.path.isdir(full_dst)):
+                            # Whatever is in the way of a folder in the mirror is replaced
+                            remove_path(full_dst)
+                        if not (mirror and os.path.isdir(full_dst)):
+                            os.mkdir(full_dst)
+                        folders.append((src, full_dst))
+                    pending.append((rel_name, None, None))
+                except OSError as exc:
+                    pending.append((rel_name, None, exc))
+                continue
+            if mirror:
+                future = pool.submit(sync_task, src, full_dst)
+            elif link_dest:
+                future = pool.submit(link_task, src, full_dst, f'{link_dest}/{rel_name}')
+            else:
+                future = pool.submit(copy_task, src, full_dst)
+            pending.append((rel_name, future, None))
+            yield from drain(pending, jobs * 4)
+        yield from drain(pending, 0)
+
+    if mirror:
+        # The mirror is listed before deleting anything, the content of a deleted folder is skipped
+        deleted = set()
+        for elem_path, rel_name, is_dir in list(walk_kept(dst)):
+            parts = rel_name.split('/')
+            if rel_name in kept or any('/'.join(parts[:index]) in deleted for index in range(1, len(parts))):
+                continue
+            try:
+                remove_path(elem_path)
+                deleted.add(rel_name)
+                yield rel_name, is_dir, None, 'deleted'
+            except OSError as exc:
+                yield rel_name, is_dir, exc, 'deleted'
+
+    for src, full_dst in reversed(folders):
+        try:
+            shutil.copystat(src, full_dst)
+        except OSError:
+            pass
@@ -0,0 +1,107 @@
+###############################################################
+# This file features the exclusion matcher that is shared by
+# the scanner, the duplication and the archiving functions so
+# that every exclusion decision is taken the same way
+
+from .gitignore import GitignoreMatcher
+import os
+
+
+class ExclusionMatcher:
+    """Decides if a path relative to the project folder should be excluded.
+    Entries are matched against whole path components (set lookups) instead of substrings,
+    so that "vendor" excludes "vendor/" and "lib/vendor/" but not "myvendorlib/".
+    """
+
+    def __init__(self, files=(), folders=(), dep_folders=()):
+        self.files = set(files)
+        self.folders = set()
+        # Entries made of several components, like "storage/logs"
+        self.folder_paths = []
+        for folder in set(folders) | set(dep_folders):
+            parts = tuple(part for part in folder.strip('/').split('/') if part)
+            if len(parts) == 1:
+                self.folders.add(parts[0])
+            elif parts:
+                self.folder_paths.append(parts)
+
+    def __bool__(self):
+        return bool(self.files or self.folders or self.folder_paths)
+
+    def excluded(self, rel_path, is_dir=False):
+        """Check if a path should be excluded
+        :param rel_path: text, the path relative to the project folder
+        :param is_dir: boolean, True if the path is a folder
+        :return: True if one of the path components matches an exclusion
+        """
+        if not rel_path or rel_path == '.':
+            return False
+        parts = rel_path.split(os.sep)
+        if parts[-1] in self.files:
+            return True
+        folders = parts if is_dir else parts[:-1]
+        for part in folders:
+            if part in self.folders:
+                return True
+        if self.folder_paths:
+            for seq in self.folder_paths:
+                size = len(seq)
+                for index in range(len(folders) - size + 1):
+                    if tuple(folders[index:index + size]) == seq:
+                        return True
+        return False
+
+    def excluded_entry(self, parent_parts, name, is_dir):
+        """Check a single folder entry whose parent folder is already known to be kept.
+        Only the new component has to be looked up, which is what the traversal hot loops use.
+        :param parent_parts: tuple of the path components of the parent folder, relative to the project
+        :param name: text, the name of the entry
+        :param is_dir: boolean, True if the entry is a folder
+        :return: True if the entry should be excluded
+        """
+        if name in self.files:
+            return True
+        if is_dir:
+            if name in self.folders:
+                return True
+            if self.folder_paths:
+                parts = parent_parts + (name,)
+                for seq in self.folder_paths:
+                    if parts[-len(seq):] == seq:
+                        return True
+        return False
+
+
+def compile_exclusions(rules, options=None, exclude_deps=False, root=None):
+    """Merges the exclusions of the given rules into a single matcher, built once per project
+    :param rules: list of dictionaries/objects representing the rules/languages corresponding to the project
+    :param options: dictionary/object containing exclusion options
+    :param exclude_deps: boolean, True to keep excluding the dependency folders when noexcl is set
+    :param root: text, the project folder, needed to honor its .gitignore files when the gitignore option is set
+    :return: an ExclusionMatcher, or a GitignoreMatcher wrapping it
+    """
+    options = options or {}
+    files = {'.DS_Store'}
+    folders = set()
+    dep_folders = set()
+
+    if not options.get('noexcl'):
+        for rule in rules:
+            if 'actions' in rule and 'exclude' in rule['actions']:
+                exclude = rule['actions']['exclude']
+                files.update(exclude.get('files') or [])
+                folders.update(exclude.get('folders') or [])
+                dep_folders.update(exclude.get('dep_folders') or [])
+    elif exclude_deps:
+        for rule in rules:
+            dep_folders.update(rule.get('actions', {}).get('exclude', {}).get('dep_folders') or [])
+
+    # Git data is excluded on demand, even when the rule exclusions are disabled
+    if options.get('nogit'):
+        folders.add('.git')
+        files.add('.gitignore')
+
+    matcher = ExclusionMatcher(files, folders, dep_folders)
+    if root and options.get('gitignore'):
+        return GitignoreMatcher(root, matcher)
+    return matcher
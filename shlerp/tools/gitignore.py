@@ -0,0 +1,176 @@
+###############################################################
+# This file features the .gitignore support. The patterns of
+# each folder are compiled once into regular expressions, and
+# the compiled list of a folder (its own patterns added to the
+# ones of its parents) is cached, so that every entry of the
+# walk is decided with the patterns that apply to its folder.
+
+import re
+import os
+
+
+def translate(pattern):
+    """Translates a .gitignore glob into a regular expression
+    :param pattern: text, the glob without its leading "/" and trailing "/"
+    :return: text, the regular expression matching a path relative to the folder of the .gitignore
+    """
+    res = ''
+    index = 0
+    size = len(pattern)
+    while index < size:
+        char = pattern[index]
+        if char == '*':
+            if pattern[index:index + 2] == '**' and (index == 0 or pattern[index - 1] == '/'):
+                if index + 2 == size:
+                    # Trailing "/**" matches everything inside
+                    res += '.*'
+                    index += 2
+                    continue
+                if pattern[index + 2] == '/':
+                    # Leading or middle "**/" matches zero or more folders
+                    res += '(?:.*/)?'
+                    index += 3
+                    continue
+            while index < size and pattern[index] == '*':
+                index += 1
+            res += '[^/]*'
+            continue
+        if char == '?':
+            res += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', index + 2 if pattern[index + 1:index + 2] in ('!', '^') else index + 1)
+            if end == -1:
+                res += re.escape(char)
+            else:
+                content = pattern[index + 1:end]
+                if content[:1] in ('!', '^'):
+                    content = '^' + content[1:]
+                res += f'[{content.replace(chr(92), chr(92) * 2)}]'
+                index = end
+        elif char == '\\' and index + 1 < size:
+            index += 1
+            res += re.escape(pattern[index])
+        else:
+            res += re.escape(char)
+        index += 1
+    return res
+
+
+def parse_lines(lines):
+    """Compiles the lines of a .gitignore file
+    :param lines: iterable of text lines
+    :return: a list of tuples (compiled regex, negated, dir_only)
+    """
+    patterns = []
+    for line in lines:
+        line = line.rstrip('\n').rstrip('\r')
+        # Trailing spaces are ignored unless they are escaped
+        while line.endswith(' ') and not line.endswith('\\ '):
+            line = line[:-1]
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        elif line.startswith('\\#') or line.startswith('\\!'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        # A pattern with a slash anywhere but at its end is relative to the folder of the .gitignore,
+        # otherwise it matches a name at any depth below it
+        anchored = '/' in line
+        line = line.lstrip('/')
+        regex = translate(line)
+        if not anchored:
+            regex = f'(?:.*/)?{regex}'
+        patterns.append((re.compile(f'^{regex}$', re.DOTALL), negated, dir_only))
+    return patterns
+
+
+def read_patterns(path):
+    """
+    :param path: text, the path of a .gitignore file
+    :return: the list of its compiled patterns, empty if the file can't be read
+    """
+    try:
+        with open(path, 'r', errors='replace') as read_ignore:
+            return parse_lines(read_ignore)
+    except OSError:
+        return []
+
+
+class GitignoreMatcher:
+    """Excludes the paths ignored by the .gitignore files of the project (nested ones included)
+    and by .git/info/exclude, on top of the decisions of another matcher.
+    It is used by the walks like an ExclusionMatcher: the parents of an entry are always
+    checked before it, so the patterns only have to be matched against the entry itself.
+    """
+
+    def __init__(self, root, base=None):
+        self.root = root
+        self.base = base
+        # Patterns applying to the entries of each folder, with the folder of the .gitignore they come from
+        self.cache = {}
+
+    def __bool__(self):
+        return True
+
+    def patterns(self, parts):
+        """
+        :param parts: tuple of the path components of a folder, relative to the project
+        :return: the list of tuples (.gitignore folder parts, compiled regex, negated, dir_only) applying to its entries
+        """
+        cached = self.cache.get(parts)
+        if cached is None:
+            if parts:
+                cached = self.patterns(parts[:-1])
+            else:
+                # .git/info/exclude has the lowest precedence, it's applied from the project folder
+                cached = [((), *pattern) for pattern in read_patterns(os.path.join(self.root, '.git', 'info', 'exclude'))]
+            own = read_patterns(os.path.join(self.root, *parts, '.gitignore'))
+            if own:
+                cached = cached + [(parts, *pattern) for pattern in own]
+            self.cache[parts] = cached
+        return cached
+
+    def ignored(self, parent_parts, name, is_dir):
+        """
+        :return: True if the last pattern matching the entry isn't a negation
+        """
+        path_parts = parent_parts + (name,)
+        for base_parts, regex, negated, dir_only in reversed(self.patterns(parent_parts)):
+            if dir_only and not is_dir:
+                continue
+            if regex.match('/'.join(path_parts[len(base_parts):])):
+                return not negated
+        return False
+
+    def excluded_entry(self, parent_parts, name, is_dir):
+        """Check a single folder entry whose parent folder is already known to be kept
+        :param parent_parts: tuple of the path components of the parent folder, relative to the project
+        :param name: text, the name of the entry
+        :param is_dir: boolean, True if the entry is a folder
+        :return: True if the entry should be excluded
+        """
+        if name == '.git':
+            # Git data is handled by --nogit, never by the ignore files
+            return bool(self.base and self.base.excluded_entry(parent_parts, name, is_dir))
+        if self.base and self.base.excluded_entry(parent_parts, name, is_dir):
+            return True
+        return self.ignored(parent_parts, name, is_dir)
+
+    def excluded(self, rel_path, is_dir=False):
+        """Check if a path should be excluded, its parent folders included
+        :param rel_path: text, the path relative to the project folder
+        :param is_dir: boolean, True if the path is a folder
+        :return: True if the path or one of its parents is excluded
+        """
+        if not rel_path or rel_path == '.':
+            return False
+        parts = tuple(rel_path.split(os.sep))
+        for index, name in enumerate(parts):
+            if self.excluded_entry(parts[:index], name, is_dir or index < len(parts) - 1):
+                return True
+        return False
@@ -0,0 +1,122 @@
+###############################################################
+# This file features the journal of the batch runs. The state
+# of each project is recorded as the batch goes, so that an
+# interrupted batch can be resumed with --resume, and so that
+# the outputs it left half written can be removed.
+
+from .utils import get_dt
+import threading
+import shutil
+import json
+import os
+
+JOURNAL_VERSION = 1
+JOURNAL_NAME = '.shlerp_journal.json'
+
+# Project states, in the order a project goes through them
+SCANNED = 'scanned'
+BACKING_UP = 'backing_up'
+DONE = 'done'
+UPLOADED = 'uploaded'
+FAILED = 'failed'
+
+# The stages of a batch record their progress from several threads
+lock = threading.Lock()
+
+
+def journal_path(fld):
+    """
+    :param fld: text, the folder where the batch writes its backups
+    :return: the path of the journal of the batch
+    """
+    return f'{fld}/{JOURNAL_NAME}'
+
+
+def new_journal(target, operation):
+    """
+    :param target: text, the folder containing the projects of the batch
+    :param operation: text, describes what the batch makes, a journal is only resumed by the same operation
+    :return: an empty journal as a dictionary/object
+    """
+    return {
+        'version': JOURNAL_VERSION,
+        'target': target,
+        'operation': operation,
+        'started': get_dt(),
+        'projects': {}
+    }
+
+
+def load_journal(path, target, operation):
+    """
+    :param path: text, the path of the journal
+    :param target: text, the folder containing the projects of the batch
+    :param operation: text, describes what the batch makes
+    :return: the journal left by a previous run of the same batch as a dictionary/object, or None
+    """
+    try:
+        with open(path, 'r') as read_journal:
+            journal = json.load(read_journal)
+    except (OSError, ValueError):
+        return None
+    if journal.get('version') != JOURNAL_VERSION or journal.get('target') != target \
+            or journal.get('operation') != operation:
+        return None
+    return journal
+
+
+def write_journal(path, journal):
+    # Written aside then renamed, so that an interruption never leaves a truncated journal behind
+    with open(f'{path}.tmp', 'w') as write_journal_file:
+        json.dump(journal, write_journal_file, indent=4)
+    os.replace(f'{path}.tmp', path)
+
+
+def record(path, journal, proj_fld, project_state, **fields):
+    """Updates the state of a project and writes the journal right away
+    :param path: text, the path of the journal
+    :param journal: dictionary/object representing the journal
+    :param proj_fld: text, the project folder
+    :param project_state: text, one of the project states
+    :param fields: other values to record for the project, like its "dst" or the "outputs" to remove if it is interrupted
+    """
+    with lock:
+        entry = journal['projects'].setdefault(proj_fld, {})
+        entry.update(fields)
+        entry['state'] = project_state
+        write_journal(path, journal)
+
+
+def completed(journal, proj_fld, upload):
+    """
+    :param journal: dictionary/object representing the journal, or None
+    :param proj_fld: text, the project folder
+    :param upload: boolean, True if the backups have to be uploaded
+    :return: True if the project doesn't have to be processed again
+    """
+    if not journal or proj_fld not in journal['projects']:
+        return False
+    project_state = journal['projects'][proj_fld]['state']
+    return project_state == UPLOADED or (project_state == DONE and not upload)
+
+
+def remove_partial_outputs(journal):
+    """Removes what the projects that were being backed up when the batch got interrupted left behind
+    :param journal: dictionary/object representing the journal
+    :return: the list of the removed paths
+    """
+    removed = []
+    for entry in journal['projects'].values():
+        if entry['state'] != BACKING_UP:
+            continue
+        for output_path in entry.get('outputs', []):
+            try:
+                if os.path.isdir(output_path) and not os.path.islink(output_path):
+                    shutil.rmtree(output_path)
+                else:
+                    os.remove(output_path)
+                removed.append(output_path)
+            except FileNotFoundError:
+                pass
+        entry['state'] = FAILED
+    return removed
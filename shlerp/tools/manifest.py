@@ -0,0 +1,150 @@
+###############################################################
+# This file features the manifests written next to the archives.
+# A manifest describes the state of the project when it has been
+# archived, the next --incremental run compares the project with
+# it to only archive what changed since then.
+
+from .utils import get_dt
+import json
+import re
+import os
+
+MANIFEST_VERSION = 1
+MANIFEST_EXT = '.manifest.json'
+# Name of the archive member listing the paths deleted since the previous archive
+DELETED_MEMBER = '.shlerp_deleted'
+
+
+def manifest_path(dst_path):
+    """
+    :param dst_path: text, the path of the archive, without its extension
+    :return: the path of the manifest of this archive
+    """
+    return f'{dst_path}{MANIFEST_EXT}'
+
+
+def find_latest(fld, project_name, suffix, version):
+    """Finds the most recent json file written for a project, named like {project_name}_{get_dt()}{suffix},
+    or {project_name}_{get_dt()}-{number}{suffix} when several have been written within the same second
+    :param fld: text, the folder to search in
+    :param project_name: text, the name of the project folder
+    :param suffix: text, what follows the datetime in the file name
+    :param version: number, the version the content of the file must have
+    :return: the content of the file as a dictionary/object, with its file name as "name", or None
+    """
+    pattern = re.compile(rf'^{re.escape(project_name)}_(\d{{8}}#\d{{6}})(?:-(\d+))?{re.escape(suffix)}$')
+    try:
+        candidates = [(pattern.match(name), name) for name in os.listdir(fld or '.')]
+    except OSError:
+        return None
+    # The datetime in the name sorts the same way as the time, then the number orders the files of the same second
+    candidates = sorted(
+        ((match.group(1), int(match.group(2) or 0)), name) for match, name in candidates if match
+    )
+    for _, name in reversed(candidates):
+        try:
+            with open(os.path.join(fld, name), 'r') as read_latest:
+                content = json.load(read_latest)
+        except (OSError, ValueError):
+            continue
+        if content.get('version') == version:
+            content['name'] = name
+            return content
+    return None
+
+
+def load_latest_manifest(dst_path):
+    """Finds the most recent manifest written for the same project, in the folder where the archive is made
+    :param dst_path: text, the path of the archive we are about to make, without its extension
+    :return: the manifest as a dictionary/object, or None if there isn't any
+    """
+    dst_fld, dst_name = os.path.split(dst_path)
+    # The archive names are built like {project_name}_{get_dt()}
+    project_name = dst_name.rsplit('_', 1)[0]
+    return find_latest(dst_fld, project_name, MANIFEST_EXT, MANIFEST_VERSION)
+
+
+def file_record(elem_path):
+    """
+    :param elem_path: text, the path of a file
+    :return: the list [size, mtime_ns, inode] used to tell if the file changed
+    """
+    stat = os.stat(elem_path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def unchanged(previous, rel_name, record):
+    """Tells if a file is the same as when the previous manifest was written
+    :param previous: dictionary/object representing the previous manifest, or None
+    :param rel_name: text, the path of the file relative to the project folder
+    :param record: list [size, mtime_ns, inode] of the file
+    :return: the previous record of the file if it didn't change, None otherwise
+    """
+    if not previous:
+        return None
+    prev_record = previous['files'].get(rel_name)
+    if prev_record and prev_record[:3] == record:
+        return prev_record
+    return None
+
+
+def deleted_paths(previous, files, folders, failed=()):
+    """
+    :param previous: dictionary/object representing the previous manifest, or None
+    :param files: dictionary of the files that are in the project now
+    :param folders: list of the folders that are in the project now
+    :param failed: paths that are in the project but couldn't be archived by this run, they aren't deleted
+    :return: the sorted list of the paths that disappeared since the previous manifest
+    """
+    if not previous:
+        return []
+    current = set(files) | set(folders) | set(failed)
+    return sorted((set(previous['files']) | set(previous['folders'])) - current)
+
+
+def deleted_member(files, folders):
+    """
+    :param files: dictionary of the files that are in the archive
+    :param folders: list of the folders that are in the archive
+    :return: the name of the member listing the deleted paths, one that no file or folder of the project uses
+    """
+    taken = set(files) | set(folders)
+    name = DELETED_MEMBER
+    index = 0
+    while name in taken:
+        index += 1
+        name = f'{DELETED_MEMBER}.{index}'
+    return name
+
+
+def write_manifest(dst_path, proj_fld, archive_name, fmt, files, folders, deleted, previous, deleted_name=None):
+    """Writes the manifest next to the archive. The manifest always lists the whole project,
+    files carried over from the previous manifest included, so that it can be used as the next base.
+    :param dst_path: text, the path of the archive, without its extension
+    :param proj_fld: text, the folder that has been archived
+    :param archive_name: text, the file name of the archive
+    :param fmt: text, the format of the archive
+    :param files: dictionary of {relative path: [size, mtime_ns, inode, sha256]}
+    :param folders: list of the relative paths of the folders
+    :param deleted: list of the relative paths deleted since the previous manifest
+    :param previous: dictionary/object representing the previous manifest, or None for a full archive
+    :param deleted_name: text, the name of the archive member listing the deleted paths, None if there isn't any
+    """
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'project': proj_fld,
+        'created': get_dt(),
+        'archive': archive_name,
+        'format': fmt,
+        'base': previous['name'] if previous else None,
+        'fields': ['size', 'mtime_ns', 'inode', 'sha256'],
+        'files': files,
+        'folders': sorted(folders),
+        'deleted': deleted,
+        'deleted_member': deleted_name
+    }
+    path = manifest_path(dst_path)
+    # Written aside then renamed, so an interrupted run never leaves a truncated manifest behind
+    with open(f'{path}.tmp', 'w') as write_manifest_file:
+        json.dump(manifest, write_manifest_file)
+    os.replace(f'{path}.tmp', path)
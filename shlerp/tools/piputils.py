@@ -7,19 +7,21 @@ from .state import (
     state,
     set_printed,
     after_warning,
+    printed_by_current_thread,
     x_consecutive_entries_in_step
 )
 from datetime import datetime
 from .utils import (
     log,
     get_dt,
+    get_settings,
     spinner_animation,
     remove_previous_line
 )
+from . import progress
+from .profiler import traced
 from click import echo
 import threading
-import requests
-import pytz
 import click
 
 
@@ -30,6 +32,11 @@ def print_term(step, lvl, message, **kwargs):
     :param message, the message we want to print
     :return: The user input if input is set to True
     """
+    captured = state('captured')
+    if captured is not None:
+        # In a batch worker, the main process prints the messages of the whole project at once
+        captured.append((step, lvl, message, bool(kwargs.get('cnt'))))
+        return None
     uid = None
     u_input = False
     count = ''
@@ -49,54 +56,72 @@ def print_term(step, lvl, message, **kwargs):
         log(f'[{uid + ":" if uid else ""}{get_dt()}:{string}', log_type)
 
     if not state('headless'):
-        set_printed(step, lvl)
-        if not lvl == 'E':
-            if not step == 'uninstall':
-                if not after_warning():
-                    if step == 'scan':
-                        if x_consecutive_entries_in_step(3, step):
-                            remove_previous_line()
-                    else:
-                        if not state('verbose'):
-                            if step == 'stat':
-                                if not x_consecutive_entries_in_step(2, 'stat'):
-                                    remove_previous_line()
-                            else:
-                                if x_consecutive_entries_in_step(2, step):
-                                    remove_previous_line()
-
-        string = f'[{string}'
-        if lvl == 'I':
-            if not u_input:
-                echo(string)
-            else:
-                return input(string)
+        # The progress line is removed first, so that the message doesn't end up appended to it
+        with progress.paused():
+            return print_message(string, step, lvl, u_input)
+
+
+def print_message(string, step, lvl, u_input):
+    """Prints a message formatted by print_term() on the terminal
+    :return: The user input if u_input is True
+    """
+    # In a pipelined batch, the previous line may come from another stage: it is never removed
+    own_line = printed_by_current_thread()
+    set_printed(step, lvl)
+    if not lvl == 'E' and own_line:
+        if not step == 'uninstall':
+            if not after_warning():
+                if step == 'scan':
+                    if x_consecutive_entries_in_step(3, step):
+                        remove_previous_line(state('stderr'))
+                else:
+                    if not state('verbose'):
+                        if step == 'stat':
+                            if not x_consecutive_entries_in_step(2, 'stat'):
+                                remove_previous_line(state('stderr'))
+                        else:
+                            if x_consecutive_entries_in_step(2, step):
+                                remove_previous_line(state('stderr'))
+
+    string = f'[{string}'
+    if lvl == 'I':
+        if not u_input:
+            echo(string, err=state('stderr'))
+        else:
+            return input(string)
+    else:
+        color = None
+        if lvl == 'E':
+            color = 'red'
+        if lvl == 'W':
+            color = 'bright_yellow'
+        if lvl == 'D':
+            color = 'cyan'
+        if not u_input:
+            echo(click.style(string, fg=color), err=state('stderr'))
         else:
-            color = None
-            if lvl == 'E':
-                color = 'red'
-            if lvl == 'W':
-                color = 'bright_yellow'
-            if lvl == 'D':
-                color = 'cyan'
-            if not u_input:
-                echo(click.style(string, fg=color))
-            else:
-                return input(click.style(string, fg=color))
-
-
-def upload_archive(archive_path, expire_time):
+            return input(click.style(string, fg=color))
+
+
+@traced
+def upload_archive(archive_path, expire_time, spinner=True):
     """Upload a file to file.io with a spinner animation.
     param: archive_path (str): The path to the file to be uploaded.
     param: expire_time (str): Expiration time in ISO 8601 or duration format (e.g., '14d').
+    param: spinner (bool): False to upload silently, when other steps are printing at the same time.
     returns: Response: The response from the file.io API.
     """
-    url = 'https://file.io'
+    # Imported here, loading requests takes longer than the rest of the startup and only the uploads need it
+    import requests
+
+    # The endpoint can be changed in settings.json, to use a compatible service or a local stand-in
+    url = get_settings()['upload_default'].get('url', 'https://file.io')
     stop_event = threading.Event()  # Event to signal the spinner to stop
 
     # Start the spinner in a separate thread
     spinner_thread = threading.Thread(target=spinner_animation, args=(stop_event, 'Uploading...'))
-    spinner_thread.start()
+    if spinner:
+        spinner_thread.start()
 
     try:
         # Perform the upload
@@ -107,12 +132,15 @@ def upload_archive(archive_path, expire_time):
     finally:
         # Stop the spinner once the request completes
         stop_event.set()
-        spinner_thread.join()  # Wait for the spinner thread to exit
+        if spinner:
+            spinner_thread.join()  # Wait for the spinner thread to exit
 
     return response
 
 
 def time_until_expiry(expiry_date_str):
+    import pytz
+
     # Parse the expiration date string with UTC timezone
     expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=pytz.UTC)
 
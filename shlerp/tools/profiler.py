@@ -0,0 +1,152 @@
+###############################################################
+# This file features the --profile option. The execution runs
+# under cProfile, in every thread it starts, and the calls of a
+# few key functions are recorded as spans, or a sample of them
+# for the ones called very often. Both are exported
+# when the execution ends: a pstats file, and a trace-event
+# json that chrome://tracing or Perfetto can open.
+
+import functools
+import itertools
+import threading
+import time
+import json
+import sys
+import os
+
+# Spans recorded so far, None unless --profile is used
+events = None
+# Profilers of the threads of the execution
+profilers = []
+# Names of the threads that recorded spans, by thread id
+thread_names = {}
+lock = threading.Lock()
+
+
+def start_tracing():
+    """Starts recording the spans of the traced functions"""
+    global events
+    events = []
+    thread_names.clear()
+
+
+def start():
+    """Starts profiling the current thread and the threads it starts, and recording the spans"""
+    # Imported here, the profilers are only loaded when --profile is used
+    import cProfile
+
+    start_tracing()
+    profiler = cProfile.Profile()
+    profilers.append(profiler)
+    if sys.version_info >= (3, 12):
+        # cProfile relies on sys.monitoring, which sees every thread and only accepts one profiler at a time
+        profiler.enable()
+        return
+
+    def profile_thread(*_):
+        # Called by the first event of a new thread, the thread gets its own profiler
+        thread_profiler = cProfile.Profile()
+        with lock:
+            profilers.append(thread_profiler)
+        thread_profiler.enable()
+    threading.setprofile(profile_thread)
+    profiler.enable()
+
+
+def stop_worker_profiling():
+    """A forked batch worker inherits the profiler of the thread that started it, it's never exported"""
+    for profiler in profilers:
+        profiler.disable()
+    sys.setprofile(None)
+    threading.setprofile(None)
+
+
+def traced(func=None, every=1):
+    """Records each call of the decorated function as a span, when --profile is used.
+    Used as @traced(every=n), only one call out of n is recorded, for the functions called so often
+    that a span for each call would make most of the trace. The span of a sampled call tells how many calls it stands for.
+    :param func: the decorated function
+    :param every: number, one call out of every is recorded
+    """
+    if func is None:
+        return functools.partial(traced, every=every)
+    name = func.__qualname__
+    # itertools.count is atomic in CPython, the threads don't need the lock to count the calls
+    calls = itertools.count()
+
+    @functools.wraps(func)
+    def traced_func(*args, **kwargs):
+        if events is None or (every > 1 and next(calls) % every):
+            return func(*args, **kwargs)
+        started = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            thread = threading.current_thread()
+            if thread.ident not in thread_names:
+                thread_names[thread.ident] = thread.name
+            event = {
+                'name': name,
+                'cat': func.__module__,
+                'ph': 'X',
+                'ts': started / 1000,
+                'dur': (time.perf_counter_ns() - started) / 1000,
+                'pid': os.getpid(),
+                'tid': thread.ident
+            }
+            if every > 1:
+                event['args'] = {'sampled_calls': every}
+            events.append(event)
+    return traced_func
+
+
+def collect():
+    """
+    :return: the spans recorded by a batch worker, with the names of its threads, to send them to the main process
+    """
+    return {'events': events or [], 'threads': [(os.getpid(), tid, name) for tid, name in thread_names.items()]}
+
+
+def merge(collected):
+    """Adds the spans recorded by a batch worker to the ones of the main process
+    :param collected: dictionary/object returned by collect() in the worker
+    """
+    if events is not None:
+        events.extend(collected['events'])
+        for pid, tid, name in collected['threads']:
+            thread_names[(pid, tid)] = name
+
+
+def export(path):
+    """Stops profiling and writes the results
+    :param path: text, the path of the files to write, without their extension
+    :return: the list of the written files
+    """
+    for profiler in profilers:
+        profiler.disable()
+    stop_worker_profiling()
+    written = []
+    if profilers:
+        import pstats
+
+        profile_stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            try:
+                profile_stats.add(profiler)
+            except TypeError:
+                # The thread didn't call anything once its profiler was enabled
+                pass
+        profile_stats.dump_stats(f'{path}.pstats')
+        written.append(f'{path}.pstats')
+    if events is not None:
+        metadata = []
+        for key, name in thread_names.items():
+            pid, tid = key if isinstance(key, tuple) else (os.getpid(), key)
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        for pid in sorted({event['pid'] for event in events}):
+            name = 'shlerp' if pid == os.getpid() else 'shlerp batch worker'
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+        with open(f'{path}.trace.json', 'w') as write_trace:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, write_trace)
+        written.append(f'{path}.trace.json')
+    return written
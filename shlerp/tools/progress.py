@@ -0,0 +1,154 @@
+###############################################################
+# This file features the progress line shown while a project
+# is archived or stored. The loops only update counters, and a
+# thread repaints a single status line a few times per second,
+# so printing doesn't slow down the processing of big trees.
+# The per-file lines are kept for --verbose.
+
+from .state import state
+from contextlib import contextmanager
+import threading
+import shutil
+import time
+import sys
+
+# Seconds between two repaints of the progress line
+RENDER_INTERVAL = 0.25
+
+# Taken while the line is painted or while a message is printed over it
+render_lock = threading.Lock()
+# Progress being displayed, if any
+active = None
+
+
+def format_size(size):
+    """
+    :param size: number of bytes
+    :return: text, the size in a readable unit
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m' if hours else f'{minutes}m{seconds:02d}s' if minutes else f'{seconds}s'
+
+
+class Progress:
+    """Counts the files processed for a project, and displays the counters on a single line
+    when the messages aren't printed one per file: not verbose, not headless, on a terminal.
+    Used as a context manager, the line is repainted until the processing ends.
+    """
+
+    def __init__(self, step, count='', out_size=None):
+        """
+        :param step: short string, the step shown in front of the line
+        :param count: string that represents nothing or the current count out of a total of backups to process
+        :param out_size: function returning the number of bytes written so far, None if it can't be known
+        """
+        self.step = step
+        self.count = f'[{count}]' if count else ''
+        self.out_size = out_size
+        self.files = 0
+        self.bytes_in = 0
+        # Bytes of the files skipped as unchanged, they only count for the ETA
+        self.bytes_skipped = 0
+        # Files and bytes of the whole project, as of its previous backup
+        self.total = None
+        self.started = time.time()
+        self.stream = sys.stderr if state('stderr') else sys.stdout
+        self.enabled = not state('verbose') and not state('headless') and state('captured') is None \
+            and self.stream.isatty()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        global active
+        if self.enabled:
+            active = self
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join()
+            with render_lock:
+                active = None
+            # The final counters stay on the screen, in place of the last per-file line
+            self.render()
+            self.stream.write('\n')
+
+    def add(self, files=1, bytes_in=0, skipped=False):
+        """
+        :param files: number of files processed
+        :param bytes_in: number of bytes read from them
+        :param skipped: boolean, True if the files haven't been read because they didn't change
+        """
+        self.files += files
+        if skipped:
+            self.bytes_skipped += bytes_in
+        else:
+            self.bytes_in += bytes_in
+
+    def expect(self, previous):
+        """Takes the size of the previous backup of the project as the total the ETA is computed from,
+        the project isn't walked a second time to measure it
+        :param previous: dictionary/object representing the previous manifest or snapshot, or None
+        """
+        if previous:
+            # The first value of each file record is its size
+            self.total = {
+                'files': len(previous['files']),
+                'bytes': sum(record[0] for record in previous['files'].values())
+            }
+
+    def line(self):
+        """
+        :return: text, the progress line without its step
+        """
+        elapsed = max(time.time() - self.started, 1e-6)
+        total = self.total
+        parts = [f'{self.files}/{total["files"]} files' if total else f'{self.files} files']
+        parts.append(f'{format_size(self.bytes_in)} read at {format_size(self.bytes_in / elapsed)}/s')
+        if self.out_size and self.bytes_in:
+            try:
+                parts.append(f'ratio {self.out_size() / self.bytes_in:.0%}')
+            except OSError:
+                pass
+        if total and total['bytes']:
+            done = (self.bytes_in + self.bytes_skipped) / total['bytes']
+            if 0 < done < 1:
+                parts.append(f'ETA {format_duration(elapsed / done - elapsed)}')
+        return ' - '.join(parts)
+
+    def clear(self):
+        self.stream.write('\r\033[K')
+        self.stream.flush()
+
+    def render(self):
+        width = shutil.get_terminal_size().columns
+        with render_lock:
+            # The line is cut to the width of the terminal, a wrapped line couldn't be repainted
+            self.stream.write(f'\r[{self.step}]{self.count}[I] {self.line()}'[:width] + '\033[K')
+            self.stream.flush()
+
+    def run(self):
+        while not self.stop_event.wait(RENDER_INTERVAL):
+            self.render()
+
+
+@contextmanager
+def paused():
+    """Removes the progress line while a message is printed, the next repaint shows it again below the message"""
+    with render_lock:
+        if active:
+            active.clear()
+        yield
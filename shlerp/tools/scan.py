@@ -6,38 +6,89 @@
 from .state import state
 from .piputils import print_term
 from . import utils
+from . import stats
+from .exclusions import ExclusionMatcher, compile_exclusions
+from .gitignore import GitignoreMatcher
+from .profiler import traced
 from os.path import exists
-import glob
+import fnmatch
 import os
 import re
 
 
-def frameworks_processing(rules, proj_fld):
-    """Process the project folder to detect frameworks based on the provided rules.
-    :param rules: object list containing framework rules
+def walk_project(rules, proj_fld):
+    """Walk the project folder once and score every rule from the same traversal.
+    Framework criteria (folders, files, patterns) and vanilla extensions are all evaluated
+    against each folder as it is visited, instead of walking the whole tree once per rule/extension.
+    :param rules: object containing the framework and vanilla rules, their "total" key gets updated
     :param proj_fld: text, the folder we want to process
-    :return: a list of matched framework rules
     """
-    _fw_leads = []
     dep_folders = utils.get_dependency_folders(rules['frameworks'] + rules['vanilla'])
-    for _rule in rules['frameworks']:
-        exclusions = _rule['actions']['exclude']
-        if state('debug'): print_term('scan:fram', 'D', f'Processing rule: {_rule["name"]}')
-        total_matches = 0
-
-        # Use os.walk() to traverse the project folder and its subfolders
-        for root, dirs, files in os.walk(proj_fld):
-            # Exclude dependency folders from dirs
-            dirs[:] = [d for d in dirs if not excluded(os.path.join(root, d), exclusions, dep_folders)]
+    dep_matcher = ExclusionMatcher(dep_folders=dep_folders)
+    gitignore = state('gitignore')
+    if gitignore:
+        # What the project ignores isn't part of its sources, it doesn't count for the detection either
+        dep_matcher = GitignoreMatcher(proj_fld, dep_matcher)
+    fw_rules = rules['frameworks']
+    v_rules = rules['vanilla']
+    matchers = {}
+    for rule in fw_rules + v_rules:
+        rule['total'] = 0
+        matchers[id(rule)] = compile_exclusions([rule])
+
+    # Index the vanilla extensions so that each file only costs a dictionary lookup
+    ext_index = {}
+    ext_patterns = []
+    for rule in v_rules:
+        for ext_elem in rule['detect']['extensions']:
+            for ext in ext_elem['names']:
+                suffix = ext[1:] if ext.startswith('*') else None
+                if suffix and suffix.startswith('.') and not any(c in suffix[1:] for c in '.*?['):
+                    ext_index.setdefault(suffix, []).append((rule, ext_elem['weight']))
+                else:
+                    ext_patterns.append((ext if ext.startswith('*') else f'*{ext}', rule, ext_elem['weight']))
+
+    contents = {}
+
+    def matches_pattern(file_path, pattern):
+        # The same file (e.g. package.json) can be checked by several rules, only read it once
+        if file_path not in contents:
+            with open(file_path, 'r') as file_content:
+                contents[file_path] = file_content.read()
+        return re.search(pattern, contents[file_path])
+
+    # Folders and files the detection went through, for --stats-json and the benchmarks
+    visited_flds = visited_files = 0
+    for root, dirs, files in os.walk(proj_fld):
+        # Dependency folders are shared by every rule, they are never entered
+        rel_root = os.path.relpath(root, proj_fld)
+        parts = () if rel_root == '.' else tuple(rel_root.split(os.sep))
+        dirs[:] = [d for d in dirs if not dep_matcher.excluded_entry(parts, d, True)]
+        if gitignore:
+            files = [f for f in files if not dep_matcher.excluded_entry(parts, f, False)]
+        visited_flds += 1
+        visited_files += len(files)
+        # glob never went through hidden folders, keep the extension count consistent with that
+        hidden = any(part.startswith('.') for part in parts)
+        # Rules for which the current folder is excluded don't get any score from it
+        skipped = {key for key, matcher in matchers.items() if matcher.excluded(rel_root, True)}
+
+        #####################
+        # Framework rules
+
+        for _rule in fw_rules:
+            if id(_rule) in skipped:
+                continue
+            matcher = matchers[id(_rule)]
 
             # Check for folders defined in the rule
             for folder in _rule['detect']['folders']:
                 name = folder['name']
                 if name in dirs:
                     folder_path = os.path.join(root, name)
-                    if not excluded(folder_path, exclusions, dep_folders):
+                    if not matcher.excluded_entry(parts, name, True):
                         if not folder['files']:
-                            total_matches += 1
+                            _rule['total'] += 1
                             if state('debug'): print_term('scan:fram', 'D', f'Matched folder: {folder_path}')
                         else:
                             match = True
@@ -45,10 +96,8 @@ def frameworks_processing(rules, proj_fld):
                                 if not exists(os.path.join(folder_path, file)):
                                     match = False
                             if match:
-                                total_matches += 1
+                                _rule['total'] += 1
                                 if state('debug'): print_term('scan:fram', 'D', f'Matched all files in folder: {folder_path}')
-                    else:
-                        continue
 
             # Check for files defined in the rule
             for file in _rule['detect']['files']:
@@ -57,19 +106,60 @@ def frameworks_processing(rules, proj_fld):
                 for name in names:
                     if name in files:
                         file_path = os.path.join(root, name)
-                        if not excluded(file_path, exclusions, dep_folders):
+                        if not matcher.excluded_entry(parts, name, False):
                             if pattern:
-                                with open(file_path, 'r') as file_content:
-                                    content = file_content.read()
-                                    if re.search(pattern, content):
-                                        total_matches += 1
-                                        if state('debug'): print_term('scan:fram', 'D', f'Matched pattern in file: {file_path}')
+                                if matches_pattern(file_path, pattern):
+                                    _rule['total'] += 1
+                                    if state('debug'): print_term('scan:fram', 'D', f'Matched pattern in file: {file_path}')
                             else:
-                                total_matches += 1
+                                _rule['total'] += 1
                                 if state('debug'): print_term('scan:fram', 'D', f'Matched file: {file_path}')
 
-        _rule["total"] = total_matches
-        if state('debug'): print_term('scan:fram', 'D', f'Total score for rule {_rule["name"]}: {total_matches}')
+        #####################
+        # Vanilla rules
+
+        if hidden:
+            continue
+        for name in files:
+            if name.startswith('.'):
+                continue
+            candidates = ext_index.get(os.path.splitext(name)[1], [])
+            if ext_patterns:
+                candidates = candidates + [
+                    (rule, weight) for ext, rule, weight in ext_patterns if fnmatch.fnmatchcase(name, ext)
+                ]
+            if not candidates:
+                continue
+            file_path = os.path.join(root, name)
+            for rule, weight in candidates:
+                if id(rule) not in skipped and not matchers[id(rule)].excluded_entry(parts, name, False):
+                    rule['total'] += weight
+                    if state('debug'): print_term('scan:walk', 'D', f'Matched: {file_path} for rule: {rule["name"]}, updated total: {rule["total"]}')
+                else:
+                    if state('debug'): print_term('scan:walk', 'D', f'Excluded: {file_path} for rule: {rule["name"]}')
+
+    stats.add('detection_folders', visited_flds)
+    stats.add('detection_files', visited_files)
+
+
+def scanned(rules, section):
+    """Tells if the rules of a given section already went through walk_project()"""
+    return all('total' in rule for rule in rules[section])
+
+
+@traced
+def frameworks_processing(rules, proj_fld):
+    """Process the project folder to detect frameworks based on the provided rules.
+    :param rules: object list containing framework rules
+    :param proj_fld: text, the folder we want to process
+    :return: a list of matched framework rules
+    """
+    _fw_leads = []
+    if not scanned(rules, 'frameworks'):
+        walk_project(rules, proj_fld)
+    for _rule in rules['frameworks']:
+        if state('debug'): print_term('scan:fram', 'D', f'Processing rule: {_rule["name"]}')
+        if state('debug'): print_term('scan:fram', 'D', f'Total score for rule {_rule["name"]}: {_rule["total"]}')
 
         matches_expected_num = 0
         def get_matches_expected_num(type):
@@ -129,36 +219,16 @@ def vanilla_processing(_rules, proj_fld):
     return leads
 
 
+@traced
 def deep_scan(proj_fld, rules):
     """Crawl the project to find files matching the extensions we provide to this function
     :param proj_fld: text, the folder we want to process
     :param rules: object list containing languages names, extensions to crawl and weights
     :return: an updated list with some more weight (hopefully)
     """
-    dep_folders = utils.get_dependency_folders(rules['frameworks'] + rules['vanilla'])
+    if not scanned(rules, 'vanilla'):
+        walk_project(rules, proj_fld)
     for rule in rules['vanilla']:
-        exclusions = rule['actions']['exclude']
-        if 'total' not in rule.keys():
-            rule['total'] = 0
-        for ext_elem in rule['detect']['extensions']:
-            for ext in ext_elem['names']:
-                if state('debug'): print_term('scan:iglob', 'D', f'Processing extension: {ext} for rule: {rule["name"]}')
-                for file_path in glob.iglob(f'{proj_fld}/**/*{ext}', recursive=True):
-                    if not excluded(file_path, exclusions, dep_folders):
-                        rule['total'] += ext_elem['weight']
-                        if state('debug'): print_term('scan:iglob', 'D', f'Matched: {file_path} for rule: {rule["name"]}, updated total: {rule["total"]}')
-                    else:
-                        if state('debug'): print_term('scan:iglob', 'D', f'Excluded: {file_path} for rule: {rule["name"]}')
-        if state('debug'): print_term('scan:iglob', 'D', f'Total for rule {rule["name"]}: {rule["total"]}')
+        if state('debug'): print_term('scan:walk', 'D', f'Total for rule {rule["name"]}: {rule["total"]}')
     return rules['vanilla']
 
-
-def excluded(path, exclusions, dep_folders):
-    """Check if a path should be excluded based on exclusions and dependency folders."""
-    for exclusion in exclusions:
-        if exclusion in path:
-            return True
-    for dep_folder in dep_folders:
-        if dep_folder in path:
-            return True
-    return False
\ No newline at end of file
@@ -1,10 +1,17 @@
 from .utils import get_settings
+import threading
+
+settings = get_settings()
 
 _state = {
     'uid': '', # UID that represents the current execution. Not meant to be changed after its initial initialization
-    'headless': get_settings()['headless'],
-    'debug': get_settings()['debug_scan'],
-    'verbose': get_settings()['verbose'] if not get_settings()['debug_scan'] else True, # Defines if the printing function should overwrite the previous term line or not
+    'headless': settings['headless'],
+    'stderr': False, # Prints the messages on stderr, used when the archive itself is written to stdout
+    'debug': settings['debug_scan'],
+    'gitignore': False, # Makes the scanner skip what the .gitignore files of the project ignore
+    'verbose': settings['verbose'] if not settings['debug_scan'] else True, # Defines if the printing function should overwrite the previous term line or not
+    'captured': None, # List collecting the messages instead of printing them, used by the batch worker processes
+    'journal': None, # Path of the journal of the current batch, used to tell how to resume it after a SIGINT
     'printed': [], # Represents the step we're in, will be used if a SIGINT occurs
     'backed_up': [], # Lists successfully backed up projects path
     'failures': [], # Lists the projects that couldn't be backed up
@@ -28,6 +35,13 @@ def after_warning():
     return _state['printed'][-1]['lvl'] == 'W'
 
 
+def printed_by_current_thread():
+    """
+    :return: True if the last line printed has been printed by the current thread, only this thread may remove it
+    """
+    return bool(_state['printed']) and _state['printed'][-1]['thread'] == threading.get_ident()
+
+
 def x_consecutive_entries_in_step(x, step):
     count = 0
     if len(_state['printed']) >= x:
@@ -57,7 +71,7 @@ def incr_state(key, amount=1):
 
 
 def set_printed(step, lvl):
-    entry = {'step': step, 'lvl': lvl}
+    entry = {'step': step, 'lvl': lvl, 'thread': threading.get_ident()}
     _state['printed'].append(entry)
     if len(_state['printed']) > 3:
         _state['printed'].pop(0)
@@ -69,4 +83,12 @@ def force_verbose():
 
 
 def activate_headless():
-    _state['headless'] = True
\ No newline at end of file
+    _state['headless'] = True
+
+
+def activate_stderr():
+    _state['stderr'] = True
+
+
+def activate_gitignore():
+    _state['gitignore'] = True
@@ -0,0 +1,253 @@
+###############################################################
+# This file features the run report written with --stats-json.
+# The time spent in each phase and the counters are recorded
+# per project, for the project the current thread works on.
+# Nothing is measured unless the report has been enabled, the
+# helpers then return the functions and iterables untouched.
+
+from contextlib import contextmanager
+import threading
+import time
+import json
+import os
+
+REPORT_VERSION = 1
+
+# Report of the current execution, None unless --stats-json is used
+report = None
+lock = threading.Lock()
+# Project report of the current thread
+local = threading.local()
+
+
+def enable(uid):
+    """Starts collecting the report of the current execution
+    :param uid: text representing the short uid of the execution
+    """
+    global report
+    report = {
+        'version': REPORT_VERSION,
+        'uid': uid,
+        'started': time.time(),
+        'projects': {}
+    }
+
+
+def project_report(proj_fld):
+    """
+    :param proj_fld: text, the project folder
+    :return: the report of the project as a dictionary/object, created on first use
+    """
+    with lock:
+        projects = report['projects']
+        if proj_fld not in projects:
+            projects[proj_fld] = {'project': proj_fld, 'phases': {}, 'counters': {}}
+        return projects[proj_fld]
+
+
+@contextmanager
+def for_project(proj_fld):
+    """What is measured by the current thread within this context is recorded for the given project"""
+    if report is None:
+        yield
+        return
+    previous = getattr(local, 'project', None)
+    local.project = project_report(proj_fld)
+    try:
+        yield
+    finally:
+        local.project = previous
+
+
+def current():
+    """
+    :return: the report of the project the current thread works on, or None
+    """
+    return getattr(local, 'project', None) if report is not None else None
+
+
+def add_time(phase, seconds, project=None):
+    project = project or current()
+    if project is not None:
+        with lock:
+            project['phases'][phase] = project['phases'].get(phase, 0) + seconds
+
+
+def phase_time(phase):
+    """
+    :return: the number of seconds recorded so far for a phase of the current project
+    """
+    project = current()
+    return project['phases'].get(phase, 0) if project is not None else 0
+
+
+@contextmanager
+def span(phase):
+    """Adds the time spent within this context to a phase of the current project"""
+    project = current()
+    if project is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(phase, time.perf_counter() - started, project)
+
+
+def timed(func, phase):
+    """Wraps a function submitted to a pool of threads, so that its calls are timed for the project of the caller
+    :param func: the function to wrap
+    :param phase: text, the phase the calls are added to
+    :return: the wrapped function, or the function itself if nothing is measured
+    """
+    project = current()
+    if project is None:
+        return func
+
+    def timed_func(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add_time(phase, time.perf_counter() - started, project)
+    return timed_func
+
+
+def measured(entries, phase='traversal'):
+    """Times a walk and counts what it keeps, the time spent measuring the files isn't part of the phase
+    :param entries: iterable of tuples (path, relative path, is_dir)
+    :param phase: text, the phase the walk is added to
+    :return: the same entries
+    """
+    project = current()
+    if project is None:
+        return entries
+
+    def measured_entries():
+        iterator = iter(entries)
+        folders = files = size = 0
+        elapsed = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    entry = next(iterator)
+                finally:
+                    elapsed += time.perf_counter() - started
+                if entry[2]:
+                    folders += 1
+                else:
+                    files += 1
+                    try:
+                        size += os.lstat(entry[0]).st_size
+                    except OSError:
+                        pass
+                yield entry
+        except StopIteration:
+            pass
+        finally:
+            add_time(phase, elapsed, project)
+            add('kept_folders', folders, project)
+            add('kept_files', files, project)
+            add('kept_bytes', size, project)
+    return measured_entries()
+
+
+def add(key, amount=1, project=None):
+    project = project or current()
+    if project is not None:
+        with lock:
+            project['counters'][key] = project['counters'].get(key, 0) + amount
+
+
+def set_value(key, value):
+    project = current()
+    if project is not None:
+        project[key] = value
+
+
+class TimedFile:
+    """File wrapper adding the time spent writing into the file to a phase of the current project"""
+
+    def __init__(self, fileobj, phase='writing'):
+        self.fileobj = fileobj
+        self.phase = phase
+        self.project = current()
+
+    def write(self, data):
+        started = time.perf_counter()
+        try:
+            return self.fileobj.write(data)
+        finally:
+            add_time(self.phase, time.perf_counter() - started, self.project)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+
+def merge(projects):
+    """Adds the project reports collected by a batch worker process to the report of the current execution
+    :param projects: dictionary of {project folder: project report}
+    """
+    if report is None:
+        return
+    for proj_fld, worker_project in projects.items():
+        project = project_report(proj_fld)
+        with lock:
+            for phase, seconds in worker_project['phases'].items():
+                project['phases'][phase] = project['phases'].get(phase, 0) + seconds
+            for key, amount in worker_project['counters'].items():
+                project['counters'][key] = project['counters'].get(key, 0) + amount
+            for key, value in worker_project.items():
+                if key not in ('phases', 'counters'):
+                    project[key] = value
+
+
+def write_report(path, run):
+    """Writes the report of the current execution
+    :param path: text, the path of the json file
+    :param run: dictionary/object describing the execution, with the lists of the "backed_up", "failures",
+    "ad_failures" and "upload_failures" projects
+    """
+    projects = []
+    phases = {}
+    for project in report['projects'].values():
+        counters = project['counters']
+        proj_fld = project['project']
+        if proj_fld in run['ad_failures']:
+            project['status'] = 'detection_failed'
+        elif proj_fld in run['failures']:
+            project['status'] = 'failed'
+        elif proj_fld in run['upload_failures']:
+            project['status'] = 'upload_failed'
+        elif proj_fld in run['backed_up']:
+            project['status'] = 'backed_up'
+        else:
+            project['status'] = 'skipped'
+        counters['scanned_entries'] = counters.get('kept_files', 0) + counters.get('kept_folders', 0) \
+            + counters.get('excluded_entries', 0)
+        if project.get('output_bytes') is not None and counters.get('kept_bytes'):
+            project['compression_ratio'] = round(project['output_bytes'] / counters['kept_bytes'], 4)
+        project['phases'] = {phase: round(seconds, 4) for phase, seconds in project['phases'].items()}
+        for phase, seconds in project['phases'].items():
+            phases[phase] = phases.get(phase, 0) + seconds
+        projects.append(project)
+    content = {
+        'version': report['version'],
+        'uid': report['uid'],
+        'started': report['started'],
+        'total_time': round(time.time() - report['started'], 4),
+        **{key: value for key, value in run.items() if key not in ('backed_up', 'failures', 'ad_failures', 'upload_failures')},
+        'summary': {
+            'backed_up': len(run['backed_up']),
+            'failed': len(run['failures']) + len(run['ad_failures']),
+            'upload_failed': len(run['upload_failures'])
+        },
+        'phases': {phase: round(seconds, 4) for phase, seconds in phases.items()},
+        'projects': projects
+    }
+    # Written aside then renamed, so that a dashboard never reads a truncated report
+    with open(f'{path}.tmp', 'w') as write_report_file:
+        json.dump(content, write_report_file, indent=4)
+    os.replace(f'{path}.tmp', path)
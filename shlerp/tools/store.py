@@ -0,0 +1,293 @@
+###############################################################
+# This file features the deduplicating backup store.
+# Files are split into content-defined chunks that are stored
+# once, named after their hash. Each backup is a snapshot index
+# listing the chunks of every file, so unchanged data is never
+# written twice, across runs and across projects.
+
+from .archive import compression_policy
+from .manifest import find_latest
+from .utils import get_dt
+from . import stats
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from zipfile import ZIP_STORED
+from stat import S_ISREG
+from uuid import uuid4
+import hashlib
+import json
+import zlib
+import os
+
+STORE_NAME = 'shlerp_store'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXT = '.json'
+# Chunk sizes bounds, the boundaries are decided by the content in between
+MIN_CHUNK = 1 << 16
+MAX_CHUNK = 1 << 22
+# An anchor whose following bytes hash to 0 under this mask ends a chunk, about 1 anchor out of 4096
+BOUNDARY_ANCHORS = (b'\n', b' ')
+BOUNDARY_MASK = 0xfff
+BOUNDARY_WINDOW = 32
+# First byte of the chunk files, tells how the rest of the file is encoded
+RAW_CHUNK = b'\x00'
+ZLIB_CHUNK = b'\x01'
+
+# Chunks known to be in the stores during the current execution, by store folder
+known_chunks = {}
+
+
+def find_boundary(buf, start=0):
+    """Finds where the chunk that starts at the given offset of the buffer ends.
+    Candidates are searched with bytes.find() so that the content is scanned at C speed,
+    and since a boundary only depends on the bytes around it, inserting data in a file
+    only changes the chunks around the insertion.
+    Only the anchor bytes can end a chunk: text and data whose bytes are spread out, like compressed
+    or encrypted files, have plenty of them. Content that has none within MAX_CHUNK, like long runs
+    of the same byte, is cut every MAX_CHUNK, so an insertion there shifts the cuts up to the next anchor.
+    :param buf: bytes or bytearray holding the chunk from start, and the BOUNDARY_WINDOW bytes after it unless the file ends
+    :param start: number, the offset of the chunk in the buffer
+    :return: the size of the chunk
+    """
+    if len(buf) - start <= MIN_CHUNK:
+        return len(buf) - start
+    limit = min(len(buf), start + MAX_CHUNK)
+    # Spaces are only used for the content that has no suitable newline, like minified files
+    for anchor in BOUNDARY_ANCHORS:
+        pos = buf.find(anchor, start + MIN_CHUNK, limit)
+        while pos != -1:
+            if not zlib.crc32(buf[pos:pos + BOUNDARY_WINDOW]) & BOUNDARY_MASK:
+                return pos + 1 - start
+            pos = buf.find(anchor, pos + 1, limit)
+    return limit - start
+
+
+def iter_chunks(src):
+    """
+    :param src: binary file object
+    :return: a generator of the content-defined chunks of the file
+    """
+    buf = bytearray()
+    # Where the next chunk starts in the buffer, what comes before has already been yielded
+    start = 0
+    eof = False
+    while True:
+        # A chunk and the window of its last anchor, so that the cuts don't depend on the size of the reads
+        while len(buf) - start < MAX_CHUNK + BOUNDARY_WINDOW and not eof:
+            if start >= MAX_CHUNK:
+                # The yielded chunks are only dropped once they add up to MAX_CHUNK, the rest is moved once
+                del buf[:start]
+                start = 0
+            data = src.read(MAX_CHUNK)
+            if data:
+                buf += data
+            else:
+                eof = True
+        if start == len(buf):
+            return
+        size = find_boundary(buf, start)
+        yield bytes(buf[start:start + size])
+        start += size
+
+
+def chunk_path(store_fld, chunk_id):
+    return f'{store_fld}/chunks/{chunk_id[:2]}/{chunk_id[2:]}'
+
+
+def put_chunk(store_fld, data, compress):
+    """Stores a chunk if it isn't already in the store
+    :param store_fld: text, the folder of the store
+    :param data: bytes, the content of the chunk
+    :param compress: boolean, False if the data is known to be already compressed
+    :return: a tuple (chunk id, number of bytes written, 0 if the chunk was already stored)
+    """
+    chunk_id = hashlib.sha256(data).hexdigest()
+    known = known_chunks.setdefault(store_fld, set())
+    if chunk_id in known:
+        return chunk_id, 0
+    path = chunk_path(store_fld, chunk_id)
+    written = 0
+    if not os.path.exists(path):
+        payload = RAW_CHUNK + data
+        if compress:
+            compressed = zlib.compress(data, 6)
+            if len(compressed) < len(data):
+                payload = ZLIB_CHUNK + compressed
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside then linked into place, so a chunk file is either complete or absent.
+        # Linking fails if another thread stored the same chunk meanwhile, only one of them counts it as written.
+        tmp_path = f'{path}.{uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as write_chunk:
+            write_chunk.write(payload)
+        try:
+            os.link(tmp_path, path)
+            written = len(payload)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    known.add(chunk_id)
+    return chunk_id, written
+
+
+def get_chunk(store_fld, chunk_id):
+    """Reads a chunk back from the store and checks its content against its id
+    :param store_fld: text, the folder of the store
+    :param chunk_id: text, the sha256 of the chunk content
+    :return: bytes, the content of the chunk
+    """
+    with open(chunk_path(store_fld, chunk_id), 'rb') as read_chunk:
+        payload = read_chunk.read()
+    data = zlib.decompress(payload[1:]) if payload[:1] == ZLIB_CHUNK else payload[1:]
+    if hashlib.sha256(data).hexdigest() != chunk_id:
+        raise ValueError(f'Corrupted chunk {chunk_id}')
+    return data
+
+
+def store_file(store_fld, elem_path):
+    """Splits a file into chunks and stores the ones that are not in the store yet
+    :param store_fld: text, the folder of the store
+    :param elem_path: text, the path of the file
+    :return: a tuple (list of chunk ids, number of bytes read, number of bytes written)
+    """
+    compress = compression_policy(elem_path, None) != (ZIP_STORED, None)
+    chunk_ids = []
+    size = written = 0
+    with open(elem_path, 'rb') as src:
+        for data in iter_chunks(src):
+            chunk_id, chunk_written = put_chunk(store_fld, data, compress)
+            chunk_ids.append(chunk_id)
+            size += len(data)
+            written += chunk_written
+    return chunk_ids, size, written
+
+
+def latest_snapshot(store_fld, proj_fld):
+    """
+    :param store_fld: text, the folder of the store
+    :param proj_fld: text, the project folder
+    :return: the most recent snapshot index of the project as a dictionary/object, or None
+    """
+    return find_latest(f'{store_fld}/snapshots', os.path.basename(proj_fld), SNAPSHOT_EXT, SNAPSHOT_VERSION)
+
+
+def store_entries(store_fld, entries, previous, files, folders, jobs):
+    """Backs up the given entries into the store.
+    Files that didn't change since the previous snapshot reuse its chunk list without being read.
+    :param store_fld: text, the folder of the store
+    :param entries: iterable of tuples (path, arcname, is_dir), as yielded by utils.walk_kept()
+    :param previous: dictionary/object representing the previous snapshot of the project, or None
+    :param files: dictionary filled with the snapshot record of each stored file
+    :param folders: list filled with the stored folders
+    :param jobs: number of threads reading and storing the files
+    :return: a generator of tuples (arcname, is_dir, error, bytes written in the store) for each entry
+    """
+    def store_entry(elem_path, rel_name):
+        stat = os.stat(elem_path)
+        if not S_ISREG(stat.st_mode):
+            # Reading a named pipe or a device would block or never end
+            raise OSError(f'{elem_path} is not a regular file')
+        record = [stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_mode & 0o7777]
+        prev_record = previous['files'].get(rel_name) if previous else None
+        if prev_record and prev_record[:4] == record:
+            return prev_record, 0
+        chunk_ids, _, written = store_file(store_fld, elem_path)
+        return record + [chunk_ids], written
+
+    def drain(pending, limit):
+        while len(pending) > limit:
+            rel_name, future = pending.popleft()
+            try:
+                files[rel_name], written = future.result()
+                yield rel_name, False, None, written
+            except Exception as exc:
+                yield rel_name, False, exc, 0
+
+    # The time the workers spend chunking the files is reported with --stats-json
+    store_task = stats.timed(store_entry, 'chunking')
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for elem_path, rel_name, is_dir in entries:
+            if is_dir:
+                folders.append(rel_name)
+                yield rel_name, True, None, 0
+                continue
+            pending.append((rel_name, pool.submit(store_task, elem_path, rel_name)))
+            yield from drain(pending, jobs * 4)
+        yield from drain(pending, 0)
+
+
+def write_snapshot(store_fld, proj_fld, files, folders, previous):
+    """Writes the snapshot index of a project into the store
+    :param store_fld: text, the folder of the store
+    :param proj_fld: text, the folder that has been backed up
+    :param files: dictionary of {relative path: [size, mtime_ns, inode, mode, chunk ids]}
+    :param folders: list of the relative paths of the folders
+    :param previous: dictionary/object representing the previous snapshot of the project, or None
+    :return: the path of the snapshot index
+    """
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'project': proj_fld,
+        'created': get_dt(),
+        'base': previous['name'] if previous else None,
+        'fields': ['size', 'mtime_ns', 'inode', 'mode', 'chunks'],
+        'files': files,
+        'folders': sorted(folders)
+    }
+    snapshots_fld = f'{store_fld}/snapshots'
+    os.makedirs(snapshots_fld, exist_ok=True)
+    snapshot_name = f'{os.path.basename(proj_fld)}_{snapshot["created"]}'
+    # Written aside then linked into place, so an interrupted run never leaves a truncated index behind
+    tmp_path = f'{snapshots_fld}/{snapshot_name}.{uuid4().hex}.tmp'
+    with open(tmp_path, 'w') as write_index:
+        json.dump(snapshot, write_index)
+    try:
+        # Linking never replaces an existing index, a snapshot made within the same second gets the next number
+        index = 0
+        while True:
+            snapshot_path = f'{snapshots_fld}/{snapshot_name}{f"-{index}" if index else ""}{SNAPSHOT_EXT}'
+            try:
+                os.link(tmp_path, snapshot_path)
+                return snapshot_path
+            except FileExistsError:
+                index += 1
+    finally:
+        os.remove(tmp_path)
+
+
+def restore_snapshot(snapshot_path, dst, jobs):
+    """Rebuilds the project folder described by a snapshot index
+    :param snapshot_path: text, the path of the snapshot index, in the snapshots folder of the store
+    :param dst: text, the folder to create
+    :param jobs: number of threads writing the files
+    :return: a generator of tuples (relative path, error) for each restored file
+    """
+    store_fld = os.path.dirname(os.path.dirname(os.path.abspath(snapshot_path)))
+    with open(snapshot_path, 'r') as read_snapshot:
+        snapshot = json.load(read_snapshot)
+    os.makedirs(dst)
+    for folder in snapshot['folders']:
+        os.makedirs(f'{dst}/{folder}', exist_ok=True)
+
+    def restore_file(rel_name, record):
+        size, mtime_ns, _, mode, chunk_ids = record
+        full_dst = f'{dst}/{rel_name}'
+        os.makedirs(os.path.dirname(full_dst), exist_ok=True)
+        with open(full_dst, 'wb') as write_file:
+            for chunk_id in chunk_ids:
+                write_file.write(get_chunk(store_fld, chunk_id))
+        os.chmod(full_dst, mode)
+        os.utime(full_dst, ns=(mtime_ns, mtime_ns))
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [
+            (rel_name, pool.submit(restore_file, rel_name, record))
+            for rel_name, record in snapshot['files'].items()
+        ]
+        for rel_name, future in futures:
+            try:
+                future.result()
+                yield rel_name, None
+            except Exception as exc:
+                yield rel_name, exc
@@ -1,22 +1,44 @@
+from .exclusions import compile_exclusions
+from . import stats
+from .profiler import traced
 from datetime import datetime
 from os.path import exists
 from uuid import uuid4
+import threading
 import random
-import subprocess
+import atexit
 import mimetypes
 import re
 import shutil
 import os
 import json
-import glob
 import json
 import sys
 import time
 
+# Common MIME types for archives
+archive_mime_types = [
+    "application/zip",
+    "application/x-tar",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/x-xz",
+    "application/zstd",
+]
+
 # Cached data
 
 settings = {}
 app_details = {}
+# Log files opened during the current execution, by log type
+log_handles = {}
+log_lock = threading.Lock()
+# Bytes of messages buffered before they are written to the log file
+LOG_BUFFER = 1 << 16
+# Set when a batch is interrupted, the backups being made stop at their next entry
+interrupted = threading.Event()
 
 # Getter functions
 
@@ -30,6 +52,14 @@ def get_setup_fld():
     return parent_dir
 
 
+def get_tmp_fld():
+    """
+    :return: text, the folder of the files shlerp writes for itself, like the rules history.
+    SHLERP_TMP can point it somewhere else than the installed package, the tests use it.
+    """
+    return os.environ.get('SHLERP_TMP') or f'{get_setup_fld()}/tmp'
+
+
 def get_app_details():
     global app_details
     if len(app_details) == 0:
@@ -101,14 +131,20 @@ def spinner_animation(stop_event, message):
     sys.stdout.write('\r')  # Clear the spinner line when done
 
 
-def remove_previous_line():
-    """ Removes the previous line from the terminal output and move the cursor"""
+def remove_previous_line(err=False):
+    """ Removes the previous line from the terminal output and move the cursor
+    :param err: boolean, True if the messages are printed on stderr instead of stdout
+    """
+    stream = sys.stderr if err else sys.stdout
+    if not stream.isatty():
+        # Redirected to a file or a pipe, every line is kept rather than filled with escape codes
+        return
     # Move the cursor up by one line
-    sys.stdout.write("\033[F")  # ANSI escape code: Move cursor up one line
+    stream.write("\033[F")  # ANSI escape code: Move cursor up one line
     # Clear the current line
-    sys.stdout.write("\033[K")  # ANSI escape code: Clear from cursor to the end of the line
+    stream.write("\033[K")  # ANSI escape code: Clear from cursor to the end of the line
     # Ensure output is flushed
-    sys.stdout.flush()
+    stream.flush()
 
 
 def iterate_log_name(log_name):
@@ -125,33 +161,55 @@ def iterate_log_name(log_name):
     return f'{base_name}-{integer}.{ext_chunk}'
 
 
-def log(msg, log_type):
-    get_settings()
-    log_fld = f'{os.path.expanduser("~")}/{settings["rel_logs_path"]}'
+def prune_log(log_path, max_age):
+    """Removes the entries older than max_age days from a log file
+    :param log_path: text, the path of the log file
+    :param max_age: number of days an entry is kept
+    """
+    with open(log_path, 'r') as prune_file:
+        lines = prune_file.readlines()
+    now = datetime.now()
+    first_valid = len(lines)
+    for index, line in enumerate(lines):
+        date_match = re.match(r"\[(.*?:)?(.*?):[a-z]+\]", line)
+        if not date_match:
+            # Continuation of a multi-line message, it goes with the entry before it
+            continue
+        str_date = date_match.group(2)
+        try:
+            date = datetime.strptime(str_date[0:8], '%Y%m%d')
+        except ValueError:
+            continue
+        if (now - date).days < max_age:
+            # The entries are in chronological order, everything after the first recent one is kept
+            first_valid = index
+            break
+    if first_valid:
+        # Then, overwrite the log file with the entries that are recent enough to be kept in the logs.
+        with open(log_path, 'w') as update_file:
+            update_file.writelines(lines[first_valid:])
+
+
+def resolve_log_file(log_fld, log_type):
+    """Finds the log file to write into, pruning or rotating the logs on the way
+    :param log_fld: text, the folder of the logs
+    :param log_type: text, "exec", "setup" or "uninstall"
+    :return: the path of the log file
+    """
     max_size = settings['logging']['no_prune']['max_log_size']
     max_age = settings['logging']['prune']['max_days']
     prune = settings['logging']['prune']['enabled']
 
-    filename = f'{log_type}.log'
-    log_file = None
-
-    os.makedirs(log_fld, mode=0o775, exist_ok=True)
-
+    log_file = f'{log_type}.log'
     log_files = [
         filename for filename in os.listdir(log_fld)
-        if log_type in filename
+        if log_type in filename and os.path.isfile(f'{log_fld}/{filename}')
     ]
 
     if prune:
         #####################
         # One log by log type
 
-        if len(log_files) == 0:
-            log_file = f'{log_type}.log'
-            abs_log_file = f'{log_fld}/{log_file}'
-            with open(abs_log_file, 'w+'):
-                pass
-
         if len(log_files) > 1:
             # If more than one log file by log type, place the old logs into an archive sub-folder.
             # Can happen if the program has been switched back to the default auto_prune mode.
@@ -160,40 +218,13 @@ def log(msg, log_type):
                 os.mkdir(old_logs_fld)
 
             # Then move all the logs to the old_logs folder
-            for log_file in log_files:
-                shutil.move(f'{log_fld}/{log_file}', f'{log_fld}/old_logs/{log_file}')
-
-            log_file = f'{log_fld}{log_type}.log'
+            for old_log in log_files:
+                shutil.move(f'{log_fld}/{old_log}', f'{old_logs_fld}/{old_log}')
 
         elif len(log_files) == 1:
             log_file = log_files[0]
-            # If only one log file, open the file in rw mode and prune the entries that are too old.
-            with open(f'{log_fld}/{log_files[0]}', 'r') as prune_file:
-                now = datetime.now()
-                valid_entries = []
-                prune = False
-                for index, line in enumerate(prune_file.readlines()):
-                    str_date = re.match(r"\[(.*?:)?(.*?):[a-z]+\]", line).group(2)
-                    year = str_date[0:4]
-                    month = str_date[4:6]
-                    day = str_date[6:8]
-                    date = datetime.strptime(f'{year}{month}{day}', '%Y%m%d')
-
-                    days = (now - date).days
-                    if days < max_age:
-                        if index == 1:  # If the first entry is valid, then we don't scan the rest of the file
-                            break
-                        # Else if the date is valid, add the line to the content that we'll write into the log
-                        valid_entries.append(line)
-                    else:
-                        prune = True
-
-                # Then, overwrite the log file with the entries that are recent enough to be kept in the logs.
-                if prune:
-                    with open(f'{log_fld}/{log_files[0]}', 'w') as update_file:
-                        update_file.truncate(0)
-                        for entry in valid_entries:
-                            update_file.write(entry)
+            # If only one log file, prune the entries that are too old.
+            prune_log(f'{log_fld}/{log_file}', max_age)
     else:
         #####################
         # Multiple logs
@@ -204,9 +235,6 @@ def log(msg, log_type):
             log_file = sorted(c_dates, reverse=True, key=lambda x: x[1])[0][0]  # sort by creation time
         elif len(log_files) == 1:
             log_file = log_files[0]
-        else:
-            # If no log file found, use the filename template to create a new one afterwards
-            log_file = filename
 
         # Then check the size of this log file
         if exists(f'{log_fld}/{log_file}'):
@@ -214,19 +242,99 @@ def log(msg, log_type):
             if log_size >= max_size:
                 log_file = iterate_log_name(log_file)
 
-    with open(f'{log_fld}/{log_file}', 'a+') as write_log:
+    return f'{log_fld}/{log_file}'
+
+
+# Called for every message, --profile only records one call out of 100
+@traced(every=100)
+def log(msg, log_type):
+    """Appends a message to the log. The log file is resolved, pruned or rotated once per execution,
+    the messages are then written through a buffered handle that is flushed on exit.
+    :param msg: text, the message to log
+    :param log_type: text, "exec", "setup" or "uninstall"
+    """
+    with log_lock:
+        write_log = log_handles.get(log_type)
+        if write_log is None:
+            log_fld = f'{os.path.expanduser("~")}/{get_settings()["rel_logs_path"]}'
+            os.makedirs(log_fld, mode=0o775, exist_ok=True)
+            write_log = open(resolve_log_file(log_fld, log_type), 'a', buffering=LOG_BUFFER)
+            log_handles[log_type] = write_log
         write_log.write(f'{msg}\n')
 
 
-def iglob_hidden(*args, **kwargs):
-    """A glob.iglob that include dot files and hidden files"""
-    """The credits goes to the user polyvertex for this function"""
-    old_ishidden = glob._ishidden
-    glob._ishidden = lambda x: False
-    try:
-        yield from glob.iglob(*args, **kwargs)
-    finally:
-        glob._ishidden = old_ishidden
+def flush_logs():
+    """Writes what the log handles still buffer, called on exit and on SIGINT"""
+    with log_lock:
+        for write_log in log_handles.values():
+            write_log.flush()
+
+
+atexit.register(flush_logs)
+
+
+def walk_kept(path, matcher=None, parts=()):
+    """Walks a folder with os.scandir, including hidden files, without ever entering the excluded folders.
+    The exclusion is decided for each entry as soon as it is listed, using the file type that
+    the folder listing already provides, so excluded subtrees are never read nor stat'ed.
+    Symbolic links to folders are listed but not followed.
+    :param path: text, the folder we want to walk through
+    :param matcher: ExclusionMatcher used to prune the entries, or None to keep everything
+    :param parts: tuple of the path components of the folder, relative to the project, when it isn't the project itself
+    :return: a generator of tuples (entry path, path relative to the project, is_dir)
+    """
+    stack = [(path, tuple(parts))]
+    while stack:
+        fld, parts = stack.pop()
+        try:
+            with os.scandir(fld) as iterator:
+                entries = list(iterator)
+        except OSError:
+            continue
+        sub_flds = []
+        excluded = 0
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if matcher and matcher.excluded_entry(parts, entry.name, is_dir):
+                excluded += 1
+                continue
+            yield entry.path, '/'.join(parts + (entry.name,)), is_dir
+            if is_dir and not entry.is_symlink():
+                sub_flds.append((entry.path, parts + (entry.name,)))
+        if excluded:
+            stats.add('excluded_entries', excluded)
+        # Reversed so that the folders are popped from the stack in their listing order
+        stack.extend(reversed(sub_flds))
+
+
+def interruptible(entries):
+    """Stops a walk as soon as the batch is interrupted
+    :param entries: iterable of tuples (path, relative path, is_dir)
+    :return: the same entries, KeyboardInterrupt is raised instead of the next one once interrupted is set
+    """
+    for entry in entries:
+        if interrupted.is_set():
+            raise KeyboardInterrupt
+        yield entry
+
+
+def count_entries(entries):
+    """Measures a list of entries, only their metadata is read
+    :param entries: iterable of tuples (path, relative path, is_dir)
+    :return: dictionary/object with the number of "files" and of "bytes"
+    """
+    files = size = 0
+    for elem_path, _, is_dir in entries:
+        if not is_dir:
+            try:
+                size += os.stat(elem_path).st_size
+                files += 1
+            except OSError:
+                pass
+    return {'files': files, 'bytes': size}
 
 
 def is_archive(file_path):
@@ -241,99 +349,47 @@ def is_archive(file_path):
     # Check the MIME type of the file
     mime_type, _ = mimetypes.guess_type(file_path)
 
-    # Common MIME types for archives
-    archive_mime_types = [
-        "application/zip",
-        "application/x-tar",
-        "application/x-gzip",
-        "application/x-bzip2",
-        "application/x-7z-compressed",
-        "application/x-rar-compressed",
-        "application/x-xz",
-    ]
-
     # Return True if the MIME type matches known archive types
     return mime_type in archive_mime_types
 
 
 def get_files(path, rules, options):
-    """Lists the files contained in a given folder
+    """Lists what has to be copied from a project folder, at every level.
+    The exclusions are applied to each entry as the tree is walked, so the excluded folders are never entered.
     :param path: String referring to the path that needs its content to be listed
     :param rules: List of rules containing exclusions
     :param options: dictionary/object containing exclusion options
-    :return: A list of files, without any possible node_modules folder
+    :return: A generator of tuples (path, path relative to the project, is_dir), folders coming before their content
     """
-    exclusions = {
-        "files": set(),
-        "folders": set(),
-        "dep_folders": set()
-    }
-
-    # Handle nogit option
-    if options['nogit']:
-        rules.append(
-            {
-                "actions": {
-                    "exclude": {
-                        "files": ['.git'],
-                        "folders": ['.gitignore']
-                    }
-                }
-            }
-        )
-
-    # Collect exclusions from all rules
-    for rule in rules:
-        if 'actions' in rule and 'exclude' in rule['actions']:
-            exclude = rule['actions']['exclude']
-            if 'files' in exclude:
-                exclusions['files'].update(exclude['files'])
-            if 'folders' in exclude:
-                exclusions['folders'].update(exclude['folders'])
-            if 'dep_folders' in exclude:
-                exclusions['dep_folders'].update(exclude['dep_folders'])
-
-    # If the noexcl option is set to True, we return all the files in the folder except the dependency folder
-    if options['noexcl']:
-        return [
-            file for file in os.listdir(path)
-            if (exclusions['dep_folders'] and file not in exclusions['dep_folders'])
-            or not exclusions['dep_folders']
-        ]
-
-    elem_list = []
+    # If the noexcl option is set to True, we keep everything except the dependency folders
+    matcher = compile_exclusions(rules, options, exclude_deps=True, root=path)
+
     for elem in os.listdir(path):
-        excl_matched = False
         elem_path = os.path.join(path, elem)
-
-        if any(dep_folder in elem_path for dep_folder in exclusions['dep_folders']):
-            excl_matched = True
-        if any(excl in elem_path for excl in exclusions['folders']):
-            excl_matched = True
-        if any(excl in elem_path for excl in exclusions['files']):
-            excl_matched = True
-
-        if not excl_matched:
-            if (
-                not options['keephidden'] and
-                elem.startswith('.') and
-                not (
-                    elem == '.git' or
-                    elem == '.gitignore'
-                )
-            ):
-                excl_matched = True
-
-        if not excl_matched:
-            elem_list.append(elem)
-
-    return elem_list
+        is_dir = os.path.isdir(elem_path)
+        if matcher.excluded_entry((), elem, is_dir):
+            stats.add('excluded_entries')
+            continue
+        if (
+            not options['noexcl'] and
+            not options['keephidden'] and
+            elem.startswith('.') and
+            not (
+                elem == '.git' or
+                elem == '.gitignore'
+            )
+        ):
+            stats.add('excluded_entries')
+            continue
+        yield elem_path, elem, is_dir
+        if is_dir and not os.path.islink(elem_path):
+            yield from walk_kept(elem_path, matcher, (elem,))
 
 
 def get_dependency_folders(rules):
     dep_folders = set()
     for rule in rules:
-        _dep_folders = rule['actions']['exclude']['dep_folders']
+        _dep_folders = rule.get('actions', {}).get('exclude', {}).get('dep_folders')
         if _dep_folders:
             for folder in _dep_folders:
                 dep_folders.add(folder)
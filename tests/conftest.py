@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def tmp_fld(tmp_path, monkeypatch):
+    """shlerp writes its rules history into a folder of the test, the shlerp processes started by the tests inherit it"""
+    tmp_fld = tmp_path / 'shlerp_tmp'
+    monkeypatch.setenv('SHLERP_TMP', str(tmp_fld))
+    return tmp_fld
+
+
+@pytest.fixture(autouse=True)
+def home(tmp_path_factory, monkeypatch):
+    """The logs of shlerp are written below the home folder, the tests keep them to themselves.
+    It is kept out of tmp_path, that the tests use as a project."""
+    home = tmp_path_factory.mktemp('home')
+    monkeypatch.setenv('HOME', str(home))
+    return home
@@ -0,0 +1,177 @@
+###############################################################
+# Tests of the archive writers: what is read back from a zip or
+# a tar stream must be what the project holds, whether the zip
+# members are compressed whole, in chunks or stored, whether the
+# archive is written to a file or streamed, and when a file
+# changes while it is archived.
+
+from shlerp.tools.archive import CHUNK_SIZE, open_archive
+from shlerp.tools import utils
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+import hashlib
+import tarfile
+import zipfile
+import pytest
+import random
+import io
+import os
+
+
+def make_project(root):
+    """Writes files of every kind the writers handle differently
+    :return: dictionary/object of {relative path: content}, None for the folders
+    """
+    rand = random.Random(0)
+    contents = {
+        'main.py': b'print(1)\n' * 100,
+        'empty.txt': b'',
+        'src/lib/util.py': b'def util():\n    return 1\n' * 50,
+        # Already compressed, stored as is
+        'assets/logo.png': bytes(rand.getrandbits(8) for _ in range(5000)),
+        # Compressed in several chunks, each primed with the end of the previous one
+        'data/big.csv': b''.join(b'%d,%d\n' % (index, index * 7) for index in range(400000)),
+        # Several chunks of random data, the probe stores them
+        'data/noise.bin': bytes(rand.getrandbits(8) for _ in range(CHUNK_SIZE + 12345)),
+    }
+    assert len(contents['data/big.csv']) > 2 * CHUNK_SIZE
+    for rel_path, content in contents.items():
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    (root / 'empty_folder').mkdir()
+    contents.update({'src': None, 'src/lib': None, 'assets': None, 'data': None, 'empty_folder': None})
+    return contents
+
+
+def write_archive(fileobj, fmt, proj_fld, jobs=4, level=None):
+    writer = open_archive(fileobj, fmt, level, jobs)
+    results = list(writer.write(utils.walk_kept(str(proj_fld))))
+    writer.add_bytes('.shlerp_deleted', b'gone.txt')
+    writer.close()
+    return results
+
+
+def check_results(results, contents):
+    assert [error for _, _, error, _ in results if error] == []
+    assert sorted(arcname for arcname, _, _, _ in results) == sorted(contents)
+    for arcname, is_dir, _, digest in results:
+        assert is_dir == (contents[arcname] is None)
+        if not is_dir:
+            assert digest == hashlib.sha256(contents[arcname]).hexdigest()
+
+
+def check_zip(read_archive, contents):
+    assert read_archive.testzip() is None
+    members = {info.filename: info for info in read_archive.infolist()}
+    assert sorted(members) == sorted(
+        [name + '/' if content is None else name for name, content in contents.items()] + ['.shlerp_deleted']
+    )
+    for name, content in contents.items():
+        if content is not None:
+            assert read_archive.read(name) == content
+    assert members['assets/logo.png'].compress_type == zipfile.ZIP_STORED
+    assert members['data/noise.bin'].compress_type == zipfile.ZIP_STORED
+    assert members['data/big.csv'].compress_type == zipfile.ZIP_DEFLATED
+    assert members['data/big.csv'].compress_size < len(contents['data/big.csv']) // 2
+    assert read_archive.read('.shlerp_deleted') == b'gone.txt'
+
+
+class Unseekable(io.RawIOBase):
+    """Stands for a pipe: the archive can only be written forward"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def test_zip_round_trip(tmp_path):
+    proj_fld = tmp_path / 'project'
+    contents = make_project(proj_fld)
+    archive_path = tmp_path / 'project.zip'
+    with open(archive_path, 'wb') as archive_file:
+        results = write_archive(archive_file, 'zip', proj_fld)
+    check_results(results, contents)
+    with zipfile.ZipFile(archive_path) as read_archive:
+        check_zip(read_archive, contents)
+
+
+def test_streamed_zip_round_trip(tmp_path):
+    # The sizes of the chunked members are written after their data, in data descriptors
+    proj_fld = tmp_path / 'project'
+    contents = make_project(proj_fld)
+    stream = Unseekable()
+    check_results(write_archive(stream, 'zip', proj_fld), contents)
+    with zipfile.ZipFile(io.BytesIO(bytes(stream.data))) as read_archive:
+        check_zip(read_archive, contents)
+
+
+def test_zip_member_errors_leave_a_valid_archive(tmp_path):
+    proj_fld = tmp_path / 'project'
+    contents = make_project(proj_fld)
+    os.mkfifo(proj_fld / 'pipe')
+    archive_path = tmp_path / 'project.zip'
+    with open(archive_path, 'wb') as archive_file:
+        results = write_archive(archive_file, 'zip', proj_fld, jobs=2)
+    assert [arcname for arcname, _, error, _ in results if error] == ['pipe']
+    with zipfile.ZipFile(archive_path) as read_archive:
+        check_zip(read_archive, contents)
+
+
+def read_tar(archive_path):
+    with tarfile.open(archive_path) as read_archive:
+        return {
+            member.name: read_archive.extractfile(member).read() if member.isreg() else None
+            for member in read_archive.getmembers()
+        }
+
+
+@pytest.mark.parametrize('fmt', [
+    'tar.gz', 'tar.xz',
+    pytest.param('tar.zst', marks=pytest.mark.skipif(not zstandard, reason='zstandard is not installed'))
+])
+def test_tar_round_trip(tmp_path, fmt):
+    proj_fld = tmp_path / 'project'
+    contents = make_project(proj_fld)
+    archive_path = tmp_path / f'project.{fmt}'
+    with open(archive_path, 'wb') as archive_file:
+        # The content is what is checked, not the compression ratio
+        results = write_archive(archive_file, fmt, proj_fld, jobs=2, level=1)
+    check_results(results, contents)
+    if fmt == 'tar.zst':
+        with open(archive_path, 'rb') as read_file:
+            archive_path = tmp_path / 'project.tar'
+            archive_path.write_bytes(zstandard.ZstdDecompressor().stream_reader(read_file).read())
+    assert read_tar(archive_path) == dict(contents, **{'.shlerp_deleted': b'gone.txt'})
+
+
+def test_tar_stream_survives_a_shrinking_file(tmp_path, monkeypatch):
+    proj_fld = tmp_path / 'project'
+    contents = make_project(proj_fld)
+    archive_path = tmp_path / 'project.tar.gz'
+    gettarinfo = tarfile.TarFile.gettarinfo
+
+    def shrinking_gettarinfo(self, name, arcname=None, fileobj=None):
+        tarinfo = gettarinfo(self, name, arcname, fileobj)
+        if arcname == 'src/lib/util.py':
+            # Truncated between the header and the data
+            os.truncate(name, 10)
+        return tarinfo
+    monkeypatch.setattr(tarfile.TarFile, 'gettarinfo', shrinking_gettarinfo)
+    with open(archive_path, 'wb') as archive_file:
+        results = write_archive(archive_file, 'tar.gz', proj_fld)
+    assert [arcname for arcname, _, error, _ in results if error] == ['src/lib/util.py']
+
+    members = read_tar(archive_path)
+    original = contents['src/lib/util.py']
+    assert members.pop('src/lib/util.py') == original[:10] + bytes(len(original) - 10)
+    contents.pop('src/lib/util.py')
+    assert members == dict(contents, **{'.shlerp_deleted': b'gone.txt'})
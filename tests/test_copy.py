@@ -0,0 +1,154 @@
+###############################################################
+# Tests of the copy engine of duplicate: a copy holds the same
+# content and metadata as the project, whichever strategy the
+# kernel supports.
+
+from shlerp.tools import copy as copier
+from shlerp.tools import utils
+import shutil
+import random
+import os
+import pytest
+
+
+def make_project(root):
+    (root / 'src' / 'empty').mkdir(parents=True)
+    (root / 'main.py').write_text('print(1)\n')
+    (root / 'empty.txt').write_bytes(b'')
+    (root / 'src' / 'data.bin').write_bytes(random.Random(0).getrandbits(8 * (3 << 20)).to_bytes(3 << 20, 'little'))
+    (root / 'run.sh').write_text('#!/bin/sh\n')
+    (root / 'run.sh').chmod(0o755)
+    os.utime(root / 'main.py', ns=(1_000_000_000, 1_000_000_000))
+
+
+def read_tree(root):
+    """
+    :return: dictionary/object of {relative path: (content, mode, mtime_ns)} for the files,
+    the target of the links and None for the folders
+    """
+    tree = {}
+    for elem_path, rel_name, is_dir in utils.walk_kept(str(root)):
+        if os.path.islink(elem_path):
+            tree[rel_name] = os.readlink(elem_path)
+        elif is_dir:
+            tree[rel_name] = None
+        else:
+            with open(elem_path, 'rb') as read_file:
+                stat = os.stat(elem_path)
+                tree[rel_name] = (read_file.read(), stat.st_mode & 0o7777, stat.st_mtime_ns)
+    return tree
+
+
+def copy_project(proj_fld, dst, **kwargs):
+    """
+    :return: dictionary/object of {relative path: (error, strategy)}
+    """
+    dst.mkdir(exist_ok=kwargs.get('mirror', False))
+    return {
+        rel_name: (error, strategy)
+        for rel_name, _, error, strategy in copier.copy_tree(utils.walk_kept(str(proj_fld)), str(dst), 4, **kwargs)
+    }
+
+
+@pytest.mark.parametrize('strategy', [name for name, _ in copier.STRATEGIES])
+def test_copy_is_identical(tmp_path, monkeypatch, strategy):
+    proj_fld = tmp_path / 'project'
+    make_project(proj_fld)
+    # Each strategy is tried on its own, with the buffered copy as the fallback that is always there
+    monkeypatch.setattr(copier, 'STRATEGIES', [item for item in copier.STRATEGIES if item[0] in (strategy, 'buffered')])
+    monkeypatch.setattr(copier, 'unsupported', {})
+    results = copy_project(proj_fld, tmp_path / 'copy')
+    assert [error for error, _ in results.values() if error] == []
+    assert read_tree(tmp_path / 'copy') == read_tree(proj_fld)
+    strategies = {strategy for rel_name, (_, strategy) in results.items() if strategy}
+    if strategies != {strategy}:
+        assert strategies == {'buffered'}
+        pytest.skip(f'{strategy} is not supported by this filesystem')
+
+
+def test_special_files_are_reported(tmp_path):
+    proj_fld = tmp_path / 'project'
+    make_project(proj_fld)
+    expected = read_tree(proj_fld)
+    # Opening a named pipe would block until something writes into it
+    os.mkfifo(proj_fld / 'pipe')
+    results = copy_project(proj_fld, tmp_path / 'copy')
+    assert isinstance(results.pop('pipe')[0], shutil.SpecialFileError)
+    assert [error for error, _ in results.values() if error] == []
+    assert read_tree(tmp_path / 'copy') == expected
+
+
+def test_unchanged_files_are_linked_to_the_previous_copy(tmp_path):
+    proj_fld = tmp_path / 'project'
+    make_project(proj_fld)
+    copy_project(proj_fld, tmp_path / 'first')
+    (proj_fld / 'main.py').write_text('print(2)\n')
+    (proj_fld / 'src' / 'new.py').write_text('print(3)\n')
+    results = copy_project(proj_fld, tmp_path / 'second', link_dest=str(tmp_path / 'first'))
+    assert [error for error, _ in results.values() if error] == []
+    assert {rel_name for rel_name, (_, strategy) in results.items() if strategy == 'hardlink'} == {
+        'empty.txt', 'src/data.bin', 'run.sh'
+    }
+    for rel_name in ('empty.txt', 'src/data.bin', 'run.sh'):
+        assert os.path.samefile(tmp_path / 'first' / rel_name, tmp_path / 'second' / rel_name)
+    assert not os.path.samefile(tmp_path / 'first' / 'main.py', tmp_path / 'second' / 'main.py')
+    assert read_tree(tmp_path / 'second') == read_tree(proj_fld)
+    assert (tmp_path / 'first' / 'main.py').read_text() == 'print(1)\n'
+
+
+def test_previous_copy_is_found_by_name(tmp_path):
+    for name in ('project_20240101#120000', 'project_20240301#120000', 'project_old_20240401#120000', 'other_20240501#120000'):
+        (tmp_path / name).mkdir()
+    (tmp_path / 'project_20240401#120000').write_text('not a folder')
+    assert copier.find_previous_copy(str(tmp_path / 'project_20240601#120000')) == str(tmp_path / 'project_20240301#120000')
+    assert copier.find_previous_copy(str(tmp_path / 'new_20240601#120000')) is None
+
+
+def test_mirror_only_copies_changes_and_deletes_the_rest(tmp_path):
+    proj_fld, mirror_fld = tmp_path / 'project', tmp_path / 'mirror'
+    make_project(proj_fld)
+    copy_project(proj_fld, mirror_fld, mirror=True)
+    assert read_tree(mirror_fld) == read_tree(proj_fld)
+
+    (proj_fld / 'main.py').write_text('print(2)\n')
+    (proj_fld / 'src' / 'data.bin').unlink()
+    (proj_fld / 'src' / 'empty').rmdir()
+    (proj_fld / 'run.sh').unlink()
+    # A file becomes a folder
+    (proj_fld / 'run.sh').mkdir()
+    (proj_fld / 'run.sh' / 'inner.txt').write_text('inner\n')
+    (mirror_fld / 'stray').mkdir()
+    (mirror_fld / 'stray' / 'left.txt').write_text('left\n')
+    results = copy_project(proj_fld, mirror_fld, mirror=True)
+    assert [error for error, _ in results.values() if error] == []
+    assert results['empty.txt'][1] == 'unchanged'
+    assert {rel_name for rel_name, (_, strategy) in results.items() if strategy == 'deleted'} == {
+        'src/data.bin', 'src/empty', 'stray'
+    }
+    assert read_tree(mirror_fld) == read_tree(proj_fld)
+
+
+def test_mirror_replaces_a_folder_by_a_linked_folder(tmp_path):
+    proj_fld, mirror_fld = tmp_path / 'project', tmp_path / 'mirror'
+    make_project(proj_fld)
+    (proj_fld / 'lib').mkdir()
+    (proj_fld / 'lib' / 'util.py').write_text('x = 1\n')
+    copy_project(proj_fld, mirror_fld, mirror=True)
+    assert not os.path.islink(mirror_fld / 'lib')
+
+    shutil.rmtree(proj_fld / 'lib')
+    os.symlink('src', proj_fld / 'lib')
+    for _ in range(2):
+        # The second sync finds the link already in place
+        results = copy_project(proj_fld, mirror_fld, mirror=True)
+        assert [error for error, _ in results.values() if error] == []
+        assert os.readlink(mirror_fld / 'lib') == 'src'
+        assert read_tree(mirror_fld) == read_tree(proj_fld)
+
+    # And back to a real folder
+    os.remove(proj_fld / 'lib')
+    (proj_fld / 'lib').mkdir()
+    results = copy_project(proj_fld, mirror_fld, mirror=True)
+    assert [error for error, _ in results.values() if error] == []
+    assert not os.path.islink(mirror_fld / 'lib')
+    assert read_tree(mirror_fld) == read_tree(proj_fld)
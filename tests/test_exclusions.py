@@ -0,0 +1,112 @@
+###############################################################
+# Tests of the exclusions shared by the scan, the copies and the
+# archives, and of the detection that scores every rule from a
+# single walk of the project.
+
+from shlerp.tools.exclusions import ExclusionMatcher, compile_exclusions
+from shlerp.tools.state import activate_headless
+from shlerp.tools import utils
+from shlerp.main import auto_detect
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def headless():
+    activate_headless()
+
+
+def write_files(root, *rel_paths):
+    for rel_path in rel_paths:
+        path = root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('x\n')
+
+
+def kept_paths(root, matcher):
+    return sorted(rel_path for _, rel_path, _ in utils.walk_kept(str(root), matcher))
+
+
+def test_whole_components_are_excluded():
+    matcher = ExclusionMatcher(files=['.env'], folders=['vendor', 'storage/logs'])
+    assert matcher.excluded('vendor', True)
+    assert matcher.excluded('lib/vendor/autoload.php')
+    assert not matcher.excluded('myvendorlib/autoload.php')
+    assert not matcher.excluded('vendor')
+    assert matcher.excluded('app/.env')
+    assert not matcher.excluded('app/.env.example')
+    assert matcher.excluded('storage/logs/today.log')
+    assert matcher.excluded('app/storage/logs', True)
+    assert not matcher.excluded('storage/app/logs.txt')
+    assert not matcher.excluded('logs/storage', True)
+
+
+def test_entries_are_decided_like_paths():
+    matcher = ExclusionMatcher(files=['.env'], folders=['vendor', 'storage/logs'])
+    for parts, name, is_dir in (
+        ((), 'vendor', True),
+        ((), 'vendor', False),
+        (('lib',), 'vendor', True),
+        (('storage',), 'logs', True),
+        (('app', 'storage'), 'logs', True),
+        (('storage',), 'logs', False),
+        (('app',), '.env', False),
+        ((), 'myvendorlib', True)
+    ):
+        assert matcher.excluded_entry(parts, name, is_dir) == matcher.excluded('/'.join(parts + (name,)), is_dir)
+
+
+def test_rule_exclusions_are_merged():
+    rules = [
+        {'actions': {'exclude': {'files': ['out.log'], 'folders': ['dist'], 'dep_folders': ['node_modules']}}},
+        {'actions': {'exclude': {'files': [], 'folders': ['build'], 'dep_folders': None}}}
+    ]
+    matcher = compile_exclusions(rules, {})
+    assert matcher.excluded('a/out.log') and matcher.excluded('dist', True) and matcher.excluded('build', True)
+    assert matcher.excluded('node_modules', True) and matcher.excluded('.DS_Store')
+
+    # Without the exclusions, the dependencies are still left out of the copies when asked
+    keep_all = compile_exclusions(rules, {'noexcl': True}, exclude_deps=True)
+    assert keep_all.excluded('node_modules', True)
+    assert not keep_all.excluded('dist', True) and not keep_all.excluded('a/out.log')
+    assert not compile_exclusions(rules, {'noexcl': True}).excluded('node_modules', True)
+
+    no_git = compile_exclusions([], {'nogit': True})
+    assert no_git.excluded('.git', True) and no_git.excluded('.gitignore')
+
+
+def test_walk_never_enters_excluded_folders(tmp_path):
+    write_files(
+        tmp_path, 'main.py', 'vendor/a.php', 'lib/vendor/b.php', 'myvendorlib/c.php',
+        'storage/logs/today.log', 'storage/app/d.txt', '.hidden/e.txt'
+    )
+    matcher = ExclusionMatcher(folders=['vendor', 'storage/logs'])
+    assert kept_paths(tmp_path, matcher) == [
+        '.hidden', '.hidden/e.txt', 'lib', 'main.py', 'myvendorlib', 'myvendorlib/c.php',
+        'storage', 'storage/app', 'storage/app/d.txt'
+    ]
+
+
+def test_gitignore_is_applied_per_folder(tmp_path):
+    write_files(tmp_path, 'keep.py', 'debug.log', 'sub/keep.log', 'sub/drop.tmp', 'build/out.o')
+    (tmp_path / '.gitignore').write_text('*.log\nbuild/\n')
+    (tmp_path / 'sub' / '.gitignore').write_text('*.tmp\n!keep.log\n')
+    matcher = compile_exclusions([], {'gitignore': True}, root=str(tmp_path))
+    assert kept_paths(tmp_path, matcher) == ['.gitignore', 'keep.py', 'sub', 'sub/.gitignore', 'sub/keep.log']
+
+
+def test_detection_scores_from_one_walk(tmp_path):
+    write_files(tmp_path, 'app.py', 'lib/util.py', 'migrations/env.py', 'instance/config.py')
+    (tmp_path / 'requirements.txt').write_text('flask==3.0\n')
+    # Dependencies and hidden folders don't say what the project is made of
+    write_files(tmp_path, *[f'node_modules/pkg/f{index}.js' for index in range(10)])
+    write_files(tmp_path, *[f'.cache/f{index}.js' for index in range(10)])
+    rules = auto_detect(str(tmp_path))
+    assert [rule['name'] for rule in rules] == ['Flask', 'Python']
+    assert rules[1]['total'] == 2
+
+
+def test_dependencies_are_not_scored(tmp_path):
+    write_files(tmp_path, 'src/a.js', 'src/b.ts', 'src/c.jsx', 'tools/d.py')
+    write_files(tmp_path, *[f'node_modules/pkg/f{index}.py' for index in range(10)])
+    rules = auto_detect(str(tmp_path))
+    assert {rule['name']: rule['total'] for rule in rules} == {'Python': 0.5, 'Javascript': 1.5}
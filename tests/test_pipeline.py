@@ -0,0 +1,200 @@
+###############################################################
+# Tests of the pipelined batch: the uploads overlap with the
+# backups of the next projects, and an interrupted batch stops
+# all its stages and exits, then is resumed. shlerp runs in its
+# own process, the uploads go to a local stand-in of file.io.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from shlerp.tools.state import activate_headless
+from shlerp.tools.utils import get_settings
+from shlerp.tools import journal
+from shlerp.main import open_journal
+import subprocess
+import pytest
+import zipfile
+import threading
+import base64
+import signal
+import json
+import time
+import sys
+import os
+
+REPO_FLD = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+JOURNAL_NAME = '.shlerp_journal.json'
+
+
+def make_projects(src_fld, count, files, size):
+    """Writes python projects made of files that take a while to compress"""
+    for index in range(count):
+        proj_fld = src_fld / f'p{index}'
+        (proj_fld / 'src').mkdir(parents=True)
+        (proj_fld / 'main.py').write_text('print(1)\n')
+        for file_index in range(files):
+            (proj_fld / 'src' / f'f{file_index}.txt').write_bytes(base64.b64encode(os.urandom(size)))
+
+
+def start_shlerp(code, *args):
+    return subprocess.Popen(
+        [sys.executable, '-c', code, *args], cwd=REPO_FLD,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+
+
+def read_journal(out_fld):
+    try:
+        with open(out_fld / JOURNAL_NAME, 'r') as read_journal_file:
+            return json.load(read_journal_file)
+    except (OSError, ValueError):
+        return None
+
+
+def read_logs(home):
+    log_fld = home / get_settings()['rel_logs_path']
+    return ''.join(path.read_text() for path in log_fld.rglob('*') if path.is_file())
+
+
+@pytest.mark.parametrize('batch_jobs', [1, 2])
+def test_interrupted_batch_exits(tmp_path, home, batch_jobs):
+    src_fld, out_fld = tmp_path / 'src', tmp_path / 'out'
+    out_fld.mkdir()
+    make_projects(src_fld, 5, 200, 40000)
+    shlerp = start_shlerp(
+        'from shlerp.bin.shlerp import main; main()', '-t', str(src_fld), '-o', str(out_fld), '-b', '-a', '-hl',
+        '-bj', str(batch_jobs)
+    )
+
+    # Interrupted while a project is being archived
+    deadline = time.time() + 60
+    while time.time() < deadline and shlerp.poll() is None:
+        journal = read_journal(out_fld)
+        if journal and any(entry['state'] == 'backing_up' for entry in journal['projects'].values()):
+            break
+        time.sleep(0.02)
+    assert shlerp.poll() is None, 'the batch ended before it could be interrupted'
+    shlerp.send_signal(signal.SIGINT)
+    try:
+        output, _ = shlerp.communicate(timeout=10)
+    except subprocess.TimeoutExpired:
+        shlerp.kill()
+        shlerp.communicate()
+        raise AssertionError('the batch kept running after SIGINT')
+
+    assert shlerp.returncode != 0
+    assert 'Traceback' not in output and 'Exception ignored' not in output, output
+    # The installed command tells how to carry on, in the log since the batch is headless
+    assert '--resume' in read_logs(home)
+    journal = read_journal(out_fld)
+    outputs = os.listdir(out_fld)
+    for proj_fld, entry in journal['projects'].items():
+        if entry['state'] == 'scanned':
+            # The backups stopped, the projects waiting for them were never archived
+            assert not any(name.startswith(os.path.basename(proj_fld) + '_') for name in outputs)
+    # Only the backups that had started are in progress
+    assert 1 <= [entry['state'] for entry in journal['projects'].values()].count('backing_up') <= batch_jobs
+
+    # The resumed batch removes the partial archive, backs up what is left, then deletes the journal
+    resumed = start_shlerp(
+        'from shlerp.bin.shlerp import main; main()', '-t', str(src_fld), '-o', str(out_fld), '-b', '-a', '-hl',
+        '-bj', str(batch_jobs), '--resume'
+    )
+    output, _ = resumed.communicate(timeout=120)
+    assert resumed.returncode == 0, output
+    assert read_journal(out_fld) is None
+    archives = list(out_fld.glob('*.zip'))
+    assert len(archives) == 5
+    for archive_path in archives:
+        with zipfile.ZipFile(archive_path) as read_archive:
+            assert read_archive.testzip() is None
+
+
+def test_headless_batch_logs_a_summary_per_project(tmp_path, home):
+    src_fld, out_fld = tmp_path / 'src', tmp_path / 'out'
+    out_fld.mkdir()
+    make_projects(src_fld, 2, 20, 1000)
+    for args in ((), ('-v',)):
+        shlerp = start_shlerp(
+            'from shlerp.bin.shlerp import main; main()', '-t', str(src_fld), '-o', str(out_fld), '-b', '-a', '-hl', *args
+        )
+        output, _ = shlerp.communicate(timeout=60)
+        assert shlerp.returncode == 0, output
+    first, verbose = read_logs(home).split('Successful: 2')[:2]
+    assert first.count('Project archived') == 2
+    assert 'Added:' not in first
+    # Only --verbose logs a line per member: main.py, src/ and its 20 files
+    assert verbose.count('Added:') == 2 * 22
+
+
+def test_only_resume_removes_partial_outputs(tmp_path):
+    activate_headless()
+    src_fld, out_fld = tmp_path / 'src', tmp_path / 'out'
+    out_fld.mkdir()
+    settings = {'output': str(out_fld), 'upload': False, 'use_store': False, 'archive': True, 'options': {'format': 'zip'}}
+    interrupted, failed = out_fld / 'p0_interrupted.zip', out_fld / 'p1_failed.zip'
+
+    def leave_journal():
+        jrnl = open_journal(str(src_fld), settings, False)
+        for proj_name, output_path, project_state in (('p0', interrupted, journal.BACKING_UP), ('p1', failed, journal.FAILED)):
+            output_path.write_bytes(b'partial')
+            journal.record(jrnl['path'], jrnl['journal'], str(src_fld / proj_name), project_state, outputs=[str(output_path)])
+
+    # A batch that doesn't resume leaves the outputs of the previous one alone
+    leave_journal()
+    open_journal(str(src_fld), settings, False)
+    assert interrupted.exists() and failed.exists()
+
+    # Only the output cut short by the interruption is removed, a failed one is kept for inspection
+    leave_journal()
+    jrnl = open_journal(str(src_fld), settings, True)
+    assert not interrupted.exists() and failed.exists()
+    assert {entry['state'] for entry in jrnl['journal']['projects'].values()} == {journal.FAILED}
+
+
+class UploadStandIn(BaseHTTPRequestHandler):
+    """Answers like file.io. The first upload is held until the archive of another project has been written,
+    which only happens if the backups go on while an upload is running."""
+    out_fld = None
+    uploads = []
+    overlapped = None
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if not self.uploads:
+            deadline = time.time() + 15
+            while time.time() < deadline and len(list(self.out_fld.glob('*.manifest.json'))) < 2:
+                time.sleep(0.02)
+            UploadStandIn.overlapped = len(list(self.out_fld.glob('*.manifest.json'))) >= 2
+        self.uploads.append(time.time())
+        body = json.dumps({'success': True, 'link': 'http://localhost/file', 'expires': '2099-01-01T00:00:00.000Z'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def test_uploads_overlap_backups(tmp_path):
+    src_fld, out_fld = tmp_path / 'src', tmp_path / 'out'
+    out_fld.mkdir()
+    make_projects(src_fld, 3, 5, 1000)
+    UploadStandIn.out_fld = out_fld
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UploadStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # The entry point refuses --upload, the command is called directly with the stand-in as endpoint
+        shlerp = start_shlerp(
+            'import sys; from shlerp.tools.utils import get_settings; '
+            'get_settings()["upload_default"]["url"] = sys.argv[1]; '
+            'from shlerp.main import main; main(sys.argv[2:])',
+            f'http://127.0.0.1:{server.server_port}',
+            '-t', str(src_fld), '-o', str(out_fld), '-b', '-u', '1d', '-hl'
+        )
+        output, _ = shlerp.communicate(timeout=60)
+    finally:
+        server.shutdown()
+
+    assert shlerp.returncode == 0, output
+    assert len(UploadStandIn.uploads) == 3
+    assert UploadStandIn.overlapped, 'no archive has been written while the first upload was running'
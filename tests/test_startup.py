@@ -0,0 +1,74 @@
+###############################################################
+# Tests of the startup of shlerp. cron runs it once per project,
+# so what its entry point loads is paid on every run: the
+# modules only some options need must stay out of the startup,
+# the config files must only be read once, and the startup must
+# stay within the budget the benchmarks check.
+
+from benchmarks.run import STARTUP_BUDGET, bench_startup
+import subprocess
+import json
+import sys
+import os
+
+REPO_FLD = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Only loaded by --upload, --profile and the parallel batches
+LAZY_MODULES = ['requests', 'pytz', 'cProfile', 'pstats', 'concurrent.futures.process']
+CONFIG_FILES = ['settings.json', 'app_details.json']
+# The budget is meant for a quiet machine, the tests may run on a loaded one
+BUDGET_MARGIN = 3
+
+# Runs the entry point with the given arguments, then prints what has been loaded and read on the last line
+STARTUP_CODE = '''
+import builtins, json, sys
+opened = []
+builtin_open = builtins.open
+def recording_open(file, *args, **kwargs):
+    opened.append(str(file))
+    return builtin_open(file, *args, **kwargs)
+builtins.open = recording_open
+sys.argv = ['shlerp'] + sys.argv[1:]
+from shlerp.bin.shlerp import main
+try:
+    main()
+except SystemExit:
+    pass
+print(json.dumps({'modules': sorted(sys.modules), 'opened': opened}))
+'''
+
+
+def run_startup(*args):
+    completed = subprocess.run(
+        [sys.executable, '-c', STARTUP_CODE, *args], cwd=REPO_FLD, capture_output=True, text=True, timeout=60
+    )
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def check_startup(loaded):
+    for module in LAZY_MODULES:
+        assert module not in loaded['modules'], f'{module} is loaded at startup'
+    for config_file in CONFIG_FILES:
+        reads = [path for path in loaded['opened'] if os.path.basename(path) == config_file]
+        assert len(reads) <= 1, f'{config_file} is read {len(reads)} times'
+
+
+def test_help_startup():
+    check_startup(run_startup('--help'))
+
+
+def test_copy_startup(tmp_path):
+    proj_fld, out_fld = tmp_path / 'project', tmp_path / 'out'
+    proj_fld.mkdir()
+    out_fld.mkdir()
+    (proj_fld / 'main.py').write_text('print(1)\n')
+    loaded = run_startup('-t', str(proj_fld), '-o', str(out_fld), '-hl')
+    check_startup(loaded)
+    assert len(os.listdir(out_fld)) == 1
+
+
+def test_startup_budget(tmp_path):
+    # The fastest of a few runs, like the benchmarks
+    for command, measures in bench_startup(str(tmp_path), 3).items():
+        assert measures['seconds'] <= STARTUP_BUDGET[command] * BUDGET_MARGIN, \
+            f'shlerp took {measures["seconds"]}s to {command}, the budget is {STARTUP_BUDGET[command]}s'
@@ -0,0 +1,100 @@
+###############################################################
+# Tests of the deduplicating store: the chunks only depend on
+# the content, a project restored from a snapshot is the one
+# that was backed up, and unchanged data is never written twice.
+
+from shlerp.tools import store
+import subprocess
+import random
+import sys
+import io
+import os
+
+REPO_FLD = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class SmallReads(io.BytesIO):
+    """Stands for a file read in small pieces, like a pipe"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 1000) if size > 0 else 1000)
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def run_shlerp(*args):
+    completed = subprocess.run(
+        [sys.executable, '-c', 'from shlerp.bin.shlerp import main; main()', *args, '-hl'],
+        cwd=REPO_FLD, capture_output=True, text=True, timeout=60
+    )
+    assert completed.returncode == 0, completed.stdout + completed.stderr
+
+
+def read_tree(root):
+    """
+    :return: dictionary/object of {relative path: (content, mode, mtime_ns)}, None for the folders
+    """
+    tree = {}
+    for fld, dirs, files in os.walk(root):
+        for name in dirs:
+            tree[os.path.relpath(os.path.join(fld, name), root)] = None
+        for name in files:
+            path = os.path.join(fld, name)
+            with open(path, 'rb') as read_file:
+                stat = os.stat(path)
+                tree[os.path.relpath(path, root)] = (read_file.read(), stat.st_mode & 0o7777, stat.st_mtime_ns)
+    return tree
+
+
+def test_chunks_only_depend_on_the_content():
+    text = b''.join(b'line %d of the file\n' % index for index in range(500000))
+    for data in (text, random_bytes(6 << 20, 0)):
+        chunks = list(store.iter_chunks(io.BytesIO(data)))
+        assert b''.join(chunks) == data
+        assert len(chunks) > 2
+        assert all(len(chunk) <= store.MAX_CHUNK for chunk in chunks)
+        assert all(len(chunk) >= store.MIN_CHUNK for chunk in chunks[:-1])
+        assert list(store.iter_chunks(SmallReads(data))) == chunks
+
+
+def test_insertion_only_changes_the_chunks_around_it():
+    data = random_bytes(8 << 20, 1)
+    changed = data[:3 << 20] + b'inserted' + data[3 << 20:]
+    before = list(store.iter_chunks(io.BytesIO(data)))
+    after = list(store.iter_chunks(io.BytesIO(changed)))
+    assert len(set(after) - set(before)) <= 2
+
+
+def test_store_and_restore_round_trip(tmp_path):
+    proj_fld, out_fld = tmp_path / 'project', tmp_path / 'out'
+    (proj_fld / 'src' / 'empty').mkdir(parents=True)
+    out_fld.mkdir()
+    (proj_fld / 'main.py').write_text('print(1)\n')
+    (proj_fld / 'empty.txt').write_bytes(b'')
+    (proj_fld / 'src' / 'data.bin').write_bytes(random_bytes(5 << 20, 2))
+    (proj_fld / 'src' / 'copy.bin').write_bytes((proj_fld / 'src' / 'data.bin').read_bytes())
+    (proj_fld / 'run.sh').write_text('#!/bin/sh\n')
+    (proj_fld / 'run.sh').chmod(0o755)
+    store_fld = out_fld / store.STORE_NAME
+
+    run_shlerp('-t', str(proj_fld), '-o', str(out_fld), '--store')
+    chunks = sorted(path for path in (store_fld / 'chunks').rglob('*') if path.is_file())
+    # The two identical files share their chunks
+    stored = sum(path.stat().st_size for path in chunks)
+    assert stored < 6 << 20
+
+    # Only what changed is written by the next snapshot
+    (proj_fld / 'main.py').write_text('print(2)\n')
+    run_shlerp('-t', str(proj_fld), '-o', str(out_fld), '--store')
+    assert len([path for path in (store_fld / 'chunks').rglob('*') if path.is_file()]) == len(chunks) + 1
+    names = [path.name for path in (store_fld / 'snapshots').glob('*.json')]
+    latest = store.latest_snapshot(str(store_fld), str(proj_fld))
+    assert len(names) == 2 and latest['base'] in names and latest['name'] in names and latest['base'] != latest['name']
+
+    restore_fld = tmp_path / 'restored'
+    restore_fld.mkdir()
+    run_shlerp('--restore', str(store_fld / 'snapshots' / latest['name']), '-o', str(restore_fld))
+    restored = restore_fld / latest['name'][:-len(store.SNAPSHOT_EXT)]
+    assert read_tree(restored) == read_tree(proj_fld)